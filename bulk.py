@@ -0,0 +1,116 @@
+import os
+from typing import Any, Dict, List, Optional
+
+from fastapi import HTTPException
+from pydantic import BaseModel, ValidationError
+
+from db_async import ASYNC_DB_ERRORS
+
+BULK_MAX_ITEMS = int(os.getenv("BULK_MAX_ITEMS", "500"))
+
+
+class BulkItemResult(BaseModel):
+    # Posición del elemento en la petición y resultado de la operación sobre él
+    index: int
+    ok: bool
+    id: Optional[int] = None
+    error: Optional[str] = None
+
+
+class BulkResponse(BaseModel):
+    succeeded: int
+    failed: int
+    results: List[BulkItemResult]
+
+
+class BulkIds(BaseModel):
+    ids: List[int]
+
+
+def check_size(items):
+    if not items:
+        raise HTTPException(status_code=400, detail="La lista está vacía")
+    if len(items) > BULK_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"Máximo {BULK_MAX_ITEMS} elementos por petición")
+
+
+def validate_items(items: List[Dict[str, Any]], model):
+    # Valida cada elemento por separado para informar de los errores sin descartar el resto
+    check_size(items)
+    valid, results = [], {}
+    for index, item in enumerate(items):
+        try:
+            valid.append((index, model.model_validate(item)))
+        except ValidationError as e:
+            error = e.errors()[0]
+            field = ".".join(str(p) for p in error["loc"])
+            results[index] = BulkItemResult(index=index, ok=False, error=f"{field}: {error['msg']}" if field else error["msg"])
+    return valid, results
+
+
+def placeholders(values):
+    return ", ".join(["%s"] * len(values))
+
+
+async def existing_ids(db, table, ids):
+    ids = list({i for i in ids if i is not None})
+    if not ids:
+        return set()
+    rows = await db.fetch_all(f"SELECT id FROM {table} WHERE id IN ({placeholders(ids)})", tuple(ids))
+    return {row["id"] for row in rows}
+
+
+# (incremento, id consecutivos en un INSERT multi-fila) del servidor MySQL; se consulta una vez por proceso
+_autoinc = None
+
+
+async def autoinc_settings(db):
+    # Con innodb_autoinc_lock_mode = 2 (el valor por defecto de MySQL 8) los id de una sentencia pueden
+    # intercalarse con los de otras; con auto_increment_increment > 1 (Galera, multi-primario) van de n en n
+    global _autoinc
+    if _autoinc is None:
+        row = await db.fetch_one("SELECT @@auto_increment_increment AS increment, @@innodb_autoinc_lock_mode AS lock_mode")
+        _autoinc = (int(row["increment"]), int(row["lock_mode"]) != 2)
+    return _autoinc
+
+
+async def insert_rows(db, table, columns, rows):
+    # Un único INSERT multi-fila cuando se puede deducir el id de cada fila; si no, un INSERT por fila
+    row_sql = f"({placeholders(columns)})"
+    if db.backend == "sqlite":
+        increment, consecutive = 1, True
+    else:
+        increment, consecutive = await autoinc_settings(db)
+    if not consecutive:
+        sql = f"INSERT INTO {table} ({', '.join(columns)}) VALUES {row_sql}"
+        return [(await db.execute(sql, tuple(row))).lastrowid for row in rows]
+    sql = f"INSERT INTO {table} ({', '.join(columns)}) VALUES {', '.join([row_sql] * len(rows))}"
+    params = tuple(value for row in rows for value in row)
+    result = await db.execute(sql, params)
+    # SQLite escribe de uno en uno y devuelve el id de la última fila; MySQL, el de la primera
+    if db.backend == "sqlite":
+        return list(range(result.lastrowid - len(rows) + 1, result.lastrowid + 1))
+    return [result.lastrowid + i * increment for i in range(len(rows))]
+
+
+async def run_in_transaction(db, operation):
+    try:
+        outcome = await operation()
+        await db.commit()
+        return outcome
+    except ASYNC_DB_ERRORS as e:
+        await db.rollback()
+        raise HTTPException(status_code=409, detail=f"No se aplicó ningún cambio: {e}")
+
+
+def build_response(results: Dict[int, BulkItemResult], total):
+    ordered = [results[i] for i in range(total)]
+    succeeded = sum(1 for r in ordered if r.ok)
+    return BulkResponse(succeeded=succeeded, failed=total - succeeded, results=ordered)
+
+
+def reject_if_atomic(atomic, results):
+    # Con ?atomic=true cualquier elemento inválido cancela toda la operación
+    if atomic and any(not r.ok for r in results.values()):
+        failed = [r.model_dump() for r in results.values() if not r.ok]
+        raise HTTPException(status_code=422, detail=failed)
@@ -1,17 +1,302 @@
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import deque
+from functools import lru_cache
+
 import mysql.connector
 from mysql.connector import Error
+from fastapi import HTTPException
+
+logger = logging.getLogger(__name__)
 
 DB_CONFIG = {
-    "host": "db.12.ibuo.io",
-    "user": "root",
-    "password": "rootpass",
-    "database": "taskmanager"
+    "host": os.getenv("DB_HOST", "db.12.ibuo.io"),
+    "port": int(os.getenv("DB_PORT", "3306")),
+    "user": os.getenv("DB_USER", "root"),
+    "password": os.getenv("DB_PASSWORD", "rootpass"),
+    "database": os.getenv("DB_NAME", "taskmanager")
 }
 
+# "mysql" en producción; "sqlite" para pruebas locales sin servidor
+DB_BACKEND = os.getenv("DB_BACKEND", "mysql")
+SQLITE_PATH = os.getenv("DB_SQLITE_PATH", "taskmanager.db")
+
+# Configuración del pool (sobrescribible por variables de entorno)
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+POOL_MAX_LIFETIME = float(os.getenv("DB_POOL_MAX_LIFETIME", "1800"))
+POOL_CHECKOUT_TIMEOUT = float(os.getenv("DB_POOL_CHECKOUT_TIMEOUT", "5"))
+POOL_HEALTH_CHECK_INTERVAL = float(os.getenv("DB_POOL_HEALTH_CHECK_INTERVAL", "30"))
+
+DB_ERRORS = (Error, sqlite3.Error)
+
+# Límites (segundos) del histograma de espera al obtener una conexión
+CHECKOUT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+@lru_cache(maxsize=512)
+def to_sqlite(sql):
+    # Traduce el dialecto MySQL que usamos en las consultas y el DDL a SQLite
+    sql = sql.replace("%s", "?")
+    sql = re.sub(r"\bINSERT IGNORE\b", "INSERT OR IGNORE", sql)
+    sql = re.sub(r"\bINT AUTO_INCREMENT PRIMARY KEY\b", "INTEGER PRIMARY KEY AUTOINCREMENT", sql)
+    sql = re.sub(r"\bENUM\([^)]*\)", "TEXT", sql)
+    sql = re.sub(r"\s+ON UPDATE CURRENT_TIMESTAMP\b", "", sql)
+    return sql
+
+
+class SQLiteCursor:
+    # Imita la interfaz de cursor de mysql.connector que usan models/*.py
+    def __init__(self, raw, dictionary=False):
+        self._cur = raw.cursor()
+        self._dictionary = dictionary
+
+    @property
+    def lastrowid(self):
+        return self._cur.lastrowid
+
+    @property
+    def rowcount(self):
+        return self._cur.rowcount
+
+    def _row(self, row):
+        if row is None or not self._dictionary:
+            return row
+        return dict(row)
+
+    def execute(self, sql, params=()):
+        self._cur.execute(to_sqlite(sql), params)
+
+    def executemany(self, sql, seq_params):
+        self._cur.executemany(to_sqlite(sql), seq_params)
+
+    def fetchone(self):
+        return self._row(self._cur.fetchone())
+
+    def fetchall(self):
+        return [self._row(row) for row in self._cur.fetchall()]
+
+    def close(self):
+        self._cur.close()
+
+
+class SQLiteConnection:
+    def __init__(self, path):
+        self._raw = sqlite3.connect(path, check_same_thread=False)
+        self._raw.row_factory = sqlite3.Row
+        self._raw.execute("PRAGMA foreign_keys = ON")
+
+    def cursor(self, dictionary=False):
+        return SQLiteCursor(self._raw, dictionary)
+
+    def commit(self):
+        self._raw.commit()
+
+    def rollback(self):
+        self._raw.rollback()
+
+    def ping(self, reconnect=False):
+        self._raw.execute("SELECT 1")
+
+    def close(self):
+        self._raw.close()
+
+
+class PoolStats:
+    def __init__(self, size):
+        self.size = size
+        self.open = 0
+        self.in_use = 0
+        self.waiting = 0
+        self.checkouts = 0
+        self.timeouts = 0
+        self.recycled = 0
+        self.failed_health_checks = 0
+        self.checkout_seconds_sum = 0.0
+        self.checkout_buckets = [0] * len(CHECKOUT_BUCKETS)
+
+    def observe_checkout(self, seconds):
+        self.checkouts += 1
+        self.checkout_seconds_sum += seconds
+        for i, bound in enumerate(CHECKOUT_BUCKETS):
+            if seconds <= bound:
+                self.checkout_buckets[i] += 1
+
+    def snapshot(self):
+        return {
+            "size": self.size,
+            "open": self.open,
+            "in_use": self.in_use,
+            "idle": self.open - self.in_use,
+            "waiting": self.waiting,
+            "checkouts": self.checkouts,
+            "timeouts": self.timeouts,
+            "recycled": self.recycled,
+            "failed_health_checks": self.failed_health_checks,
+            "checkout_seconds_sum": self.checkout_seconds_sum,
+            "checkout_buckets": list(zip(CHECKOUT_BUCKETS, self.checkout_buckets)),
+        }
+
+
+class PooledConnection:
+    # Envuelve la conexión real: close() la devuelve al pool en lugar de cerrarla
+    def __init__(self, pool, raw, created_at):
+        self._pool = pool
+        self._raw = raw
+        self._created_at = created_at
+        self._closed = False
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self._pool.release(self._raw, self._created_at)
+
+
+class ConnectionPool:
+    def __init__(self, config, size=POOL_SIZE, max_lifetime=POOL_MAX_LIFETIME,
+                 checkout_timeout=POOL_CHECKOUT_TIMEOUT, health_check_interval=POOL_HEALTH_CHECK_INTERVAL):
+        self.config = config
+        self.size = size
+        self.max_lifetime = max_lifetime
+        self.checkout_timeout = checkout_timeout
+        self.health_check_interval = health_check_interval
+        self.stats = PoolStats(size)
+        # Conexiones libres: (conexión, creada_en, devuelta_en)
+        self._idle = deque()
+        self._cond = threading.Condition()
+
+    def _connect(self):
+        if DB_BACKEND == "sqlite":
+            return SQLiteConnection(SQLITE_PATH)
+        return mysql.connector.connect(**self.config)
+
+    def _count(self, counter):
+        with self._cond:
+            setattr(self.stats, counter, getattr(self.stats, counter) + 1)
+
+    def _discard(self, raw):
+        try:
+            raw.close()
+        except DB_ERRORS:
+            pass
+
+    def _is_healthy(self, raw, returned_at):
+        if time.monotonic() - returned_at < self.health_check_interval:
+            return True
+        try:
+            raw.ping(reconnect=False)
+            return True
+        except DB_ERRORS:
+            return False
+
+    def acquire(self, timeout=None):
+        timeout = self.checkout_timeout if timeout is None else timeout
+        start = time.monotonic()
+        deadline = start + timeout
+        with self._cond:
+            self.stats.waiting += 1
+            try:
+                while not self._idle and self.stats.open >= self.size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.stats.timeouts += 1
+                        raise PoolTimeout(f"No hay conexiones libres tras {timeout}s")
+                    self._cond.wait(remaining)
+                if self._idle:
+                    raw, created_at, returned_at = self._idle.pop()
+                else:
+                    raw, created_at, returned_at = None, None, None
+                self.stats.in_use += 1
+                if raw is None:
+                    self.stats.open += 1
+            finally:
+                self.stats.waiting -= 1
+        # La conexión (o el hueco) ya está reservada; conectar y comprobar fuera del lock
+        try:
+            if raw is not None:
+                if time.monotonic() - created_at > self.max_lifetime:
+                    self._count("recycled")
+                    self._discard(raw)
+                    raw = None
+                elif not self._is_healthy(raw, returned_at):
+                    self._count("failed_health_checks")
+                    self._discard(raw)
+                    raw = None
+            if raw is None:
+                raw = self._connect()
+                created_at = time.monotonic()
+        except Exception:
+            with self._cond:
+                self.stats.in_use -= 1
+                self.stats.open -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self.stats.observe_checkout(time.monotonic() - start)
+        return PooledConnection(self, raw, created_at)
+
+    def release(self, raw, created_at):
+        keep = True
+        try:
+            # Descarta cualquier transacción sin confirmar antes de reutilizarla
+            raw.rollback()
+        except DB_ERRORS:
+            keep = False
+        if keep and time.monotonic() - created_at > self.max_lifetime:
+            self._count("recycled")
+            keep = False
+        if not keep:
+            self._discard(raw)
+        with self._cond:
+            self.stats.in_use -= 1
+            if keep:
+                self._idle.append((raw, created_at, time.monotonic()))
+            else:
+                self.stats.open -= 1
+            self._cond.notify()
+
+    def metrics(self):
+        with self._cond:
+            return self.stats.snapshot()
+
+    def close_all(self):
+        with self._cond:
+            idle = list(self._idle)
+            self._idle.clear()
+            self.stats.open -= len(idle)
+        for raw, _, _ in idle:
+            self._discard(raw)
+
+
+pool = ConnectionPool(DB_CONFIG)
+
+
 def get_db():
     try:
-        connection = mysql.connector.connect(**DB_CONFIG)
-        return connection
-    except Error as e:
-        print(f"Error de conexión a la base de datos: {e}")
-        return None 
\ No newline at end of file
+        return pool.acquire()
+    except (PoolTimeout,) + DB_ERRORS as e:
+        logger.error("Error de conexión a la base de datos: %s", e)
+        return None
+
+
+def get_conn():
+    # Dependencia de FastAPI: presta una conexión del pool durante la petición
+    try:
+        db = pool.acquire()
+    except (PoolTimeout,) + DB_ERRORS as e:
+        logger.error("Error de conexión a la base de datos: %s", e)
+        raise HTTPException(status_code=503, detail="Base de datos no disponible")
+    try:
+        yield db
+    finally:
+        db.close()
@@ -0,0 +1,451 @@
+import asyncio
+import contextvars
+import logging
+import os
+import sqlite3
+import time
+from collections import deque, namedtuple
+from contextlib import asynccontextmanager
+
+import aiomysql
+import pymysql
+from fastapi import HTTPException
+
+from db import (
+    DB_BACKEND, DB_CONFIG, SQLITE_PATH, POOL_SIZE, POOL_MAX_LIFETIME, POOL_CHECKOUT_TIMEOUT,
+    POOL_HEALTH_CHECK_INTERVAL, PoolStats, PoolTimeout, to_sqlite,
+)
+
+logger = logging.getLogger(__name__)
+
+ASYNC_DB_ERRORS = (pymysql.err.MySQLError, sqlite3.Error, OSError)
+
+ExecResult = namedtuple("ExecResult", ["lastrowid", "rowcount"])
+
+# Funciones llamadas con (sql, params, segundos) tras cada consulta y con (segundos) tras cada préstamo
+# de conexión; las usan la instrumentación de peticiones y las herramientas de diagnóstico
+query_listeners = []
+checkout_listeners = []
+
+
+def _notify(sql, params, seconds):
+    for listener in query_listeners:
+        listener(sql, params, seconds)
+
+
+class AsyncConnection:
+    # Conexión prestada por el pool; close() la devuelve en lugar de cerrarla
+    def __init__(self, pool, raw, created_at):
+        self._pool = pool
+        self._raw = raw
+        self._created_at = created_at
+        self._closed = False
+        self.backend = pool.backend
+
+    async def _run(self, sql, params, fetch=None):
+        start = time.perf_counter()
+        try:
+            return await self._query(sql, params, fetch)
+        finally:
+            _notify(sql, params, time.perf_counter() - start)
+
+    async def _query(self, sql, params, fetch):
+        if self.backend == "sqlite":
+            cursor = await self._raw.execute(to_sqlite(sql), params)
+            try:
+                if fetch == "one":
+                    row = await cursor.fetchone()
+                    return dict(row) if row is not None else None
+                if fetch == "all":
+                    return [dict(row) for row in await cursor.fetchall()]
+                return ExecResult(cursor.lastrowid, cursor.rowcount)
+            finally:
+                await cursor.close()
+        async with self._raw.cursor(aiomysql.DictCursor) as cursor:
+            await cursor.execute(sql, params)
+            if fetch == "one":
+                return await cursor.fetchone()
+            if fetch == "all":
+                return list(await cursor.fetchall())
+            return ExecResult(cursor.lastrowid, cursor.rowcount)
+
+    async def execute(self, sql, params=()):
+        return await self._run(sql, params)
+
+    async def executemany(self, sql, seq_params):
+        start = time.perf_counter()
+        try:
+            if self.backend == "sqlite":
+                cursor = await self._raw.executemany(to_sqlite(sql), seq_params)
+                await cursor.close()
+                return ExecResult(cursor.lastrowid, cursor.rowcount)
+            async with self._raw.cursor() as cursor:
+                await cursor.executemany(sql, seq_params)
+                return ExecResult(cursor.lastrowid, cursor.rowcount)
+        finally:
+            _notify(sql, seq_params[0] if seq_params else (), time.perf_counter() - start)
+
+    async def fetch_one(self, sql, params=()):
+        return await self._run(sql, params, "one")
+
+    async def fetch_all(self, sql, params=()):
+        return await self._run(sql, params, "all")
+
+    async def stream(self, sql, params=(), batch_size=500):
+        # Recorre el resultado sin cargarlo entero en memoria (cursor sin buffer en MySQL)
+        # Se mide solo la ejecución: el tiempo de lectura depende de quien consume las filas
+        start = time.perf_counter()
+        if self.backend == "sqlite":
+            cursor = await self._raw.execute(to_sqlite(sql), params)
+            _notify(sql, params, time.perf_counter() - start)
+            try:
+                while True:
+                    rows = await cursor.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    for row in rows:
+                        yield dict(row)
+            finally:
+                await cursor.close()
+            return
+        async with self._raw.cursor(aiomysql.SSDictCursor) as cursor:
+            await cursor.execute(sql, params)
+            _notify(sql, params, time.perf_counter() - start)
+            while True:
+                rows = await cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield row
+
+    async def commit(self):
+        await self._raw.commit()
+
+    async def rollback(self):
+        await self._raw.rollback()
+
+    async def close(self):
+        if not self._closed:
+            self._closed = True
+            await self._pool.release(self._raw, self._created_at)
+
+
+class AsyncConnectionPool:
+    def __init__(self, config, backend=DB_BACKEND, size=POOL_SIZE, max_lifetime=POOL_MAX_LIFETIME,
+                 checkout_timeout=POOL_CHECKOUT_TIMEOUT, health_check_interval=POOL_HEALTH_CHECK_INTERVAL):
+        self.config = config
+        self.backend = backend
+        self.size = size
+        self.max_lifetime = max_lifetime
+        self.checkout_timeout = checkout_timeout
+        self.health_check_interval = health_check_interval
+        self.stats = PoolStats(size)
+        # Conexiones libres: (conexión, creada_en, devuelta_en)
+        self._idle = deque()
+        self._cond = asyncio.Condition()
+
+    async def _connect(self):
+        if self.backend == "sqlite":
+            import aiosqlite
+            raw = await aiosqlite.connect(self.config.get("path", SQLITE_PATH))
+            raw.row_factory = aiosqlite.Row
+            await raw.execute("PRAGMA foreign_keys = ON")
+            return raw
+        return await aiomysql.connect(
+            host=self.config["host"], port=self.config.get("port", 3306), user=self.config["user"],
+            password=self.config["password"], db=self.config["database"], autocommit=False,
+        )
+
+    async def _discard(self, raw):
+        try:
+            if self.backend == "sqlite":
+                await raw.close()
+            else:
+                raw.close()
+        except ASYNC_DB_ERRORS:
+            pass
+
+    async def _is_healthy(self, raw, returned_at):
+        if time.monotonic() - returned_at < self.health_check_interval:
+            return True
+        try:
+            if self.backend == "sqlite":
+                await raw.execute("SELECT 1")
+            else:
+                await raw.ping(reconnect=False)
+            return True
+        except ASYNC_DB_ERRORS:
+            return False
+
+    async def acquire(self, timeout=None):
+        timeout = self.checkout_timeout if timeout is None else timeout
+        start = time.monotonic()
+        async with self._cond:
+            self.stats.waiting += 1
+            try:
+                await asyncio.wait_for(
+                    self._cond.wait_for(lambda: self._idle or self.stats.open < self.size), timeout
+                )
+            except asyncio.TimeoutError:
+                self.stats.timeouts += 1
+                raise PoolTimeout(f"No hay conexiones libres tras {timeout}s")
+            finally:
+                self.stats.waiting -= 1
+            if self._idle:
+                raw, created_at, returned_at = self._idle.pop()
+            else:
+                raw, created_at, returned_at = None, None, None
+                self.stats.open += 1
+            self.stats.in_use += 1
+        # La conexión (o el hueco) ya está reservada; conectar y comprobar fuera del lock
+        try:
+            if raw is not None:
+                if time.monotonic() - created_at > self.max_lifetime:
+                    self.stats.recycled += 1
+                    await self._discard(raw)
+                    raw = None
+                elif not await self._is_healthy(raw, returned_at):
+                    self.stats.failed_health_checks += 1
+                    await self._discard(raw)
+                    raw = None
+            if raw is None:
+                raw = await self._connect()
+                created_at = time.monotonic()
+        except BaseException:
+            async with self._cond:
+                self.stats.in_use -= 1
+                self.stats.open -= 1
+                self._cond.notify()
+            raise
+        elapsed = time.monotonic() - start
+        self.stats.observe_checkout(elapsed)
+        for listener in checkout_listeners:
+            listener(elapsed)
+        return AsyncConnection(self, raw, created_at)
+
+    async def release(self, raw, created_at):
+        keep = True
+        try:
+            # Descarta cualquier transacción sin confirmar antes de reutilizarla
+            await raw.rollback()
+        except ASYNC_DB_ERRORS:
+            keep = False
+        if keep and time.monotonic() - created_at > self.max_lifetime:
+            self.stats.recycled += 1
+            keep = False
+        if not keep:
+            await self._discard(raw)
+        async with self._cond:
+            self.stats.in_use -= 1
+            if keep:
+                self._idle.append((raw, created_at, time.monotonic()))
+            else:
+                self.stats.open -= 1
+            self._cond.notify()
+
+    @asynccontextmanager
+    async def connection(self):
+        conn = await self.acquire()
+        try:
+            yield conn
+        finally:
+            await conn.close()
+
+    def metrics(self):
+        return self.stats.snapshot()
+
+    async def close_all(self):
+        async with self._cond:
+            idle = list(self._idle)
+            self._idle.clear()
+            self.stats.open -= len(idle)
+        for raw, _, _ in idle:
+            await self._discard(raw)
+        # El Condition queda ligado al event loop actual; se recrea para el próximo arranque
+        self._cond = asyncio.Condition()
+
+
+apool = AsyncConnectionPool(DB_CONFIG)
+
+# Réplicas de lectura: DB_REPLICAS="host1:3306,host2:3306" (mismo usuario y base de datos que el primario).
+# Con DB_BACKEND=sqlite cada entrada es la ruta de un fichero, útil para probar el enrutado en local
+DB_REPLICAS = [spec.strip() for spec in os.getenv("DB_REPLICAS", "").split(",") if spec.strip()]
+REPLICA_POOL_SIZE = int(os.getenv("DB_REPLICA_POOL_SIZE", str(POOL_SIZE)))
+# Una réplica con más retraso que esto (segundos) deja de recibir lecturas hasta que se ponga al día
+REPLICA_MAX_LAG = float(os.getenv("DB_REPLICA_MAX_LAG", "5"))
+REPLICA_CHECK_INTERVAL = float(os.getenv("DB_REPLICA_CHECK_INTERVAL", "5"))
+# Tras una escritura, las lecturas de ese cliente van al primario durante estos segundos (lee lo que escribe)
+READ_YOUR_WRITES_SECONDS = float(os.getenv("DB_READ_YOUR_WRITES", "5"))
+READ_YOUR_WRITES_COOKIE = "db_primary_until"
+
+# "replica" si la petición en curso puede leer de una réplica; lo fija ReplicaRoutingMiddleware
+db_target = contextvars.ContextVar("db_target", default="primary")
+replica_stats = {"reads": 0, "primary_fallback_reads": 0, "fallbacks": 0}
+
+
+def _replica_config(spec):
+    if DB_BACKEND == "sqlite":
+        return {"path": spec}
+    host, _, port = spec.partition(":")
+    return {**DB_CONFIG, "host": host, "port": int(port or DB_CONFIG["port"])}
+
+
+class Replica:
+    def __init__(self, name, spec):
+        self.name = name
+        self.pool = AsyncConnectionPool(_replica_config(spec), size=REPLICA_POOL_SIZE)
+        self.healthy = True
+        # Segundos de retraso en la última comprobación; None si el servidor no informa (no es réplica)
+        self.lag = None
+
+    async def check(self):
+        try:
+            async with self.pool.connection() as conn:
+                if conn.backend == "sqlite":
+                    await conn.fetch_one("SELECT 1")
+                    lag = None
+                else:
+                    lag = await self._replication_lag(conn)
+        except (PoolTimeout,) + ASYNC_DB_ERRORS as e:
+            if self.healthy:
+                logger.warning("Réplica %s no disponible: %s", self.name, e)
+            self.healthy = False
+            return
+        self.lag = lag
+        healthy = lag is None or lag <= REPLICA_MAX_LAG
+        if healthy != self.healthy:
+            logger.warning("Réplica %s %s (retraso: %s s)", self.name, "recuperada" if healthy else "retrasada", lag)
+        self.healthy = healthy
+
+    async def _replication_lag(self, conn):
+        try:
+            status = await conn.fetch_one("SHOW REPLICA STATUS")
+            column = "Seconds_Behind_Source"
+        except pymysql.err.ProgrammingError:
+            # MySQL anterior a 8.0.22
+            status = await conn.fetch_one("SHOW SLAVE STATUS")
+            column = "Seconds_Behind_Master"
+        if not status:
+            return None
+        if status[column] is None:
+            # La replicación está parada: los datos pueden estar arbitrariamente atrasados
+            return float("inf")
+        return float(status[column])
+
+
+class ReplicaSet:
+    def __init__(self, specs):
+        self.replicas = [Replica(f"replica{i + 1}", spec) for i, spec in enumerate(specs)]
+        self._next = 0
+        self._task = None
+
+    def candidates(self):
+        # Réplicas sanas en turno rotatorio
+        healthy = [r for r in self.replicas if r.healthy]
+        if not healthy:
+            return []
+        self._next = (self._next + 1) % len(healthy)
+        return healthy[self._next:] + healthy[:self._next]
+
+    async def _check_loop(self):
+        while True:
+            await asyncio.gather(*(replica.check() for replica in self.replicas))
+            await asyncio.sleep(REPLICA_CHECK_INTERVAL)
+
+    def start(self):
+        if self.replicas and self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._check_loop())
+
+    async def close_all(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        for replica in self.replicas:
+            await replica.pool.close_all()
+
+    def metrics(self):
+        return {replica.name: replica.pool.metrics() for replica in self.replicas}
+
+
+replicas = ReplicaSet(DB_REPLICAS)
+
+
+async def acquire_routed():
+    # Réplica si la petición es una lectura sin escrituras recientes del cliente; si no hay ninguna sana o
+    # falla la conexión, el primario
+    if db_target.get() == "replica":
+        for replica in replicas.candidates():
+            try:
+                conn = await replica.pool.acquire()
+                replica_stats["reads"] += 1
+                return conn
+            except (PoolTimeout,) + ASYNC_DB_ERRORS as e:
+                replica_stats["fallbacks"] += 1
+                if not isinstance(e, PoolTimeout):
+                    logger.warning("Réplica %s no disponible: %s", replica.name, e)
+                    replica.healthy = False
+        replica_stats["primary_fallback_reads"] += 1
+    return await apool.acquire()
+
+
+@asynccontextmanager
+async def read_connection():
+    # Como apool.connection(), pero respeta el enrutado de lecturas de la petición en curso
+    conn = await acquire_routed()
+    try:
+        yield conn
+    finally:
+        await conn.close()
+
+
+class ReplicaRoutingMiddleware:
+    # GET y HEAD pueden ir a réplicas; el resto de métodos van al primario y, si responden bien, marcan al
+    # cliente con una cookie para que sus lecturas de los próximos segundos también vayan al primario
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not replicas.replicas:
+            await self.app(scope, receive, send)
+            return
+        if scope["method"] in ("GET", "HEAD"):
+            token = db_target.set("primary" if self._recent_write(scope) else "replica")
+            try:
+                await self.app(scope, receive, send)
+            finally:
+                db_target.reset(token)
+            return
+
+        async def send_with_cookie(message):
+            if message["type"] == "http.response.start" and message["status"] < 400:
+                until = int(time.time() + READ_YOUR_WRITES_SECONDS)
+                cookie = (f"{READ_YOUR_WRITES_COOKIE}={until}; Max-Age={int(READ_YOUR_WRITES_SECONDS)}; "
+                          "Path=/; HttpOnly; SameSite=Lax")
+                message = {**message, "headers": list(message.get("headers", [])) + [(b"set-cookie", cookie.encode())]}
+            await send(message)
+
+        await self.app(scope, receive, send_with_cookie)
+
+    @staticmethod
+    def _recent_write(scope):
+        for name, value in scope.get("headers", ()):
+            if name == b"cookie":
+                for part in value.decode("latin-1").split(";"):
+                    key, _, until = part.strip().partition("=")
+                    if key == READ_YOUR_WRITES_COOKIE and until.isdigit():
+                        return int(until) > time.time()
+        return False
+
+
+async def get_adb():
+    # Dependencia de FastAPI: presta una conexión asíncrona durante la petición (réplica o primario,
+    # según ReplicaRoutingMiddleware)
+    try:
+        conn = await acquire_routed()
+    except (PoolTimeout,) + ASYNC_DB_ERRORS as e:
+        logger.error("Error de conexión a la base de datos: %s", e)
+        raise HTTPException(status_code=503, detail="Base de datos no disponible")
+    try:
+        yield conn
+    finally:
+        await conn.close()
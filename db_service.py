@@ -1,94 +1,94 @@
-from fastapi import FastAPI, HTTPException, Request
-from pydantic import BaseModel
-import mysql.connector
-from typing import Dict
+import logging
+import os
+from fastapi import FastAPI, HTTPException, Request, Depends, Response
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel, Field
+from typing import Dict, List
+from db_async import apool, get_adb
+from key_validation import (lookup_key, lookup_keys, invalidate_key, record_usage, flush_usage,
+                            start_invalidation_listener, stop_invalidation_listener)
+from jobs import worker
+import ratelimit
+from instrumentation import InstrumentationMiddleware
+from routers.metrics import router as metrics_router
+
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"), format="%(asctime)s %(levelname)s %(name)s: %(message)s")
 
 app = FastAPI(title="DB Service para API Keys (Percona/MySQL)")
+app.add_middleware(InstrumentationMiddleware)
+app.include_router(metrics_router)
+
+@app.on_event("startup")
+async def startup():
+    # Vuelca el uso de las claves a la cola de trabajos (y ejecuta esos trabajos si JOBS_WORKER no es 0)
+    worker.start()
+    # Revocaciones hechas en main:app (con EVENTS_URL): sin esto /validate-key y /validate-keys aceptarían la
+    # clave hasta que caducara en caché
+    start_invalidation_listener()
 
-# Configuración de conexión a Percona/MySQL
-DB_CONFIG = {
-    "host": "db.12.ibuo.io",
-    "user": "root",
-    "password": "rootpass",
-    "database": "taskmanager"
-}
+@app.on_event("shutdown")
+async def shutdown():
+    await worker.stop()
+    await stop_invalidation_listener()
+    await flush_usage()
+    await ratelimit.limiter.close()
+    await apool.close_all()
 
-def get_db():
-    return mysql.connector.connect(**DB_CONFIG)
+# La configuración de conexión y el pool viven en db.py; el esquema lo crea migrations.py
 
 class APIKeyCreate(BaseModel):
     name: str
 
-def ensure_table_exists(table_name: str):
-    db = get_db()
-    cursor = db.cursor()
-    if table_name == "api_keys":
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS api_keys (
-            id INT AUTO_INCREMENT PRIMARY KEY,
-            name VARCHAR(255) NOT NULL,
-            api_key VARCHAR(255) NOT NULL UNIQUE
-        )
-        """)
-    elif table_name == "users":
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            id INT AUTO_INCREMENT PRIMARY KEY,
-            username VARCHAR(50) NOT NULL UNIQUE,
-            password_hash VARCHAR(255) NOT NULL,
-            email VARCHAR(100) NOT NULL UNIQUE,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-        """)
-    elif table_name == "tasks":
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS tasks (
-            id INT AUTO_INCREMENT PRIMARY KEY,
-            user_id INT NOT NULL,
-            title VARCHAR(255) NOT NULL,
-            description TEXT,
-            status ENUM('pending', 'in_progress', 'completed', 'archived') DEFAULT 'pending',
-            due_date DATE,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
-        )
-        """)
-    # Agrega más tablas según sea necesario
-    cursor.close()
-    db.close()
+# Claves por llamada a /validate-keys
+VALIDATE_BATCH_MAX = int(os.getenv("VALIDATE_BATCH_MAX", "1000"))
+
+class KeyBatch(BaseModel):
+    # Una entrada por petición del gateway: una clave repetida gasta una ficha por cada aparición
+    keys: List[str] = Field(..., max_length=VALIDATE_BATCH_MAX)
 
 @app.get("/validate-key")
-def validate_key(key: str):
-    ensure_table_exists("api_keys")
-    db = get_db()
-    cursor = db.cursor(dictionary=True)
-    cursor.execute("SELECT * FROM api_keys WHERE api_key = %s", (key,))
-    result = cursor.fetchone()
-    cursor.close()
-    db.close()
-    return {"valid": bool(result)}
+async def validate_key(key: str, response: Response):
+    # Sin dependencia de conexión: solo se pide una al pool si la clave no está en caché
+    # Con una clave válida se gasta una ficha de su límite: el gateway que llama reenvía el 429 y las cabeceras
+    result = await lookup_key(key)
+    if not result:
+        return {"valid": False}
+    record_usage(result)
+    decision = await ratelimit.check_key(result)
+    headers = {name.decode(): value.decode() for name, value in decision.headers()}
+    if not decision.allowed:
+        return JSONResponse({"valid": True, "detail": "Demasiadas peticiones"}, status_code=429, headers=headers)
+    response.headers.update(headers)
+    return {"valid": True}
+
+@app.post("/validate-keys")
+async def validate_keys(batch: KeyBatch):
+    # Versión por lotes de /validate-key para gateways que agrupan peticiones: una llamada HTTP y, como mucho,
+    # una consulta por lote de claves que no estén en caché. Los resultados van en el orden de `keys`
+    rows = await lookup_keys(batch.keys)
+    results = []
+    for key in batch.keys:
+        row = rows[key]
+        if not row:
+            results.append({"valid": False})
+            continue
+        record_usage(row)
+        decision = await ratelimit.check_key(row)
+        results.append({"valid": True, "allowed": decision.allowed, "remaining": decision.remaining,
+                        "retry_after": decision.retry_after})
+    return {"results": results}
 
 @app.get("/list-keys")
-def list_keys():
-    ensure_table_exists("api_keys")
-    db = get_db()
-    cursor = db.cursor(dictionary=True)
-    cursor.execute("SELECT name, api_key FROM api_keys")
-    keys = {row["name"]: row["api_key"] for row in cursor.fetchall()}
-    cursor.close()
-    db.close()
+async def list_keys(db=Depends(get_adb)):
+    rows = await db.fetch_all("SELECT name, api_key FROM api_keys")
+    keys = {row["name"]: row["api_key"] for row in rows}
     return {"keys": keys}
 
 @app.post("/create-key")
-def create_key(data: APIKeyCreate):
+async def create_key(data: APIKeyCreate, db=Depends(get_adb)):
     import secrets
-    ensure_table_exists("api_keys")
     new_key = secrets.token_urlsafe(24)
-    db = get_db()
-    cursor = db.cursor()
-    cursor.execute("INSERT INTO api_keys (name, api_key) VALUES (%s, %s)", (data.name, new_key))
-    db.commit()
-    cursor.close()
-    db.close()
+    await db.execute("INSERT INTO api_keys (name, api_key) VALUES (%s, %s)", (data.name, new_key))
+    await db.commit()
+    await invalidate_key(new_key)
     return {"name": data.name, "api_key": new_key} 
\ No newline at end of file
@@ -0,0 +1,210 @@
+import asyncio
+import json
+import logging
+import os
+from collections import deque
+
+from serialization import dumps
+
+logger = logging.getLogger(__name__)
+
+# Con EVENTS_URL=redis://... los eventos se comparten entre workers (pub/sub y búfer en Redis);
+# sin ella el broker vive en el proceso
+EVENTS_URL = os.getenv("EVENTS_URL")
+# Eventos que se guardan por canal para reanudar una suscripción desde una secuencia anterior
+EVENTS_BUFFER_SIZE = int(os.getenv("EVENTS_BUFFER_SIZE", "1000"))
+SUBSCRIBER_QUEUE_SIZE = int(os.getenv("EVENTS_SUBSCRIBER_QUEUE", "1000"))
+KEY_PREFIX = "taskmanager:events:"
+
+# Canal global: recibe todos los eventos (para el dashboard de estadísticas)
+ALL = "all"
+
+event_stats = {"published": 0, "delivered": 0, "resyncs": 0, "subscribers": 0}
+
+
+def project_channel(project_id):
+    return f"project:{project_id}"
+
+
+def resync_event(channel):
+    # El cliente se ha quedado atrás más de lo que guarda el búfer: debe volver a pedir el estado completo
+    event_stats["resyncs"] += 1
+    return {"type": "resync", "channel": channel}
+
+
+class Subscription:
+    def __init__(self, broker, channel):
+        self.broker = broker
+        self.channel = channel
+        self.queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+
+    def deliver(self, event):
+        try:
+            self.queue.put_nowait(event)
+            event_stats["delivered"] += 1
+        except asyncio.QueueFull:
+            # Un cliente lento no frena al resto: se descarta su cola y se le pide resincronizar
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(resync_event(self.channel))
+
+    async def get(self, timeout=None):
+        return await asyncio.wait_for(self.queue.get(), timeout)
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class MemoryBroker:
+    # Secuencia y búfer por canal, y reparto a los suscriptores del proceso
+    def __init__(self):
+        self.sequences = {}
+        self.buffers = {}
+        self.subscribers = {}
+
+    def _deliver(self, channel, event):
+        for subscription in list(self.subscribers.get(channel, ())):
+            subscription.deliver(event)
+
+    async def publish(self, channel, event):
+        seq = self.sequences.get(channel, 0) + 1
+        self.sequences[channel] = seq
+        event = {**event, "channel": channel, "seq": seq}
+        self.buffers.setdefault(channel, deque(maxlen=EVENTS_BUFFER_SIZE)).append(event)
+        self._deliver(channel, event)
+
+    async def history(self, channel, after):
+        # Eventos con seq > after; None si ya no están todos en el búfer
+        buffer = self.buffers.get(channel, ())
+        if after >= self.sequences.get(channel, 0):
+            return []
+        if not buffer or buffer[0]["seq"] > after + 1:
+            return None
+        return [event for event in buffer if event["seq"] > after]
+
+    async def subscribe(self, channel):
+        subscription = Subscription(self, channel)
+        self.subscribers.setdefault(channel, set()).add(subscription)
+        event_stats["subscribers"] += 1
+        return subscription
+
+    def unsubscribe(self, subscription):
+        subscribers = self.subscribers.get(subscription.channel)
+        if subscribers and subscription in subscribers:
+            subscribers.discard(subscription)
+            event_stats["subscribers"] -= 1
+            if not subscribers:
+                del self.subscribers[subscription.channel]
+
+    def healthy(self):
+        return True
+
+    async def close(self):
+        pass
+
+
+# Secuencia, búfer y reparto en un solo paso en el servidor: dos workers que publican en el mismo canal no pueden
+# repartir seq N+1 antes que N. El evento llega ya serializado sin seq y el script lo añade antes de la llave final
+PUBLISH_SCRIPT = """
+local seq = redis.call('INCR', KEYS[1])
+local payload = string.sub(ARGV[1], 1, -2) .. ',"seq":' .. seq .. '}'
+redis.call('LPUSH', KEYS[2], payload)
+redis.call('LTRIM', KEYS[2], 0, tonumber(ARGV[2]) - 1)
+redis.call('PUBLISH', KEYS[3], payload)
+return seq
+"""
+
+
+class RedisBroker(MemoryBroker):
+    # Cualquier servidor compatible con Redis: INCR da la secuencia, una lista acotada hace de búfer y
+    # PUBLISH reparte a todos los procesos, que entregan a sus suscriptores locales
+    def __init__(self, url):
+        super().__init__()
+        import redis.asyncio
+        self.client = redis.asyncio.from_url(url)
+        self.script = self.client.register_script(PUBLISH_SCRIPT)
+        self._listener = None
+
+    async def publish(self, channel, event):
+        payload = dumps({**event, "channel": channel})
+        await self.script(keys=[f"{KEY_PREFIX}seq:{channel}", f"{KEY_PREFIX}buffer:{channel}", f"{KEY_PREFIX}{channel}"],
+                          args=[payload, EVENTS_BUFFER_SIZE])
+
+    async def history(self, channel, after):
+        current = int(await self.client.get(f"{KEY_PREFIX}seq:{channel}") or 0)
+        if after >= current:
+            return []
+        events = [json.loads(raw) for raw in reversed(await self.client.lrange(f"{KEY_PREFIX}buffer:{channel}", 0, -1))]
+        if not events or events[0]["seq"] > after + 1:
+            return None
+        return [event for event in events if event["seq"] > after]
+
+    def _resync_all(self):
+        for channel in list(self.subscribers):
+            self._deliver(channel, resync_event(channel))
+
+    async def _listen(self):
+        # Si se pierde la conexión, los eventos publicados entre medias no llegan: se pide resincronizar a los
+        # suscriptores al caer y otra vez al recuperarla, y se vuelve a suscribir
+        lost = False
+        while True:
+            pubsub = self.client.pubsub()
+            try:
+                await pubsub.psubscribe(f"{KEY_PREFIX}*")
+                if lost:
+                    self._resync_all()
+                    lost = False
+                async for message in pubsub.listen():
+                    if message["type"] == "pmessage":
+                        event = json.loads(message["data"])
+                        self._deliver(event["channel"], event)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Conexión con el broker de eventos perdida: %s", e)
+                if not lost:
+                    self._resync_all()
+                    lost = True
+                await asyncio.sleep(1)
+            finally:
+                await pubsub.close()
+
+    async def subscribe(self, channel):
+        if self._listener is None or self._listener.done():
+            self._listener = asyncio.get_running_loop().create_task(self._listen())
+        return await super().subscribe(channel)
+
+    def healthy(self):
+        # El listener se arranca con la primera suscripción y se reconecta solo; si aun así termina, la siguiente
+        # suscripción lo vuelve a arrancar
+        return self._listener is not None and not self._listener.done()
+
+    async def close(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            self._listener = None
+
+
+broker = RedisBroker(EVENTS_URL) if EVENTS_URL else MemoryBroker()
+
+
+async def publish(event_type, project_id=None, **data):
+    # Se llama tras el commit; un fallo del broker no debe romper la escritura que ya se ha confirmado
+    event = {"type": event_type, "project_id": project_id, **data}
+    channels = [ALL] if project_id is None else [project_channel(project_id), ALL]
+    try:
+        for channel in channels:
+            await broker.publish(channel, event)
+        event_stats["published"] += 1
+    except Exception as e:
+        logger.error("No se pudo publicar el evento %s: %s", event_type, e)
+
+
+async def replay_and_subscribe(channel, after=None):
+    # Se suscribe antes de leer el histórico para no perder eventos publicados entre medias;
+    # los repetidos se descartan por seq al consumir
+    subscription = await broker.subscribe(channel)
+    if after is None:
+        return subscription, []
+    backlog = await broker.history(channel, after)
+    return subscription, [resync_event(channel)] if backlog is None else backlog
@@ -0,0 +1,116 @@
+import asyncio
+import csv
+import io
+import os
+import secrets
+import time
+
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+
+from db_async import read_connection
+from jobs import JOBS_RETENTION_HOURS, enqueue, job, periodic
+from pagination import Filters, parse_fields
+from serialization import dumps
+
+EXPORT_FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+# Ficheros generados por los trabajos de exportación; con varios servidores debe ser un volumen compartido
+EXPORT_DIR = os.getenv("EXPORT_DIR", "exports")
+EXPORT_WRITE_CHUNK = 1 << 20
+
+
+async def _rows(sql, params):
+    # La conexión se toma dentro del generador para que viva mientras se envía la respuesta; en una petición
+    # GET puede ser una réplica, en los trabajos de exportación es el primario
+    async with read_connection() as db:
+        async for row in db.stream(sql, params):
+            yield row
+
+
+async def _ndjson(rows):
+    async for row in rows:
+        yield dumps(row) + b"\n"
+
+
+async def _csv(rows, columns):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    async for row in rows:
+        writer.writerow([row[c] for c in columns])
+        # Se vacía el buffer en cada fila para mantener memoria constante
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate(0)
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def _export_sql(table, columns, clauses):
+    where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+    return f"SELECT {', '.join(columns)} FROM {table}{where} ORDER BY id"
+
+
+def _check_format(fmt):
+    if fmt not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Formato no válido; use uno de: {', '.join(EXPORT_FORMATS)}")
+
+
+def export_response(table, model, filters: Filters, fmt, fields=None):
+    _check_format(fmt)
+    columns = parse_fields(fields, model)
+    rows = _rows(_export_sql(table, columns, filters.clauses), tuple(filters.params))
+    body = _ndjson(rows) if fmt == "ndjson" else _csv(rows, columns)
+    headers = {"Content-Disposition": f'attachment; filename="{table}.{fmt}"'}
+    return StreamingResponse(body, media_type=EXPORT_FORMATS[fmt], headers=headers)
+
+
+async def enqueue_export(table, model, filters: Filters, fmt, fields=None):
+    # Misma consulta que export_response, pero el fichero lo genera el worker y se descarga desde /api/jobs
+    _check_format(fmt)
+    columns = parse_fields(fields, model)
+    payload = {"table": table, "columns": columns, "clauses": filters.clauses, "params": filters.params,
+               "format": fmt, "file": f"{table}-{secrets.token_hex(8)}.{fmt}"}
+    job_id = await enqueue("export.generate", payload)
+    return {"job_id": job_id, "status_url": f"/api/jobs/{job_id}"}
+
+
+def export_path(name):
+    return os.path.join(EXPORT_DIR, os.path.basename(name))
+
+
+@job("export.generate", concurrency=2, timeout=3600, max_attempts=3)
+async def generate_export(payload):
+    columns = payload["columns"]
+    rows = _rows(_export_sql(payload["table"], columns, payload["clauses"]), tuple(payload["params"]))
+    body = _ndjson(rows) if payload["format"] == "ndjson" else _csv(rows, columns)
+    path = export_path(payload["file"])
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    # Se escribe en un temporal y se renombra al terminar: nunca se sirve un fichero a medias
+    size = 0
+    with open(path + ".tmp", "wb") as f:
+        pending = []
+        pending_size = 0
+        async for chunk in body:
+            data = chunk.encode() if isinstance(chunk, str) else chunk
+            pending.append(data)
+            pending_size += len(data)
+            if pending_size >= EXPORT_WRITE_CHUNK:
+                await asyncio.to_thread(f.write, b"".join(pending))
+                size += pending_size
+                pending, pending_size = [], 0
+        await asyncio.to_thread(f.write, b"".join(pending))
+        size += pending_size
+    os.replace(path + ".tmp", path)
+    return {"file": payload["file"], "bytes": size}
+
+
+@periodic(3600)
+async def remove_old_exports():
+    # Los ficheros duran lo mismo que los trabajos terminados que los referencian
+    if not os.path.isdir(EXPORT_DIR):
+        return
+    cutoff = time.time() - JOBS_RETENTION_HOURS * 3600
+    for entry in os.scandir(EXPORT_DIR):
+        if entry.is_file() and entry.stat().st_mtime < cutoff:
+            os.remove(entry.path)
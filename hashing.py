@@ -0,0 +1,53 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi import HTTPException
+from passlib.context import CryptContext
+
+# Coste de bcrypt; los hashes con un coste menor se regeneran al iniciar sesión
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+# bcrypt libera el GIL, así que un pool de hilos dedicado basta para no bloquear el resto de la API
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", str(os.cpu_count() or 2)))
+HASH_QUEUE_LIMIT = int(os.getenv("HASH_QUEUE_LIMIT", "32"))
+
+pwd_context = CryptContext(
+    schemes=["bcrypt"], deprecated="auto",
+    bcrypt__default_rounds=BCRYPT_ROUNDS, bcrypt__min_rounds=BCRYPT_ROUNDS,
+)
+
+_executor = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix="bcrypt")
+hash_stats = {"in_flight": 0, "completed": 0, "rejected": 0, "rehashed": 0}
+
+
+async def _run(fn, *args):
+    # Trabajos en ejecución + en cola; por encima del límite se rechaza en vez de encolar sin fin
+    if hash_stats["in_flight"] >= HASH_WORKERS + HASH_QUEUE_LIMIT:
+        hash_stats["rejected"] += 1
+        raise HTTPException(
+            status_code=429,
+            detail="Demasiadas operaciones de autenticación en curso, inténtalo de nuevo",
+            headers={"Retry-After": "1"},
+        )
+    hash_stats["in_flight"] += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_executor, fn, *args)
+    finally:
+        hash_stats["in_flight"] -= 1
+        hash_stats["completed"] += 1
+
+
+async def hash_password(password: str) -> str:
+    return await _run(pwd_context.hash, password)
+
+
+async def verify_and_update(password: str, hashed: str):
+    # Devuelve (válida, nuevo_hash); nuevo_hash no es None si el hash usa un esquema o coste obsoleto
+    valid, new_hash = await _run(pwd_context.verify_and_update, password, hashed)
+    if new_hash:
+        hash_stats["rehashed"] += 1
+    return valid, new_hash
+
+
+def shutdown():
+    _executor.shutdown(wait=False)
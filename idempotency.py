@@ -0,0 +1,176 @@
+import hashlib
+import logging
+import os
+
+from cache import TTLCache
+from db_async import apool
+from jobs import periodic, timestamp
+
+logger = logging.getLogger(__name__)
+
+# Tiempo que se recuerda la respuesta de cada Idempotency-Key
+IDEMPOTENCY_TTL_HOURS = float(os.getenv("IDEMPOTENCY_TTL_HOURS", "24"))
+# Si la petición original no termina en este tiempo (proceso caído), otra con la misma clave puede ocupar su lugar
+IDEMPOTENCY_LOCK_SECONDS = float(os.getenv("IDEMPOTENCY_LOCK_SECONDS", "60"))
+# Las respuestas más grandes no se guardan: la clave se libera y un reintento vuelve a ejecutar la petición
+IDEMPOTENCY_MAX_BODY = int(os.getenv("IDEMPOTENCY_MAX_BODY", str(256 * 1024)))
+IDEMPOTENCY_CACHE_SIZE = int(os.getenv("IDEMPOTENCY_CACHE_SIZE", "10000"))
+# Cabecera que distingue a quién pertenece la clave, para que dos clientes no compartan respuestas
+IDENTITY_HEADERS = (b"authorization", b"x-api-key")
+WRITE_METHODS = ("POST", "PUT", "PATCH", "DELETE")
+
+# key_hash -> (request_hash, status_code, content_type, body); solo respuestas terminadas
+front_cache = TTLCache(maxsize=IDEMPOTENCY_CACHE_SIZE, ttl=min(IDEMPOTENCY_TTL_HOURS * 3600, 3600))
+idempotency_stats = {"stored": 0, "replayed": 0, "conflicts": 0, "mismatches": 0}
+
+
+def _json_response(status, detail, extra_headers=()):
+    body = ('{"detail":"%s"}' % detail).encode()
+    headers = [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()), *extra_headers]
+    return status, headers, body
+
+
+async def _send(send, status, headers, body):
+    await send({"type": "http.response.start", "status": status, "headers": headers})
+    await send({"type": "http.response.body", "body": body})
+
+
+def _replay(stored):
+    _, status, content_type, body = stored
+    body = body.encode()
+    headers = [(b"content-type", (content_type or "application/json").encode()),
+               (b"content-length", str(len(body)).encode()), (b"idempotent-replayed", b"true")]
+    return status, headers, body
+
+
+async def _claim(key_hash, request_hash):
+    # True si esta petición se queda con la clave; si no, la fila existente (terminada o en curso)
+    lock_until = timestamp(IDEMPOTENCY_LOCK_SECONDS)
+    async with apool.connection() as db:
+        result = await db.execute(
+            "INSERT IGNORE INTO idempotency_keys (key_hash, request_hash, expires_at) VALUES (%s, %s, %s)",
+            (key_hash, request_hash, lock_until))
+        if not result.rowcount:
+            # Caducada (o la petición original se perdió): se reutiliza la fila
+            result = await db.execute("""
+                UPDATE idempotency_keys SET request_hash = %s, status_code = NULL, content_type = NULL, body = NULL,
+                       expires_at = %s
+                WHERE key_hash = %s AND expires_at < %s
+            """, (request_hash, lock_until, key_hash, timestamp()))
+        await db.commit()
+        if result.rowcount:
+            return True, None
+        row = await db.fetch_one("SELECT request_hash, status_code, content_type, body FROM idempotency_keys WHERE key_hash = %s",
+                                 (key_hash,))
+    return False, row
+
+
+async def _store(key_hash, request_hash, status, content_type, body):
+    async with apool.connection() as db:
+        await db.execute(
+            "UPDATE idempotency_keys SET status_code = %s, content_type = %s, body = %s, expires_at = %s WHERE key_hash = %s",
+            (status, content_type, body, timestamp(IDEMPOTENCY_TTL_HOURS * 3600), key_hash))
+        await db.commit()
+    front_cache.set(key_hash, (request_hash, status, content_type, body))
+    idempotency_stats["stored"] += 1
+
+
+async def _release(key_hash):
+    async with apool.connection() as db:
+        await db.execute("DELETE FROM idempotency_keys WHERE key_hash = %s AND status_code IS NULL", (key_hash,))
+        await db.commit()
+
+
+class IdempotencyMiddleware:
+    # Middleware ASGI puro para escrituras con cabecera Idempotency-Key: la primera petición se ejecuta y su
+    # respuesta (si no es un 5xx) se guarda; las repeticiones con la misma clave y el mismo cuerpo la reciben
+    # tal cual, sin volver a ejecutar nada
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in WRITE_METHODS:
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope.get("headers", ()))
+        key = headers.get(b"idempotency-key")
+        if not key:
+            await self.app(scope, receive, send)
+            return
+        if len(key) > 255:
+            await _send(send, *_json_response(400, "Idempotency-Key demasiado larga"))
+            return
+
+        # La clave vale para un cliente, un método y una ruta; el cuerpo se compara aparte
+        identity = b"|".join(headers.get(name, b"") for name in IDENTITY_HEADERS)
+        path = scope["path"].encode() + b"?" + scope.get("query_string", b"")
+        key_hash = hashlib.sha256(b"\n".join((identity, scope["method"].encode(), path, key))).hexdigest()
+        messages, body = [], b""
+        while True:
+            message = await receive()
+            messages.append(message)
+            body += message.get("body", b"")
+            if message["type"] != "http.request" or not message.get("more_body"):
+                break
+        request_hash = hashlib.sha256(body).hexdigest()
+
+        stored = front_cache.get(key_hash)
+        if stored is None:
+            claimed, row = await _claim(key_hash, request_hash)
+            if not claimed:
+                stored = (row["request_hash"], row["status_code"], row["content_type"], row["body"])
+                if row["status_code"] is None and row["request_hash"] == request_hash:
+                    idempotency_stats["conflicts"] += 1
+                    await _send(send, *_json_response(409, "La petición original con esta Idempotency-Key sigue en curso",
+                                                      [(b"retry-after", b"1")]))
+                    return
+                if row["status_code"] is not None:
+                    front_cache.set(key_hash, stored)
+        else:
+            claimed = False
+        if not claimed:
+            if stored[0] != request_hash:
+                idempotency_stats["mismatches"] += 1
+                await _send(send, *_json_response(422, "Idempotency-Key ya usada con un cuerpo distinto"))
+                return
+            idempotency_stats["replayed"] += 1
+            await _send(send, *_replay(stored))
+            return
+
+        async def replay_receive():
+            # El cuerpo ya se ha leído: se entrega a la aplicación tal como llegó
+            if messages:
+                return messages.pop(0)
+            return await receive()
+
+        response = {"status": 500, "content_type": None, "chunks": [], "size": 0}
+
+        async def capture_send(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+                response["content_type"] = dict(message.get("headers", ())).get(b"content-type", b"").decode() or None
+            elif message["type"] == "http.response.body" and response["size"] <= IDEMPOTENCY_MAX_BODY:
+                response["chunks"].append(message.get("body", b""))
+                response["size"] += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, replay_receive, capture_send)
+        except BaseException:
+            await _release(key_hash)
+            raise
+        body_out = b"".join(response["chunks"])
+        if response["status"] >= 500 or response["size"] > IDEMPOTENCY_MAX_BODY:
+            await _release(key_hash)
+            return
+        try:
+            await _store(key_hash, request_hash, response["status"], response["content_type"], body_out.decode())
+        except UnicodeDecodeError:
+            await _release(key_hash)
+
+
+@periodic(3600)
+async def remove_expired_keys():
+    async with apool.connection() as db:
+        await db.execute("DELETE FROM idempotency_keys WHERE expires_at < %s", (timestamp(),))
+        await db.commit()
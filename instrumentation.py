@@ -0,0 +1,126 @@
+import logging
+import os
+import re
+import time
+from contextvars import ContextVar
+from functools import lru_cache
+
+from db_async import checkout_listeners, query_listeners
+
+logger = logging.getLogger("taskmanager.slow_query")
+
+# Consultas que tardan más de SLOW_QUERY_MS milisegundos se registran con el SQL normalizado
+SLOW_QUERY_SECONDS = float(os.getenv("SLOW_QUERY_MS", "200")) / 1000
+# Con SERVER_TIMING=1 cada respuesta incluye la cabecera Server-Timing (visible en las devtools del navegador)
+SERVER_TIMING = os.getenv("SERVER_TIMING", "0") == "1"
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class RequestStats:
+    __slots__ = ("queries", "db_seconds", "checkout_seconds")
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.checkout_seconds = 0.0
+
+    def server_timing(self, total_seconds):
+        return (f'db;dur={self.db_seconds * 1000:.1f};desc="{self.queries} consultas", '
+                f"pool;dur={self.checkout_seconds * 1000:.1f}, app;dur={total_seconds * 1000:.1f}")
+
+
+class RouteStats:
+    def __init__(self):
+        self.count = 0
+        self.seconds_sum = 0.0
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.checkout_seconds = 0.0
+
+    def observe(self, seconds, request):
+        self.count += 1
+        self.seconds_sum += seconds
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+        self.queries += request.queries
+        self.db_seconds += request.db_seconds
+        self.checkout_seconds += request.checkout_seconds
+
+
+# (método, plantilla de ruta, código de estado) -> RouteStats
+route_stats = {}
+query_stats = {"queries": 0, "seconds": 0.0, "slow": 0}
+
+_current = ContextVar("request_stats", default=None)
+
+
+@lru_cache(maxsize=1024)
+def normalize_sql(sql):
+    # Quita los valores para agrupar en el log las consultas que solo difieren en parámetros
+    sql = " ".join(sql.split())
+    sql = re.sub(r"'(?:[^']|'')*'", "?", sql)
+    sql = re.sub(r"\b\d+(?:\.\d+)?\b", "?", sql)
+    sql = sql.replace("%s", "?")
+    # Listas IN (...) y filas de un INSERT multi-fila de cualquier longitud
+    sql = re.sub(r"\(\s*\?(?:\s*,\s*\?)+\s*\)", "(?, ...)", sql)
+    return re.sub(r"(\((?:\?, \.\.\.|\?)\))(?:\s*,\s*\1)+", r"\1, ...", sql)
+
+
+def record_query(sql, params, seconds):
+    query_stats["queries"] += 1
+    query_stats["seconds"] += seconds
+    stats = _current.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.db_seconds += seconds
+    if seconds >= SLOW_QUERY_SECONDS:
+        query_stats["slow"] += 1
+        logger.warning("Consulta lenta (%.1f ms): %s", seconds * 1000, normalize_sql(sql))
+
+
+def record_checkout(seconds):
+    stats = _current.get()
+    if stats is not None:
+        stats.checkout_seconds += seconds
+
+
+query_listeners.append(record_query)
+checkout_listeners.append(record_checkout)
+
+
+class InstrumentationMiddleware:
+    # Middleware ASGI puro: no envuelve la respuesta, así que funciona también con StreamingResponse
+    def __init__(self, app, server_timing=SERVER_TIMING):
+        self.app = app
+        self.server_timing = server_timing
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        stats = RequestStats()
+        token = _current.set(stats)
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if self.server_timing:
+                    header = stats.server_timing(time.perf_counter() - start).encode()
+                    message = {**message, "headers": list(message.get("headers", [])) + [(b"server-timing", header)]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _current.reset(token)
+            # La plantilla (/tasks/{task_id}) y no la ruta concreta, para no crear una serie por id
+            route = getattr(scope.get("route"), "path", "sin_ruta")
+            key = (scope["method"], route, status)
+            if key not in route_stats:
+                route_stats[key] = RouteStats()
+            route_stats[key].observe(time.perf_counter() - start, stats)
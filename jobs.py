@@ -0,0 +1,249 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+from datetime import datetime, timedelta, timezone
+
+from db_async import apool
+from serialization import dumps
+
+logger = logging.getLogger(__name__)
+
+# Con JOBS_WORKER=0 el proceso encola y ejecuta las tareas periódicas, pero no ejecuta trabajos
+JOBS_WORKER = os.getenv("JOBS_WORKER", "1") != "0"
+# Trabajos que un proceso ejecuta a la vez
+JOBS_CONCURRENCY = int(os.getenv("JOBS_CONCURRENCY", "4"))
+# Sin trabajos listos se vuelve a mirar la tabla cada JOBS_POLL_INTERVAL segundos (antes si se encola aquí)
+JOBS_POLL_INTERVAL = float(os.getenv("JOBS_POLL_INTERVAL", "1"))
+# Reintentos: espera base * 2^(intento - 1), con un máximo, más un reparto aleatorio de hasta el 20 %
+JOBS_BACKOFF_BASE = float(os.getenv("JOBS_BACKOFF_BASE", "5"))
+JOBS_BACKOFF_MAX = float(os.getenv("JOBS_BACKOFF_MAX", "600"))
+# Los trabajos terminados se borran pasado este tiempo; los fallidos se conservan para revisarlos
+JOBS_RETENTION_HOURS = float(os.getenv("JOBS_RETENTION_HOURS", "24"))
+DEPTH_INTERVAL = 5.0
+
+job_stats = {"enqueued": 0, "started": 0, "completed": 0, "retried": 0, "failed": 0}
+# (tipo, estado) -> trabajos en cola o en ejecución en toda la base de datos, no solo en este proceso
+queue_depth = {}
+
+
+class Handler:
+    def __init__(self, fn, concurrency, timeout, max_attempts):
+        self.fn = fn
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+
+
+handlers = {}
+# [intervalo en segundos, función, próxima ejecución]
+periodic_tasks = []
+
+
+def job(kind, concurrency=None, timeout=300, max_attempts=5):
+    # Registra el manejador de un tipo de trabajo; recibe el payload y devuelve un resultado serializable
+    def register(fn):
+        handlers[kind] = Handler(fn, concurrency or JOBS_CONCURRENCY, timeout, max_attempts)
+        return fn
+    return register
+
+
+def periodic(seconds):
+    # Función que el worker llama cada `seconds` segundos, normalmente para encolar un trabajo
+    def register(fn):
+        periodic_tasks.append([seconds, fn, time.monotonic() + seconds])
+        return fn
+    return register
+
+
+def schedule(kind, seconds, payload=None):
+    # Encola `kind` cada `seconds` segundos. Con varios procesos, el primero que llega en cada intervalo lo
+    # encola y el resto ve el trabajo reciente; dedupe_key evita dos copias en cola si coinciden
+    async def enqueue_if_due():
+        async with apool.connection() as db:
+            recent = await db.fetch_one("SELECT id FROM jobs WHERE kind = %s AND run_at > %s LIMIT 1",
+                                        (kind, timestamp(-seconds * 0.9)))
+        if recent is None:
+            await enqueue(kind, payload, dedupe_key=kind)
+    periodic(seconds)(enqueue_if_due)
+
+
+def timestamp(delay=0.0):
+    # UTC con precisión de segundos; el mismo formato sirve en MySQL y se compara bien como texto en SQLite
+    return (datetime.now(timezone.utc) + timedelta(seconds=delay)).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def backoff(attempts):
+    delay = min(JOBS_BACKOFF_BASE * 2 ** (attempts - 1), JOBS_BACKOFF_MAX)
+    return delay * (1 + random.random() * 0.2)
+
+
+async def enqueue(kind, payload=None, *, delay=0.0, dedupe_key=None, max_attempts=None, db=None):
+    # Con db se inserta en la transacción de quien llama, que hace el commit; sin db se usa una conexión propia.
+    # Devuelve el id del trabajo, o None si ya había uno en cola con la misma dedupe_key
+    max_attempts = max_attempts or (handlers[kind].max_attempts if kind in handlers else 5)
+    sql = ("INSERT IGNORE INTO jobs (kind, payload, status, max_attempts, run_at, dedupe_key) "
+           "VALUES (%s, %s, 'queued', %s, %s, %s)")
+    params = (kind, dumps(payload).decode(), max_attempts, timestamp(delay), dedupe_key)
+    if db is None:
+        async with apool.connection() as own:
+            result = await own.execute(sql, params)
+            await own.commit()
+    else:
+        result = await db.execute(sql, params)
+    if not result.rowcount:
+        return None
+    job_stats["enqueued"] += 1
+    worker.wake()
+    return result.lastrowid
+
+
+class JobWorker:
+    def __init__(self, concurrency=JOBS_CONCURRENCY):
+        self.concurrency = concurrency
+        self.running = {}
+        self._wakeup = None
+        self._loop_task = None
+        self._next_depth = 0.0
+        self._next_cleanup = 0.0
+
+    def wake(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def start(self):
+        if self._loop_task is None:
+            self._wakeup = asyncio.Event()
+            self._loop_task = asyncio.get_running_loop().create_task(self._loop())
+
+    async def stop(self, grace=10.0):
+        # Deja terminar los trabajos en curso; los que no acaben vuelven a la cola cuando caduca su bloqueo
+        if self._loop_task is None:
+            return
+        self._loop_task.cancel()
+        self._loop_task = None
+        tasks = [task for task, _ in self.running.values()]
+        if tasks:
+            await asyncio.wait(tasks, timeout=grace)
+            for task in tasks:
+                task.cancel()
+
+    def _busy_kinds(self):
+        in_flight = {}
+        for _, kind in self.running.values():
+            in_flight[kind] = in_flight.get(kind, 0) + 1
+        return {kind for kind, count in in_flight.items() if count >= handlers[kind].concurrency}
+
+    async def _loop(self):
+        while True:
+            try:
+                await self._tick()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Error en el worker de trabajos: %s", e)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), JOBS_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def _tick(self):
+        now = time.monotonic()
+        for task in periodic_tasks:
+            if now >= task[2]:
+                task[2] = now + task[0]
+                try:
+                    await task[1]()
+                except Exception as e:
+                    logger.error("Error en la tarea periódica %s: %s", task[1].__qualname__, e)
+        if now >= self._next_depth:
+            self._next_depth = now + DEPTH_INTERVAL
+            await self._refresh_depth()
+        if now >= self._next_cleanup:
+            self._next_cleanup = now + 3600
+            await self._cleanup()
+        if JOBS_WORKER:
+            await self._claim()
+
+    async def _claim(self):
+        free = self.concurrency - len(self.running)
+        kinds = [kind for kind in handlers if kind not in self._busy_kinds()]
+        if free <= 0 or not kinds:
+            return
+        now = timestamp()
+        kind_list = ", ".join(["%s"] * len(kinds))
+        # Listos para ejecutar, o en ejecución con el bloqueo caducado (el proceso que los tenía se cayó)
+        ready = f"""
+            SELECT id, kind, payload, attempts, max_attempts FROM jobs
+            WHERE ((status = 'queued' AND run_at <= %s) OR (status = 'running' AND locked_until < %s))
+              AND kind IN ({kind_list})
+            ORDER BY run_at LIMIT %s
+        """
+        async with apool.connection() as db:
+            candidates = await db.fetch_all(ready, (now, now, *kinds, free))
+            for row in candidates:
+                handler = handlers[row["kind"]]
+                if row["kind"] in self._busy_kinds():
+                    continue
+                # El UPDATE condicional hace de reserva: si otro proceso se adelantó, rowcount es 0
+                claimed = await db.execute("""
+                    UPDATE jobs SET status = 'running', attempts = attempts + 1, locked_until = %s, dedupe_key = NULL
+                    WHERE id = %s AND (status = 'queued' OR (status = 'running' AND locked_until < %s))
+                """, (timestamp(handler.timeout + 60), row["id"], now))
+                await db.commit()
+                if claimed.rowcount:
+                    row["attempts"] += 1
+                    task = asyncio.get_running_loop().create_task(self._run(row, handler))
+                    self.running[row["id"]] = (task, row["kind"])
+
+    async def _run(self, row, handler):
+        job_stats["started"] += 1
+        try:
+            payload = json.loads(row["payload"]) if row["payload"] else None
+            result = await asyncio.wait_for(handler.fn(payload), handler.timeout)
+            await self._finish(row["id"], "done", result=dumps(result).decode())
+            job_stats["completed"] += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            if row["attempts"] >= row["max_attempts"]:
+                logger.error("Trabajo %s (%s) fallido tras %s intentos: %s", row["id"], row["kind"], row["attempts"], error)
+                await self._finish(row["id"], "failed", error=error)
+                job_stats["failed"] += 1
+            else:
+                logger.warning("Trabajo %s (%s) fallido, se reintentará: %s", row["id"], row["kind"], error)
+                await self._finish(row["id"], "queued", error=error, delay=backoff(row["attempts"]))
+                job_stats["retried"] += 1
+        finally:
+            self.running.pop(row["id"], None)
+            self.wake()
+
+    async def _finish(self, job_id, status, result=None, error=None, delay=0.0):
+        async with apool.connection() as db:
+            await db.execute(
+                "UPDATE jobs SET status = %s, result = %s, last_error = %s, run_at = %s, locked_until = NULL WHERE id = %s",
+                (status, result, error, timestamp(delay), job_id))
+            await db.commit()
+
+    async def _refresh_depth(self):
+        async with apool.connection() as db:
+            rows = await db.fetch_all("""
+                SELECT kind, status, COUNT(*) AS count FROM jobs
+                WHERE status IN ('queued', 'running') GROUP BY kind, status
+            """)
+        queue_depth.clear()
+        for row in rows:
+            queue_depth[(row["kind"], row["status"])] = int(row["count"])
+
+    async def _cleanup(self):
+        cutoff = timestamp(-JOBS_RETENTION_HOURS * 3600)
+        async with apool.connection() as db:
+            await db.execute("DELETE FROM jobs WHERE status = 'done' AND run_at < %s", (cutoff,))
+            await db.commit()
+
+
+worker = JobWorker()
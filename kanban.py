@@ -0,0 +1,209 @@
+import os
+
+from fastapi import HTTPException
+
+from db_async import apool
+from events import publish
+from jobs import enqueue, job, schedule
+from project_progress import for_update
+
+KANBAN_COLUMNS = ("todo", "in-progress", "review", "completed")
+# Columna inicial según el estado, para las tareas que ya existían y las de scripts/seed.py
+STATUS_COLUMNS = {"in_progress": "in-progress", "completed": "completed"}
+
+# Claves de orden: texto en base 36 que se compara byte a byte (ascii_bin en MySQL, BINARY en SQLite) y se lee
+# como una fracción 0.xxx. Nunca acaban en '0', así que siempre cabe otra clave entre dos distintas
+RANK_DIGITS = "0123456789abcdefghijklmnopqrstuvwxyz"
+RANK_BASE = len(RANK_DIGITS)
+# Añadir al final incrementa la clave en esta posición: miles de tareas seguidas sin que la clave crezca
+RANK_APPEND_WIDTH = 4
+# Las columnas con alguna clave más larga (o sin clave) se reparten de nuevo en segundo plano
+RANK_REBALANCE_LENGTH = int(os.getenv("RANK_REBALANCE_LENGTH", "24"))
+# Cada cuántos segundos se buscan columnas que repartir (0 lo desactiva; mover una tarea lo pide igualmente)
+KANBAN_REBALANCE_INTERVAL = float(os.getenv("KANBAN_REBALANCE_INTERVAL", "600"))
+REBALANCE_BATCH = 100
+
+
+def _value(key, width):
+    value = 0
+    for char in key.ljust(width, "0"):
+        value = value * RANK_BASE + RANK_DIGITS.index(char)
+    return value
+
+
+def _key(value, width):
+    chars = []
+    for _ in range(width):
+        value, digit = divmod(value, RANK_BASE)
+        chars.append(RANK_DIGITS[digit])
+    return "".join(reversed(chars)).rstrip("0")
+
+
+def rank_between(before=None, after=None):
+    # Clave estrictamente entre `before` y `after` (None: sin límite). Crece un carácter solo si no hay hueco
+    low = before or ""
+    if after is not None and low >= after:
+        raise ValueError(f"rango de claves vacío: {before!r} >= {after!r}")
+    key = []
+    i = 0
+    while True:
+        digit_low = RANK_DIGITS.index(low[i]) if i < len(low) else 0
+        digit_high = RANK_DIGITS.index(after[i]) if after is not None and i < len(after) else RANK_BASE
+        if digit_high - digit_low > 1:
+            key.append(RANK_DIGITS[(digit_low + digit_high) // 2])
+            return "".join(key)
+        key.append(RANK_DIGITS[digit_low])
+        if digit_high != digit_low:
+            # Dígitos consecutivos: se conserva el menor y se busca por encima del resto de `before`
+            after = None
+        i += 1
+
+
+def rank_after(before):
+    # Clave para el final de una columna: el siguiente valor a RANK_APPEND_WIDTH dígitos
+    if before is None:
+        return rank_between()
+    width = max(len(before), RANK_APPEND_WIDTH)
+    value = _value(before, width) + 1
+    if value >= RANK_BASE ** width:
+        return rank_between(before)
+    return _key(value, width)
+
+
+def spaced_rank(index, count):
+    # Clave de la posición `index` entre `count` repartidas por igual en la mitad inferior del espacio:
+    # ~36 huecos entre cada dos y la mitad superior libre para añadir al final
+    width = 1
+    while RANK_BASE ** width < 2 * RANK_BASE * (count + 1):
+        width += 1
+    step = RANK_BASE ** width // (2 * (count + 1))
+    return _key((index + 1) * step, width)
+
+
+def column_where(project_id, column):
+    if project_id is None:
+        return "project_id IS NULL AND kanban_column = %s", (column,)
+    return "project_id = %s AND kanban_column = %s", (project_id, column)
+
+
+def check_column(column):
+    if column not in KANBAN_COLUMNS:
+        raise HTTPException(status_code=400, detail=f"Columna no válida; use una de: {', '.join(KANBAN_COLUMNS)}")
+
+
+async def last_rank(db, project_id, column):
+    # Última clave de la columna, con el final de la columna bloqueado hasta el commit: dos altas simultáneas
+    # en la misma columna se esperan en vez de calcular la misma clave
+    where, params = column_where(project_id, column)
+    row = await db.fetch_one(
+        f"SELECT rank_key FROM tasks WHERE {where} AND rank_key IS NOT NULL ORDER BY rank_key DESC LIMIT 1{for_update(db)}",
+        params)
+    return row["rank_key"] if row else None
+
+
+async def check_appended(db, project_id, column, ranks):
+    # Tras el commit de un alta al final de la columna. En una columna vacía no hay fila que bloquear y dos altas
+    # pueden coincidir: si en el tramo de claves escrito hay más tareas de las propias, se reparte la columna
+    where, params = column_where(project_id, column)
+    row = await db.fetch_one(f"SELECT COUNT(*) AS count FROM tasks WHERE {where} AND rank_key >= %s AND rank_key <= %s",
+                             params + (min(ranks), max(ranks)))
+    if int(row["count"]) > len(ranks):
+        await request_rebalance(project_id, column)
+
+
+async def rebalance_column(db, project_id, column):
+    # Reparte de nuevo las claves de una columna sin cambiar el orden. Las tareas sin clave (insertadas
+    # directamente en la tabla) van primero, igual que en ?sort=rank_key: MySQL y SQLite ordenan NULL primero.
+    # updated_at = updated_at evita que MySQL lo cambie: el contenido de las tareas no cambia
+    where, params = column_where(project_id, column)
+    rows = await db.fetch_all(f"SELECT id FROM tasks WHERE {where} ORDER BY rank_key, id{for_update(db)}",
+                              params)
+    await db.executemany("UPDATE tasks SET rank_key = %s, updated_at = updated_at WHERE id = %s",
+                         [(spaced_rank(index, len(rows)), row["id"]) for index, row in enumerate(rows)])
+    return len(rows)
+
+
+async def _neighbor(db, task_id, project_id, column):
+    row = await db.fetch_one(f"SELECT project_id, kanban_column, rank_key FROM tasks WHERE id = %s{for_update(db)}", (task_id,))
+    if row is None or row["project_id"] != project_id or row["kanban_column"] != column:
+        raise HTTPException(status_code=409, detail=f"La tarea {task_id} no está en la columna de destino")
+    return row["rank_key"]
+
+
+async def _bounds(db, task, column, after_id, before_id, order):
+    # (clave anterior, clave siguiente) del hueco de destino, sin contar la propia tarea
+    where, params = column_where(task["project_id"], column)
+    where += " AND id <> %s"
+    params += (task["id"],)
+    lock = for_update(db)
+    if after_id is not None or before_id is not None:
+        low = await _neighbor(db, after_id, task["project_id"], column) if after_id is not None else None
+        high = await _neighbor(db, before_id, task["project_id"], column) if before_id is not None else None
+        if before_id is None:
+            row = await db.fetch_one(f"SELECT MIN(rank_key) AS rank_key FROM tasks WHERE {where} AND rank_key > %s{lock}",
+                                     params + (low,))
+            high = row["rank_key"]
+        elif after_id is None:
+            row = await db.fetch_one(f"SELECT MAX(rank_key) AS rank_key FROM tasks WHERE {where} AND rank_key < %s{lock}",
+                                     params + (high,))
+            low = row["rank_key"]
+        return low, high
+    if order is not None:
+        # Posición como la envía el frontend Pro: se leen las dos tareas que quedarán alrededor
+        rows = await db.fetch_all(f"SELECT rank_key FROM tasks WHERE {where} ORDER BY rank_key, id LIMIT 2 OFFSET %s{lock}",
+                                  params + (max(order - 1, 0),))
+        ranks = [row["rank_key"] for row in rows]
+        if order == 0:
+            return None, ranks[0] if ranks else None
+        return (ranks[0] if ranks else await last_rank(db, task["project_id"], column)), (ranks[1] if len(ranks) > 1 else None)
+    return await last_rank(db, task["project_id"], column), None
+
+
+async def rank_for_move(db, task, column, after_id=None, before_id=None, order=None):
+    # Dentro de la transacción del movimiento, con la fila de la tarea ya bloqueada
+    if task["id"] in (after_id, before_id):
+        raise HTTPException(status_code=400, detail="Una tarea no puede ser su propia vecina")
+    where, params = column_where(task["project_id"], column)
+    unranked = await db.fetch_one(f"SELECT id FROM tasks WHERE {where} AND rank_key IS NULL LIMIT 1", params)
+    if unranked is not None:
+        await rebalance_column(db, task["project_id"], column)
+    for _ in range(2):
+        low, high = await _bounds(db, task, column, after_id, before_id, order)
+        if low is None or high is None or low < high:
+            return rank_after(low) if high is None else rank_between(low, high)
+        if after_id is not None and before_id is not None and low > high:
+            raise HTTPException(status_code=409, detail="after_id y before_id están en orden inverso")
+        # Dos vecinas con la misma clave (movimientos simultáneos): se reparte la columna y se vuelve a calcular
+        await rebalance_column(db, task["project_id"], column)
+    raise HTTPException(status_code=409, detail="No se pudo calcular la posición; vuelva a intentarlo")
+
+
+async def request_rebalance(project_id, column):
+    await enqueue("kanban.rebalance", {"project_id": project_id, "column": column},
+                  dedupe_key=f"kanban.rebalance:{project_id}:{column}")
+
+
+@job("kanban.rebalance", concurrency=1)
+async def rebalance_job(payload):
+    # Con payload, una columna concreta; sin él, las columnas con claves largas o sin clave
+    total = 0
+    async with apool.connection() as db:
+        if payload:
+            columns = [(payload["project_id"], payload["column"])]
+        else:
+            rows = await db.fetch_all("""
+                SELECT DISTINCT project_id, kanban_column FROM tasks
+                WHERE rank_key IS NULL OR LENGTH(rank_key) > %s LIMIT %s
+            """, (RANK_REBALANCE_LENGTH, REBALANCE_BATCH))
+            columns = [(row["project_id"], row["kanban_column"]) for row in rows]
+        for project_id, column in columns:
+            total += await rebalance_column(db, project_id, column)
+            await db.commit()
+    # Las claves que tengan los clientes dejan de valer para ordenar: se avisa para que recarguen la columna
+    for project_id, column in columns:
+        await publish("kanban.rebalanced", project_id, column=column)
+    return {"columns": len(columns), "tasks": total}
+
+
+if KANBAN_REBALANCE_INTERVAL > 0:
+    schedule("kanban.rebalance", KANBAN_REBALANCE_INTERVAL)
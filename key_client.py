@@ -0,0 +1,63 @@
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Cliente de db_service para gateways que no corren dentro de main:app (allí basta con
+# key_validation.require_api_key). Reutiliza conexiones keep-alive y valida varias claves por llamada.
+KEY_SERVICE_URL = os.getenv("KEY_SERVICE_URL", "http://127.0.0.1:8001")
+KEY_SERVICE_POOL_SIZE = int(os.getenv("KEY_SERVICE_POOL_SIZE", "20"))
+KEY_SERVICE_TIMEOUT = float(os.getenv("KEY_SERVICE_TIMEOUT", "2"))
+
+
+class KeyServiceClient:
+    def __init__(self, base_url=KEY_SERVICE_URL, pool_size=KEY_SERVICE_POOL_SIZE, timeout=KEY_SERVICE_TIMEOUT):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.session = requests.Session()
+        # Validar es de solo lectura (salvo el contador de uso), así que se reintenta también el POST
+        # ante errores de conexión; pool_maxsize conexiones abiertas como mucho por host
+        retry = Retry(total=2, connect=2, read=0, backoff_factor=0.05, allowed_methods=frozenset({"GET", "POST"}))
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True, max_retries=retry)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def validate(self, key):
+        # {"valid": ..., "allowed": ...}; el 429 del servicio (clave válida pero sin fichas) pasa a allowed=False
+        response = self.session.get(f"{self.base_url}/validate-key", params={"key": key}, timeout=self.timeout)
+        if response.status_code == 429:
+            return {"valid": True, "allowed": False, "retry_after": int(response.headers.get("Retry-After", "1"))}
+        response.raise_for_status()
+        result = response.json()
+        if result["valid"]:
+            result["allowed"] = True
+        return result
+
+    def validate_many(self, keys, batch_size=1000):
+        # Una llamada a /validate-keys por cada `batch_size` claves; resultados en el mismo orden que `keys`
+        keys = list(keys)
+        results = []
+        for start in range(0, len(keys), batch_size):
+            response = self.session.post(f"{self.base_url}/validate-keys", json={"keys": keys[start:start + batch_size]},
+                                         timeout=self.timeout)
+            response.raise_for_status()
+            results.extend(response.json()["results"])
+        return results
+
+    def close(self):
+        self.session.close()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    # Un cliente por proceso: así todas las llamadas comparten el mismo pool de conexiones
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = KeyServiceClient()
+        return _client
@@ -0,0 +1,232 @@
+import asyncio
+import hashlib
+import logging
+import os
+import time
+
+from fastapi import HTTPException, Security
+from fastapi.security import APIKeyHeader
+
+import events
+from cache import TTLCache
+from db_async import apool
+from jobs import enqueue, job, periodic, timestamp
+
+logger = logging.getLogger(__name__)
+
+# Las claves válidas se recuerdan APIKEY_CACHE_TTL segundos y las inexistentes APIKEY_NEGATIVE_TTL,
+# para frenar ataques de fuerza bruta sin ocultar demasiado tiempo una clave recién creada.
+KEY_CACHE_TTL = float(os.getenv("APIKEY_CACHE_TTL", "60"))
+KEY_NEGATIVE_TTL = float(os.getenv("APIKEY_NEGATIVE_TTL", "5"))
+KEY_CACHE_SIZE = int(os.getenv("APIKEY_CACHE_SIZE", "10000"))
+# Las inexistentes van en una caché aparte y más pequeña: una avalancha de claves inventadas no expulsa a las válidas
+KEY_NEGATIVE_CACHE_SIZE = int(os.getenv("APIKEY_NEGATIVE_CACHE_SIZE", "1000"))
+# Cada cuántos segundos se pasa a la cola de trabajos el uso acumulado en memoria
+KEY_USAGE_FLUSH_INTERVAL = float(os.getenv("APIKEY_USAGE_FLUSH_INTERVAL", "30"))
+# Canal privado del broker de eventos (no se expone por SSE) por el que los procesos se avisan de las
+# claves creadas o revocadas; cada cuánto se comprueba que la suscripción sigue viva
+INVALIDATION_CHANNEL = "apikeys"
+INVALIDATION_CHECK_INTERVAL = 30.0
+
+key_cache = TTLCache(maxsize=KEY_CACHE_SIZE, ttl=KEY_CACHE_TTL)
+negative_cache = TTLCache(maxsize=KEY_NEGATIVE_CACHE_SIZE, ttl=KEY_NEGATIVE_TTL)
+key_cache_stats = {"hits": 0, "negative_hits": 0, "misses": 0, "invalidations": 0}
+
+_MISSING = object()
+KEY_COLUMNS = "id, user_id, name, rate_limit_per_minute, daily_quota"
+# Máximo de claves por consulta IN en lookup_keys
+KEY_BATCH_SIZE = 500
+
+# hash de clave -> instante de su última invalidación; una búsqueda que empezó antes no guarda su resultado
+_invalidated = {}
+INVALIDATED_KEEP_SECONDS = 60.0
+
+# id de clave -> usos desde el último volcado
+_usage = {}
+
+
+def key_hash(key: str) -> str:
+    # La caché se indexa por el hash: la clave en claro no queda en memoria
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def _cached(digest):
+    # Fila de la clave, None si se sabe que no existe o _MISSING si no está en ninguna de las dos cachés
+    row = key_cache.get(digest, _MISSING)
+    if row is _MISSING and negative_cache.get(digest, _MISSING) is None:
+        return None
+    return row
+
+
+def _clear_caches():
+    key_cache.clear()
+    negative_cache.clear()
+
+
+def _cache_result(digest, row, started):
+    # Si la clave se invalidó mientras se consultaba (revocada en otro proceso, p. ej. durante un lote largo de
+    # /validate-keys), la fila leída puede ser anterior: se devuelve pero no se guarda
+    if _invalidated.get(digest, 0.0) >= started:
+        return
+    if row:
+        key_cache.set(digest, row)
+    else:
+        negative_cache.set(digest, None)
+
+
+def _forget(digest):
+    now = time.monotonic()
+    key_cache.pop(digest)
+    negative_cache.pop(digest)
+    _invalidated[digest] = now
+    if len(_invalidated) > KEY_CACHE_SIZE:
+        for stale in [d for d, at in _invalidated.items() if now - at > INVALIDATED_KEEP_SECONDS]:
+            del _invalidated[stale]
+
+
+async def lookup_key(key: str, db=None):
+    digest = key_hash(key)
+    cached = _cached(digest)
+    if cached is not _MISSING:
+        key_cache_stats["hits" if cached else "negative_hits"] += 1
+        return cached
+    key_cache_stats["misses"] += 1
+    started = time.monotonic()
+    sql = f"SELECT {KEY_COLUMNS} FROM api_keys WHERE api_key = %s"
+    if db is None:
+        async with apool.connection() as db:
+            row = await db.fetch_one(sql, (key,))
+    else:
+        row = await db.fetch_one(sql, (key,))
+    _cache_result(digest, row, started)
+    return row
+
+
+async def lookup_keys(keys, db=None):
+    # Varias claves a la vez: las que no están en caché se buscan con una sola consulta por lote.
+    # Devuelve {clave: fila o None}
+    found, missing = {}, []
+    for key in dict.fromkeys(keys):
+        cached = _cached(key_hash(key))
+        if cached is _MISSING:
+            missing.append(key)
+        else:
+            key_cache_stats["hits" if cached else "negative_hits"] += 1
+            found[key] = cached
+    if not missing:
+        return found
+    key_cache_stats["misses"] += len(missing)
+    started = time.monotonic()
+
+    async def fetch(db):
+        for start in range(0, len(missing), KEY_BATCH_SIZE):
+            batch = missing[start:start + KEY_BATCH_SIZE]
+            rows = await db.fetch_all(
+                f"SELECT api_key, {KEY_COLUMNS} FROM api_keys WHERE api_key IN ({', '.join(['%s'] * len(batch))})",
+                tuple(batch))
+            by_key = {row.pop("api_key"): row for row in rows}
+            for key in batch:
+                row = by_key.get(key)
+                _cache_result(key_hash(key), row, started)
+                found[key] = row
+
+    if db is None:
+        async with apool.connection() as db:
+            await fetch(db)
+    else:
+        await fetch(db)
+    return found
+
+
+async def invalidate_key(key: str):
+    # Se borra aquí y se avisa al resto de procesos (main:app y db_service:app) por el broker de eventos
+    digest = key_hash(key)
+    key_cache_stats["invalidations"] += 1
+    _forget(digest)
+    try:
+        await events.broker.publish(INVALIDATION_CHANNEL, {"type": "apikey.invalidated", "key_hash": digest})
+    except Exception as e:
+        logger.error("No se pudo publicar la invalidación de una API Key: %s", e)
+
+
+async def _listen_invalidations():
+    # Si la suscripción se pierde, lo que llegara entre medias tampoco se sabe: se vacía la caché entera
+    while True:
+        subscription = await events.broker.subscribe(INVALIDATION_CHANNEL)
+        try:
+            while True:
+                try:
+                    event = await subscription.get(INVALIDATION_CHECK_INTERVAL)
+                except asyncio.TimeoutError:
+                    if not events.broker.healthy():
+                        raise ConnectionError("suscripción del broker de eventos perdida")
+                    continue
+                if event["type"] == "resync":
+                    _clear_caches()
+                else:
+                    _forget(event["key_hash"])
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error("Error en las invalidaciones de API Keys: %s", e)
+            _clear_caches()
+            await asyncio.sleep(1)
+        finally:
+            subscription.close()
+
+
+_listener = None
+
+
+def start_invalidation_listener():
+    global _listener
+    if _listener is None:
+        _listener = asyncio.get_running_loop().create_task(_listen_invalidations())
+
+
+async def stop_invalidation_listener():
+    global _listener
+    if _listener is not None:
+        _listener.cancel()
+        _listener = None
+
+
+def record_usage(row):
+    # Solo un contador en memoria: la escritura en api_keys la hace un trabajo en segundo plano
+    _usage[row["id"]] = _usage.get(row["id"], 0) + 1
+
+
+api_key_header = APIKeyHeader(name="X-API-Key", auto_error=False)
+
+
+async def require_api_key(key: str = Security(api_key_header)):
+    # Dependencia para rutas de main:app que aceptan API keys: valida en este proceso, sin pasar por db_service.
+    # El uso lo cuenta RateLimitMiddleware, que ya ha buscado la misma clave en la caché
+    row = await lookup_key(key) if key else None
+    if not row:
+        raise HTTPException(status_code=401, detail="API Key no válida", headers={"WWW-Authenticate": "ApiKey"})
+    return row
+
+
+@periodic(KEY_USAGE_FLUSH_INTERVAL)
+async def flush_usage():
+    if not _usage:
+        return
+    counts = list(_usage.items())
+    _usage.clear()
+    try:
+        await enqueue("apikeys.usage", {"counts": counts, "at": timestamp()})
+    except Exception:
+        # Se devuelven a memoria para el siguiente volcado
+        for key_id, count in counts:
+            _usage[key_id] = _usage.get(key_id, 0) + count
+        raise
+
+
+@job("apikeys.usage", concurrency=1)
+async def apply_usage(payload):
+    async with apool.connection() as db:
+        await db.executemany("UPDATE api_keys SET usage_count = usage_count + %s, last_used_at = %s WHERE id = %s",
+                             [(count, payload["at"], key_id) for key_id, count in sorted(payload["counts"])])
+        await db.commit()
+    return {"keys": len(payload["counts"])}
@@ -1,4 +1,14 @@
+import logging
+import os
 from fastapi import FastAPI
+from fastapi.concurrency import run_in_threadpool
+from db import pool
+from db_async import ReplicaRoutingMiddleware, apool, replicas
+from migrations import check_on_startup
+import hashing
+from instrumentation import InstrumentationMiddleware
+from idempotency import IdempotencyMiddleware
+import ratelimit
 from routers.users import router as users_router
 from routers.tasks import router as tasks_router
 from routers.apikeys import router as apikeys_router
@@ -7,8 +17,22 @@ from routers.projects import router as projects_router
 from routers.team import router as team_router
 from routers.milestones import router as milestones_router
 from routers.stats import router as stats_router
+from routers.metrics import router as metrics_router
+from routers.events import router as events_router
+from routers.jobs import router as jobs_router
+import events
+from jobs import worker
+from key_validation import flush_usage, start_invalidation_listener, stop_invalidation_listener
+
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"), format="%(asctime)s %(levelname)s %(name)s: %(message)s")
 
 app = FastAPI(title="Task Manager Modular")
+# Idempotency primero (el más interno): la instrumentación también mide sus consultas. El limitador va
+# por fuera de Idempotency para que una petición rechazada con 429 no ocupe su Idempotency-Key
+app.add_middleware(IdempotencyMiddleware)
+app.add_middleware(ratelimit.RateLimitMiddleware)
+app.add_middleware(InstrumentationMiddleware)
+app.add_middleware(ReplicaRoutingMiddleware)
 
 app.include_router(users_router)
 app.include_router(tasks_router)
@@ -17,4 +41,27 @@ app.include_router(auth_router)
 app.include_router(projects_router)
 app.include_router(team_router)
 app.include_router(milestones_router)
-app.include_router(stats_router) 
\ No newline at end of file
+app.include_router(stats_router)
+app.include_router(metrics_router)
+app.include_router(events_router)
+app.include_router(jobs_router)
+
+@app.on_event("startup")
+async def startup():
+    await run_in_threadpool(check_on_startup)
+    worker.start()
+    replicas.start()
+    start_invalidation_listener()
+
+@app.on_event("shutdown")
+async def shutdown():
+    await worker.stop()
+    await stop_invalidation_listener()
+    # El uso de las API Keys acumulado desde el último volcado, antes de cerrar los pools
+    await flush_usage()
+    await events.broker.close()
+    await ratelimit.limiter.close()
+    await replicas.close_all()
+    await apool.close_all()
+    pool.close_all()
+    hashing.shutdown()
\ No newline at end of file
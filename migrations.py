@@ -0,0 +1,157 @@
+import argparse
+import logging
+import os
+import sys
+
+from db import DB_BACKEND, get_db, pool
+from models.user import create_users_table, add_users_token_version_column
+from models.apikey import create_apikeys_table, add_apikeys_usage_columns, add_apikeys_rate_limit_columns
+from models.project import create_projects_table, add_projects_indexes, add_projects_task_counters, add_projects_fulltext
+from models.teammember import create_team_members_table
+from models.project_team import create_project_team_table, add_project_team_indexes
+from models.task import create_tasks_table, add_tasks_project_column, add_tasks_time_columns, add_tasks_indexes, add_tasks_fulltext, add_tasks_kanban_columns
+from models.milestone import create_milestones_table, add_milestones_indexes
+from models.job import create_jobs_table
+from models.idempotency import create_idempotency_keys_table
+
+# Migraciones en orden: (versión, descripción, función que recibe la conexión).
+# Nunca se modifica una ya publicada; los cambios de esquema se añaden al final.
+MIGRATIONS = [
+    (1, "crear tabla users", create_users_table),
+    (2, "crear tabla api_keys", create_apikeys_table),
+    (3, "crear tabla projects", create_projects_table),
+    (4, "crear tabla team_members", create_team_members_table),
+    (5, "crear tabla project_team", create_project_team_table),
+    (6, "crear tabla tasks", create_tasks_table),
+    (7, "crear tabla milestones", create_milestones_table),
+    (8, "tasks.project_id", add_tasks_project_column),
+    (9, "tasks.time_spent y tasks.time_estimate", add_tasks_time_columns),
+    (10, "users.token_version", add_users_token_version_column),
+    (11, "índices de tasks", add_tasks_indexes),
+    (12, "índices de milestones", add_milestones_indexes),
+    (13, "índices de projects", add_projects_indexes),
+    (14, "índices de project_team", add_project_team_indexes),
+    (15, "projects.tasks_total y projects.tasks_completed", add_projects_task_counters),
+    (16, "índice de texto completo de tasks", add_tasks_fulltext),
+    (17, "índice de texto completo de projects", add_projects_fulltext),
+    (18, "crear tabla jobs", create_jobs_table),
+    (19, "api_keys.usage_count y api_keys.last_used_at", add_apikeys_usage_columns),
+    (20, "crear tabla idempotency_keys", create_idempotency_keys_table),
+    (21, "api_keys.rate_limit_per_minute y api_keys.daily_quota", add_apikeys_rate_limit_columns),
+    (22, "tasks.kanban_column y tasks.rank_key", add_tasks_kanban_columns),
+]
+
+LOCK_NAME = "taskmanager_schema_migrations"
+
+logger = logging.getLogger(__name__)
+
+
+def ensure_version_table(db):
+    cursor = db.cursor()
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INT PRIMARY KEY,
+            description VARCHAR(255) NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.close()
+    db.commit()
+
+
+def applied_versions(db):
+    cursor = db.cursor()
+    cursor.execute("SELECT version FROM schema_version")
+    versions = {row[0] for row in cursor.fetchall()}
+    cursor.close()
+    return versions
+
+
+def pending_migrations(db):
+    applied = applied_versions(db)
+    return [m for m in MIGRATIONS if m[0] not in applied]
+
+
+def _lock(db, acquire):
+    # Evita que dos despliegues simultáneos apliquen la misma migración (solo MySQL)
+    if DB_BACKEND == "sqlite":
+        return
+    cursor = db.cursor()
+    if acquire:
+        cursor.execute("SELECT GET_LOCK(%s, 60)", (LOCK_NAME,))
+        got_lock = cursor.fetchone()[0]
+        cursor.close()
+        if got_lock != 1:
+            raise RuntimeError("No se pudo obtener el bloqueo de migraciones")
+    else:
+        cursor.execute("SELECT RELEASE_LOCK(%s)", (LOCK_NAME,))
+        cursor.fetchone()
+        cursor.close()
+
+
+def upgrade(db, target=None):
+    ensure_version_table(db)
+    _lock(db, True)
+    applied = []
+    try:
+        for version, description, migrate in pending_migrations(db):
+            if target is not None and version > target:
+                break
+            migrate(db)
+            cursor = db.cursor()
+            cursor.execute("INSERT INTO schema_version (version, description) VALUES (%s, %s)", (version, description))
+            cursor.close()
+            db.commit()
+            applied.append((version, description))
+    finally:
+        _lock(db, False)
+    return applied
+
+
+def check_on_startup():
+    # Una sola conexión al arrancar: aplica las migraciones si DB_MIGRATE_ON_STARTUP=1,
+    # si no, solo avisa de las pendientes (se aplican en el despliegue con la CLI)
+    db = get_db()
+    if not db:
+        return
+    try:
+        if os.getenv("DB_MIGRATE_ON_STARTUP") == "1":
+            for version, description in upgrade(db):
+                logger.info("Migración %s aplicada: %s", version, description)
+            return
+        ensure_version_table(db)
+        pending = pending_migrations(db)
+        if pending:
+            logger.warning("Hay %s migraciones pendientes; ejecuta: python migrations.py upgrade", len(pending))
+    finally:
+        db.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Migraciones de esquema de la base de datos")
+    sub = parser.add_subparsers(dest="command", required=True)
+    up = sub.add_parser("upgrade", help="aplica las migraciones pendientes")
+    up.add_argument("--target", type=int, default=None, help="versión máxima a aplicar")
+    sub.add_parser("status", help="muestra las migraciones aplicadas y pendientes")
+    args = parser.parse_args(argv)
+
+    db = pool.acquire()
+    try:
+        if args.command == "upgrade":
+            applied = upgrade(db, args.target)
+            for version, description in applied:
+                print(f"{version:>4}  {description}")
+            print(f"{len(applied)} migraciones aplicadas")
+        else:
+            ensure_version_table(db)
+            applied = applied_versions(db)
+            for version, description, _ in MIGRATIONS:
+                state = "aplicada " if version in applied else "pendiente"
+                print(f"{version:>4}  {state}  {description}")
+    finally:
+        db.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
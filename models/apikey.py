@@ -1,5 +1,6 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import Optional
+from datetime import datetime
 
 def create_apikeys_table(db):
     cursor = db.cursor()
@@ -15,9 +16,33 @@ def create_apikeys_table(db):
     ''')
     cursor.close()
 
+def add_apikeys_usage_columns(db):
+    cursor = db.cursor()
+    # Uso acumulado de cada clave; key_validation.py lo escribe por lotes desde la cola de trabajos
+    cursor.execute("ALTER TABLE api_keys ADD COLUMN usage_count INT NOT NULL DEFAULT 0")
+    cursor.execute("ALTER TABLE api_keys ADD COLUMN last_used_at DATETIME NULL")
+    cursor.close()
+
+def add_apikeys_rate_limit_columns(db):
+    cursor = db.cursor()
+    # Límites propios de cada clave (ratelimit.py); NULL usa RATE_LIMIT_KEY_PER_MINUTE y sin cuota diaria
+    cursor.execute("ALTER TABLE api_keys ADD COLUMN rate_limit_per_minute INT NULL")
+    cursor.execute("ALTER TABLE api_keys ADD COLUMN daily_quota INT NULL")
+    cursor.close()
+
+class APIKeyLimits(BaseModel):
+    rate_limit_per_minute: Optional[int] = Field(None, ge=1)
+    daily_quota: Optional[int] = Field(None, ge=1)
+
 class APIKey(BaseModel):
-    id: Optional[int]
-    user_id: Optional[int]
+    id: Optional[int] = None
+    user_id: Optional[int] = None
     name: str
     api_key: str
-    created_at: Optional[str] 
\ No newline at end of file
+    created_at: Optional[datetime] = None
+    # Solo lectura
+    usage_count: Optional[int] = 0
+    last_used_at: Optional[datetime] = None 
+    # Se cambian con PATCH /apikeys/{id}/limits
+    rate_limit_per_minute: Optional[int] = None
+    daily_quota: Optional[int] = None
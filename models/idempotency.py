@@ -0,0 +1,16 @@
+def create_idempotency_keys_table(db):
+    cursor = db.cursor()
+    # Respuestas guardadas por Idempotency-Key (idempotency.py). status_code NULL: la petición original sigue en curso
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS idempotency_keys (
+            key_hash CHAR(64) PRIMARY KEY,
+            request_hash CHAR(64) NOT NULL,
+            status_code INT NULL,
+            content_type VARCHAR(100) NULL,
+            body MEDIUMTEXT NULL,
+            expires_at DATETIME NOT NULL
+        )
+    ''')
+    # Limpieza periódica de las caducadas
+    cursor.execute("CREATE INDEX idx_idempotency_keys_expires_at ON idempotency_keys (expires_at)")
+    cursor.close()
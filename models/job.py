@@ -0,0 +1,43 @@
+from pydantic import BaseModel
+from typing import Optional
+from datetime import datetime
+
+JOB_STATUSES = ('queued', 'running', 'done', 'failed')
+
+def create_jobs_table(db):
+    cursor = db.cursor()
+    # Cola de trabajos en segundo plano (jobs.py). dedupe_key solo se mantiene mientras el trabajo está en cola,
+    # así que un segundo enqueue con la misma clave no duplica un trabajo pendiente
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            kind VARCHAR(64) NOT NULL,
+            payload TEXT,
+            status ENUM('queued', 'running', 'done', 'failed') NOT NULL DEFAULT 'queued',
+            attempts INT NOT NULL DEFAULT 0,
+            max_attempts INT NOT NULL DEFAULT 5,
+            run_at DATETIME NOT NULL,
+            locked_until DATETIME NULL,
+            dedupe_key VARCHAR(191) NULL UNIQUE,
+            last_error TEXT,
+            result TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+        )
+    ''')
+    # Búsqueda de trabajos listos y recuento de la cola por estado
+    cursor.execute("CREATE INDEX idx_jobs_status_run_at ON jobs (status, run_at)")
+    cursor.close()
+
+class Job(BaseModel):
+    id: Optional[int] = None
+    kind: str
+    payload: Optional[str] = None
+    status: str
+    attempts: int
+    max_attempts: int
+    run_at: Optional[datetime] = None
+    last_error: Optional[str] = None
+    result: Optional[str] = None
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
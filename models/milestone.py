@@ -1 +1,28 @@
- 
\ No newline at end of file
+from pydantic import BaseModel
+from typing import Optional
+import datetime
+
+def create_milestones_table(db):
+    cursor = db.cursor()
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS milestones (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            projectId INT NOT NULL,
+            title VARCHAR(255) NOT NULL,
+            date DATE,
+            FOREIGN KEY (projectId) REFERENCES projects(id) ON DELETE CASCADE
+        )
+    ''')
+    cursor.close()
+
+def add_milestones_indexes(db):
+    cursor = db.cursor()
+    # Hitos de un proyecto ordenados o filtrados por fecha
+    cursor.execute("CREATE INDEX idx_milestones_project_date ON milestones (projectId, date)")
+    cursor.close()
+
+class Milestone(BaseModel):
+    id: Optional[int] = None
+    projectId: int
+    title: str
+    date: Optional[datetime.date] = None
\ No newline at end of file
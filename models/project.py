@@ -1,5 +1,7 @@
 from pydantic import BaseModel
 from typing import Optional
+from datetime import date
+from db import DB_BACKEND
 
 def create_projects_table(db):
     cursor = db.cursor()
@@ -17,12 +19,60 @@ def create_projects_table(db):
     ''')
     cursor.close()
 
+def add_projects_indexes(db):
+    cursor = db.cursor()
+    cursor.execute("CREATE INDEX idx_projects_status ON projects (status)")
+    cursor.close()
+
+def add_projects_task_counters(db):
+    cursor = db.cursor()
+    # Contadores mantenidos por project_progress.py; progress pasa a calcularse en el servidor.
+    # tasks_total no cuenta las tareas archivadas
+    cursor.execute("ALTER TABLE projects ADD COLUMN tasks_total INT NOT NULL DEFAULT 0")
+    cursor.execute("ALTER TABLE projects ADD COLUMN tasks_completed INT NOT NULL DEFAULT 0")
+    cursor.execute('''
+        UPDATE projects SET
+            tasks_total = (SELECT COUNT(*) FROM tasks WHERE tasks.project_id = projects.id AND tasks.status <> 'archived'),
+            tasks_completed = (SELECT COUNT(*) FROM tasks WHERE tasks.project_id = projects.id AND tasks.status = 'completed')
+    ''')
+    cursor.execute("UPDATE projects SET progress = CASE WHEN tasks_total > 0 THEN ROUND(100.0 * tasks_completed / tasks_total) ELSE 0 END")
+    cursor.close()
+
+def add_projects_fulltext(db):
+    cursor = db.cursor()
+    if DB_BACKEND == "sqlite":
+        # Igual que tasks_fts; el trigger de UPDATE solo salta con las columnas de texto, no con los contadores
+        cursor.execute("CREATE VIRTUAL TABLE projects_fts USING fts5(name, description, clientName, content='projects', content_rowid='id', prefix='2 3')")
+        cursor.execute('''
+            CREATE TRIGGER projects_fts_insert AFTER INSERT ON projects BEGIN
+                INSERT INTO projects_fts (rowid, name, description, clientName) VALUES (new.id, new.name, new.description, new.clientName);
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER projects_fts_delete AFTER DELETE ON projects BEGIN
+                INSERT INTO projects_fts (projects_fts, rowid, name, description, clientName) VALUES ('delete', old.id, old.name, old.description, old.clientName);
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER projects_fts_update AFTER UPDATE OF name, description, clientName ON projects BEGIN
+                INSERT INTO projects_fts (projects_fts, rowid, name, description, clientName) VALUES ('delete', old.id, old.name, old.description, old.clientName);
+                INSERT INTO projects_fts (rowid, name, description, clientName) VALUES (new.id, new.name, new.description, new.clientName);
+            END
+        ''')
+        cursor.execute("INSERT INTO projects_fts (projects_fts) VALUES ('rebuild')")
+    else:
+        cursor.execute("CREATE FULLTEXT INDEX ft_projects_text ON projects (name, description, clientName)")
+    cursor.close()
+
 class Project(BaseModel):
-    id: Optional[int]
+    id: Optional[int] = None
     name: str
     description: Optional[str] = None
     clientName: Optional[str] = None
-    startDate: Optional[str] = None
-    endDate: Optional[str] = None
+    startDate: Optional[date] = None
+    endDate: Optional[date] = None
     status: Optional[str] = 'active'
-    progress: Optional[int] = 0 
\ No newline at end of file
+    # Solo lectura: se calculan a partir de las tareas del proyecto
+    progress: Optional[int] = 0
+    tasks_total: Optional[int] = 0
+    tasks_completed: Optional[int] = 0 
\ No newline at end of file
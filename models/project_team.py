@@ -1 +1,18 @@
- 
\ No newline at end of file
+def create_project_team_table(db):
+    cursor = db.cursor()
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS project_team (
+            project_id INT NOT NULL,
+            team_member_id INT NOT NULL,
+            PRIMARY KEY (project_id, team_member_id),
+            FOREIGN KEY (project_id) REFERENCES projects(id) ON DELETE CASCADE,
+            FOREIGN KEY (team_member_id) REFERENCES team_members(id) ON DELETE CASCADE
+        )
+    ''')
+    cursor.close()
+
+def add_project_team_indexes(db):
+    cursor = db.cursor()
+    # La clave primaria cubre la búsqueda por proyecto; este índice cubre la inversa por miembro
+    cursor.execute("CREATE INDEX idx_project_team_member ON project_team (team_member_id, project_id)")
+    cursor.close()
@@ -1,5 +1,9 @@
 from pydantic import BaseModel
 from typing import Optional
+from datetime import date, datetime
+from db import DB_BACKEND
+
+TASK_STATUSES = ('pending', 'in_progress', 'completed', 'archived')
 
 def create_tasks_table(db):
     cursor = db.cursor()
@@ -18,12 +22,103 @@ def create_tasks_table(db):
     ''')
     cursor.close()
 
+def add_tasks_project_column(db):
+    cursor = db.cursor()
+    if DB_BACKEND == "sqlite":
+        cursor.execute("ALTER TABLE tasks ADD COLUMN project_id INT REFERENCES projects(id) ON DELETE CASCADE")
+    else:
+        cursor.execute('''
+            ALTER TABLE tasks
+                ADD COLUMN project_id INT NULL AFTER user_id,
+                ADD CONSTRAINT fk_tasks_project FOREIGN KEY (project_id) REFERENCES projects(id) ON DELETE CASCADE
+        ''')
+    cursor.close()
+
+def add_tasks_time_columns(db):
+    cursor = db.cursor()
+    # Minutos dedicados y estimados por tarea
+    cursor.execute("ALTER TABLE tasks ADD COLUMN time_spent INT NOT NULL DEFAULT 0")
+    cursor.execute("ALTER TABLE tasks ADD COLUMN time_estimate INT")
+    cursor.close()
+
+def add_tasks_indexes(db):
+    cursor = db.cursor()
+    # Solo status: el id implícito al final del índice sirve el ORDER BY id de los listados filtrados
+    cursor.execute("CREATE INDEX idx_tasks_status ON tasks (status)")
+    # Agregados de estadísticas por proyecto y usuario; time_spent al final para que los SUM sean cubiertos
+    cursor.execute("CREATE INDEX idx_tasks_project_status ON tasks (project_id, status, time_spent)")
+    cursor.execute("CREATE INDEX idx_tasks_user_status ON tasks (user_id, status, time_spent)")
+    # Orden por fecha en los listados paginados (el id implícito del índice desempata)
+    cursor.execute("CREATE INDEX idx_tasks_due_date ON tasks (due_date)")
+    cursor.execute("CREATE INDEX idx_tasks_created_at ON tasks (created_at)")
+    cursor.close()
+
+def add_tasks_fulltext(db):
+    cursor = db.cursor()
+    if DB_BACKEND == "sqlite":
+        # FTS5 con contenido externo: el índice guarda solo los términos y los triggers lo mantienen al día
+        cursor.execute("CREATE VIRTUAL TABLE tasks_fts USING fts5(title, description, content='tasks', content_rowid='id', prefix='2 3')")
+        cursor.execute('''
+            CREATE TRIGGER tasks_fts_insert AFTER INSERT ON tasks BEGIN
+                INSERT INTO tasks_fts (rowid, title, description) VALUES (new.id, new.title, new.description);
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER tasks_fts_delete AFTER DELETE ON tasks BEGIN
+                INSERT INTO tasks_fts (tasks_fts, rowid, title, description) VALUES ('delete', old.id, old.title, old.description);
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER tasks_fts_update AFTER UPDATE OF title, description ON tasks BEGIN
+                INSERT INTO tasks_fts (tasks_fts, rowid, title, description) VALUES ('delete', old.id, old.title, old.description);
+                INSERT INTO tasks_fts (rowid, title, description) VALUES (new.id, new.title, new.description);
+            END
+        ''')
+        cursor.execute("INSERT INTO tasks_fts (tasks_fts) VALUES ('rebuild')")
+    else:
+        cursor.execute("CREATE FULLTEXT INDEX ft_tasks_text ON tasks (title, description)")
+    cursor.close()
+
+def add_tasks_kanban_columns(db):
+    cursor = db.cursor()
+    # Tablero Kanban: columna y posición dentro de ella. rank_key es una clave lexicográfica (kanban.py), así que
+    # mover una tarea solo reescribe su fila; en MySQL se compara byte a byte, igual que en SQLite
+    rank_type = "VARCHAR(255)" if DB_BACKEND == "sqlite" else "VARCHAR(255) CHARACTER SET ascii COLLATE ascii_bin"
+    cursor.execute("ALTER TABLE tasks ADD COLUMN kanban_column VARCHAR(32) NOT NULL DEFAULT 'todo'")
+    cursor.execute(f"ALTER TABLE tasks ADD COLUMN rank_key {rank_type} NULL")
+    cursor.execute('''
+        UPDATE tasks SET kanban_column = CASE status WHEN 'in_progress' THEN 'in-progress'
+                                                     WHEN 'completed' THEN 'completed' ELSE 'todo' END
+    ''')
+    # Columnas del tablero en orden
+    cursor.execute("CREATE INDEX idx_tasks_kanban ON tasks (project_id, kanban_column, rank_key)")
+    # Las tareas existentes quedan en orden de creación dentro de cada columna, con las mismas claves repartidas
+    # que usa kanban.rebalance
+    from kanban import spaced_rank
+    cursor.execute("SELECT project_id, kanban_column, COUNT(*) FROM tasks GROUP BY project_id, kanban_column")
+    for project_id, column, count in cursor.fetchall():
+        if project_id is None:
+            cursor.execute("SELECT id FROM tasks WHERE project_id IS NULL AND kanban_column = %s ORDER BY id", (column,))
+        else:
+            cursor.execute("SELECT id FROM tasks WHERE project_id = %s AND kanban_column = %s ORDER BY id", (project_id, column))
+        ids = [row[0] for row in cursor.fetchall()]
+        for start in range(0, len(ids), 1000):
+            cursor.executemany("UPDATE tasks SET rank_key = %s, updated_at = updated_at WHERE id = %s",
+                               [(spaced_rank(index, count), ids[index]) for index in range(start, min(start + 1000, len(ids)))])
+    cursor.close()
+
 class Task(BaseModel):
-    id: Optional[int]
+    id: Optional[int] = None
     user_id: int
+    project_id: Optional[int] = None
     title: str
-    description: Optional[str]
+    description: Optional[str] = None
     status: Optional[str] = 'pending'
-    due_date: Optional[str]
-    created_at: Optional[str]
-    updated_at: Optional[str] 
\ No newline at end of file
+    due_date: Optional[date] = None
+    time_spent: Optional[int] = 0
+    time_estimate: Optional[int] = None
+    kanban_column: Optional[str] = 'todo'
+    # Solo lectura: lo asigna el servidor al crear y al mover (POST /tasks/{id}/move)
+    rank_key: Optional[str] = None
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None 
\ No newline at end of file
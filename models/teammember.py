@@ -13,6 +13,6 @@ def create_team_members_table(db):
     cursor.close()
 
 class TeamMember(BaseModel):
-    id: Optional[int]
+    id: Optional[int] = None
     name: str
     avatarUrl: Optional[str] = None 
\ No newline at end of file
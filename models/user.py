@@ -1,5 +1,6 @@
 from pydantic import BaseModel
 from typing import Optional
+from datetime import datetime
 
 def create_users_table(db):
     cursor = db.cursor()
@@ -15,10 +16,16 @@ def create_users_table(db):
     ''')
     cursor.close()
 
+def add_users_token_version_column(db):
+    cursor = db.cursor()
+    # Se incrementa para revocar todos los tokens emitidos a un usuario
+    cursor.execute("ALTER TABLE users ADD COLUMN token_version INT NOT NULL DEFAULT 0")
+    cursor.close()
+
 class User(BaseModel):
-    id: Optional[int]
+    id: Optional[int] = None
     username: str
     password_hash: str
     email: str
     role: Optional[str] = 'user'
-    created_at: Optional[str] 
\ No newline at end of file
+    created_at: Optional[datetime] = None 
\ No newline at end of file
@@ -0,0 +1,109 @@
+from typing import Any, Dict, List, Optional
+
+from fastapi import HTTPException, Query
+from pydantic import BaseModel
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 500
+
+
+class Page(BaseModel):
+    items: List[Dict[str, Any]]
+    # id del último elemento; se pasa como ?after= para pedir la página siguiente
+    next_after: Optional[int] = None
+    limit: int
+
+
+class PageParams:
+    # Parámetros comunes de los listados: ?after=&limit=&sort=&fields=
+    def __init__(
+        self,
+        after: Optional[int] = Query(None, description="id del último elemento de la página anterior"),
+        limit: int = Query(DEFAULT_LIMIT, ge=1, le=MAX_LIMIT),
+        sort: str = Query("id", description="columna de orden; prefijo '-' para descendente"),
+        fields: Optional[str] = Query(None, description="columnas a devolver separadas por comas"),
+    ):
+        self.after = after
+        self.limit = limit
+        self.sort = sort
+        self.fields = fields
+
+
+class Filters:
+    def __init__(self):
+        self.clauses = []
+        self.params = []
+
+    def add(self, clause, *params):
+        self.clauses.append(clause)
+        self.params.extend(params)
+
+    def eq(self, column, value):
+        if value is not None:
+            self.add(f"{column} = %s", value)
+
+    def range(self, column, start, end):
+        if start is not None:
+            self.add(f"{column} >= %s", start)
+        if end is not None:
+            self.add(f"{column} <= %s", end)
+
+
+def parse_fields(fields, model):
+    if not fields:
+        return list(model.model_fields)
+    columns = [f.strip() for f in fields.split(",") if f.strip()]
+    unknown = [c for c in columns if c not in model.model_fields]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Campos no válidos: {', '.join(unknown)}")
+    if "id" not in columns:
+        columns.insert(0, "id")
+    return columns
+
+
+def parse_sort(sort, sortable):
+    desc = sort.startswith("-")
+    column = sort.lstrip("-")
+    if column not in sortable:
+        raise HTTPException(status_code=400, detail=f"Orden no válido; use uno de: {', '.join(sortable)}")
+    return column, desc
+
+
+def _keyset_clause(column, value, after, desc):
+    # MySQL y SQLite ordenan NULL primero en ASC y al final en DESC
+    if column == "id":
+        return ("id < %s" if desc else "id > %s"), [after]
+    if not desc:
+        if value is None:
+            return f"(({column} IS NULL AND id > %s) OR {column} IS NOT NULL)", [after]
+        return f"({column} > %s OR ({column} = %s AND id > %s))", [value, value, after]
+    if value is None:
+        return f"({column} IS NULL AND id < %s)", [after]
+    return f"({column} < %s OR ({column} = %s AND id < %s) OR {column} IS NULL)", [value, value, after]
+
+
+async def fetch_page(db, table, model, filters: Filters, page: PageParams, sortable):
+    columns = parse_fields(page.fields, model)
+    column, desc = parse_sort(page.sort, sortable)
+    clauses = list(filters.clauses)
+    params = list(filters.params)
+    if page.after is not None:
+        value = None
+        if column != "id":
+            row = await db.fetch_one(f"SELECT {column} FROM {table} WHERE id = %s", (page.after,))
+            if row is None:
+                raise HTTPException(status_code=400, detail="Cursor 'after' no válido")
+            value = row[column]
+        clause, clause_params = _keyset_clause(column, value, page.after, desc)
+        clauses.append(clause)
+        params.extend(clause_params)
+    where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+    direction = "DESC" if desc else "ASC"
+    order = f"id {direction}" if column == "id" else f"{column} {direction}, id {direction}"
+    rows = await db.fetch_all(
+        f"SELECT {', '.join(columns)} FROM {table}{where} ORDER BY {order} LIMIT %s",
+        tuple(params) + (page.limit + 1,),
+    )
+    next_after = rows[page.limit - 1]["id"] if len(rows) > page.limit else None
+    # Las filas vienen de la base de datos: se construye la página sin validar cada elemento
+    return Page.model_construct(items=rows[:page.limit], next_after=next_after, limit=page.limit)
@@ -0,0 +1,156 @@
+import argparse
+import asyncio
+import os
+import sys
+from collections import defaultdict
+
+from db import DB_BACKEND, pool
+from jobs import job, schedule
+from response_cache import bump
+
+# La reconciliación se encola como trabajo en segundo plano cada PROGRESS_RECONCILE_INTERVAL segundos (0 la desactiva)
+PROGRESS_RECONCILE_INTERVAL = float(os.getenv("PROGRESS_RECONCILE_INTERVAL", "3600"))
+
+# progress se asigna antes que los contadores: MySQL evalúa el SET de izquierda a derecha y SQLite usa
+# siempre los valores anteriores, así que en ambos casos la expresión ve los contadores sin actualizar
+APPLY_SQL = """
+    UPDATE projects SET
+        progress = CASE WHEN tasks_total + %s > 0
+                        THEN ROUND(100.0 * (tasks_completed + %s) / (tasks_total + %s)) ELSE 0 END,
+        tasks_total = tasks_total + %s,
+        tasks_completed = tasks_completed + %s
+    WHERE id = %s
+"""
+
+COUNT_SQL = """
+    SELECT project_id,
+           SUM(CASE WHEN status <> 'archived' THEN 1 ELSE 0 END) AS total,
+           SUM(CASE WHEN status = 'completed' THEN 1 ELSE 0 END) AS completed
+    FROM tasks WHERE project_id IN ({placeholders}) GROUP BY project_id
+"""
+
+
+def task_weight(status):
+    # (cuenta en el total, cuenta como completada); las archivadas no cuentan
+    if status == "archived":
+        return 0, 0
+    return 1, 1 if status == "completed" else 0
+
+
+def progress(total, completed):
+    # Redondeo hacia arriba en .5, igual que ROUND() en SQL
+    return int(100 * completed / total + 0.5) if total else 0
+
+
+def for_update(db):
+    # Bloquea las filas leídas hasta el commit; SQLite ya serializa las escrituras
+    return "" if db.backend == "sqlite" else " FOR UPDATE"
+
+
+class ProgressDeltas:
+    # Acumula los cambios de una transacción por proyecto para aplicarlos con un UPDATE por proyecto
+    def __init__(self):
+        self._deltas = defaultdict(lambda: [0, 0])
+
+    def add(self, project_id, status, sign=1):
+        if project_id is None:
+            return
+        total, completed = task_weight(status)
+        delta = self._deltas[project_id]
+        delta[0] += sign * total
+        delta[1] += sign * completed
+
+    def remove(self, project_id, status):
+        self.add(project_id, status, -1)
+
+    def changed(self):
+        return {project_id: delta for project_id, delta in self._deltas.items() if delta != [0, 0]}
+
+
+async def apply_deltas(db, deltas: ProgressDeltas):
+    # Dentro de la transacción de la escritura de tareas; en orden de id para no provocar interbloqueos
+    changed = deltas.changed()
+    if changed:
+        await db.executemany(APPLY_SQL, [(t, c, t, t, c, project_id) for project_id, (t, c) in sorted(changed.items())])
+    return sorted(changed)
+
+
+async def invalidate_projects(project_ids):
+    # Tras el commit: las respuestas cacheadas de estos proyectos (y los listados) incluyen progress
+    if project_ids:
+        await bump("projects", *(f"project:{project_id}" for project_id in project_ids))
+
+
+def reconcile(db, batch_size=500, repaired_ids=None):
+    # Recalcula los contadores desde tasks por lotes de proyectos y corrige los que se hayan desviado;
+    # si se pasa repaired_ids, se añaden los id corregidos
+    repaired = checked = 0
+    last_id = 0
+    while True:
+        cursor = db.cursor(dictionary=True)
+        lock = "" if DB_BACKEND == "sqlite" else " FOR UPDATE"
+        cursor.execute(f"SELECT id, tasks_total, tasks_completed, progress FROM projects WHERE id > %s ORDER BY id LIMIT %s{lock}",
+                       (last_id, batch_size))
+        projects = cursor.fetchall()
+        if not projects:
+            cursor.close()
+            db.commit()
+            break
+        ids = [p["id"] for p in projects]
+        cursor.execute(COUNT_SQL.format(placeholders=", ".join(["%s"] * len(ids))), tuple(ids))
+        counts = {row["project_id"]: (int(row["total"]), int(row["completed"])) for row in cursor.fetchall()}
+        updates = []
+        for p in projects:
+            total, completed = counts.get(p["id"], (0, 0))
+            expected = (total, completed, progress(total, completed))
+            if (p["tasks_total"], p["tasks_completed"], p["progress"]) != expected:
+                updates.append(expected + (p["id"],))
+        if updates:
+            if repaired_ids is not None:
+                repaired_ids.extend(u[-1] for u in updates)
+            cursor.executemany("UPDATE projects SET tasks_total = %s, tasks_completed = %s, progress = %s WHERE id = %s", updates)
+        cursor.close()
+        db.commit()
+        checked += len(projects)
+        repaired += len(updates)
+        last_id = ids[-1]
+    return checked, repaired
+
+
+@job("progress.reconcile", concurrency=1, timeout=3600, max_attempts=3)
+async def reconcile_job(payload):
+    repaired_ids = []
+
+    def run():
+        db = pool.acquire()
+        try:
+            return reconcile(db, (payload or {}).get("batch_size", 500), repaired_ids)
+        finally:
+            db.close()
+    checked, repaired = await asyncio.to_thread(run)
+    await invalidate_projects(repaired_ids)
+    return {"checked": checked, "repaired": repaired}
+
+
+if PROGRESS_RECONCILE_INTERVAL > 0:
+    schedule("progress.reconcile", PROGRESS_RECONCILE_INTERVAL)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Contadores de tareas y progreso de los proyectos")
+    sub = parser.add_subparsers(dest="command", required=True)
+    rec = sub.add_parser("reconcile", help="recalcula los contadores desde la tabla tasks")
+    rec.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args(argv)
+
+    db = pool.acquire()
+    try:
+        checked, repaired = reconcile(db, args.batch_size)
+        print(f"{checked} proyectos comprobados, {repaired} corregidos")
+    finally:
+        db.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,256 @@
+import logging
+import math
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+from jose import jwt, JWTError
+
+from db_async import ASYNC_DB_ERRORS
+from key_validation import lookup_key, record_usage
+from routers.auth import SECRET_KEY, ALGORITHM
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "1") != "0"
+# Con RATE_LIMIT_URL=redis://... los límites se comparten entre procesos; sin ella cada proceso cuenta por su cuenta
+RATE_LIMIT_URL = os.getenv("RATE_LIMIT_URL")
+# Peticiones por minuto por defecto; las claves pueden tener el suyo en api_keys.rate_limit_per_minute
+RATE_LIMIT_KEY_PER_MINUTE = int(os.getenv("RATE_LIMIT_KEY_PER_MINUTE", "600"))
+RATE_LIMIT_USER_PER_MINUTE = int(os.getenv("RATE_LIMIT_USER_PER_MINUTE", "300"))
+RATE_LIMIT_ANON_PER_MINUTE = int(os.getenv("RATE_LIMIT_ANON_PER_MINUTE", "120"))
+# Ráfaga permitida sobre el ritmo medio, como múltiplo del límite por minuto (1 = hasta un minuto de golpe)
+RATE_LIMIT_BURST = float(os.getenv("RATE_LIMIT_BURST", "1"))
+# Cubos en memoria como máximo; al pasarse se descarta el usado hace más tiempo (el más relleno)
+RATE_LIMIT_MAX_BUCKETS = int(os.getenv("RATE_LIMIT_MAX_BUCKETS", "100000"))
+EXEMPT_PATHS = ("/metrics", "/docs", "/redoc", "/openapi.json")
+KEY_PREFIX = "taskmanager:rl:"
+
+rate_limit_stats = {"allowed": 0, "limited": 0, "quota_exceeded": 0, "backend_errors": 0}
+
+
+class Limit:
+    def __init__(self, per_minute, daily_quota=None):
+        self.per_minute = per_minute
+        self.capacity = max(1.0, per_minute * RATE_LIMIT_BURST)
+        self.rate = per_minute / 60.0
+        self.daily_quota = daily_quota
+
+
+class Decision:
+    def __init__(self, allowed, limit, remaining, reset, retry_after=0, quota_used=None):
+        self.allowed = allowed
+        self.limit = limit
+        self.remaining = remaining
+        # Segundos hasta que el cubo vuelve a estar lleno
+        self.reset = reset
+        self.retry_after = retry_after
+        self.quota_used = quota_used
+
+    def headers(self):
+        headers = [(b"x-ratelimit-limit", str(self.limit.per_minute).encode()),
+                   (b"x-ratelimit-remaining", str(self.remaining).encode()),
+                   (b"x-ratelimit-reset", str(self.reset).encode())]
+        if self.limit.daily_quota is not None and self.quota_used is not None:
+            headers.append((b"x-ratelimit-quota-limit", str(self.limit.daily_quota).encode()))
+            headers.append((b"x-ratelimit-quota-remaining",
+                            str(max(0, self.limit.daily_quota - self.quota_used)).encode()))
+        if not self.allowed:
+            headers.append((b"retry-after", str(self.retry_after).encode()))
+        return headers
+
+
+def today():
+    return datetime.now(timezone.utc).strftime("%Y-%m-%d")
+
+
+def seconds_to_midnight():
+    now = datetime.now(timezone.utc)
+    return 86400 - (now.hour * 3600 + now.minute * 60 + now.second)
+
+
+def refill(tokens, updated, limit, now):
+    return min(limit.capacity, tokens + (now - updated) * limit.rate)
+
+
+class MemoryLimiter:
+    def __init__(self):
+        # identidad -> [fichas, instante de la última actualización], de la menos a la más reciente
+        self.buckets = OrderedDict()
+        # identidad -> peticiones contadas hoy para la cuota diaria
+        self.quotas = OrderedDict()
+        self.quota_day = None
+
+    async def take(self, identity, limit):
+        # (se ha gastado una ficha, fichas que quedan)
+        now = time.monotonic()
+        bucket = self.buckets.get(identity)
+        tokens = limit.capacity if bucket is None else refill(bucket[0], bucket[1], limit, now)
+        taken = tokens >= 1
+        if taken:
+            tokens -= 1
+        self.buckets[identity] = [tokens, now]
+        self.buckets.move_to_end(identity)
+        # Se descarta el cubo usado hace más tiempo, que es el que más se ha rellenado: coste constante aunque
+        # una avalancha de IP llene el límite
+        if len(self.buckets) > RATE_LIMIT_MAX_BUCKETS:
+            self.buckets.popitem(last=False)
+        return taken, tokens
+
+    async def count(self, identity):
+        day = today()
+        if day != self.quota_day:
+            self.quotas.clear()
+            self.quota_day = day
+        self.quotas[identity] = self.quotas.get(identity, 0) + 1
+        self.quotas.move_to_end(identity)
+        if len(self.quotas) > RATE_LIMIT_MAX_BUCKETS:
+            self.quotas.popitem(last=False)
+        return self.quotas[identity]
+
+    async def close(self):
+        pass
+
+
+# Recarga y gasto en un solo paso en el servidor, para que dos procesos no gasten la misma ficha.
+# Las fichas se devuelven como texto porque Redis trunca a entero los números de Lua
+TAKE_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local data = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(data[1]) or capacity
+local ts = tonumber(data[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local taken = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    taken = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+return {taken, tostring(tokens)}
+"""
+
+
+class RedisLimiter:
+    # Cualquier servidor compatible con el protocolo de Redis (Redis, Valkey, KeyDB...)
+    def __init__(self, url):
+        import redis.asyncio
+        self.client = redis.asyncio.from_url(url)
+        self.script = self.client.register_script(TAKE_SCRIPT)
+
+    async def take(self, identity, limit):
+        taken, tokens = await self.script(keys=[f"{KEY_PREFIX}{identity}"],
+                                          args=[limit.rate, limit.capacity, time.time()])
+        return bool(taken), float(tokens)
+
+    async def count(self, identity):
+        key = f"{KEY_PREFIX}quota:{identity}:{today()}"
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.incr(key)
+            pipe.expire(key, 2 * 86400)
+            used, _ = await pipe.execute()
+        return int(used)
+
+    async def close(self):
+        await self.client.aclose()
+
+
+limiter = RedisLimiter(RATE_LIMIT_URL) if RATE_LIMIT_URL else MemoryLimiter()
+
+
+async def check(identity, limit):
+    # Gasta una ficha de `identity` y, si quedaba, cuenta la petición en su cuota diaria
+    try:
+        taken, tokens = await limiter.take(identity, limit)
+        reset = math.ceil((limit.capacity - tokens) / limit.rate)
+        if not taken:
+            rate_limit_stats["limited"] += 1
+            return Decision(False, limit, 0, reset, retry_after=max(1, math.ceil((1 - tokens) / limit.rate)))
+        used = await limiter.count(identity) if limit.daily_quota is not None else None
+    except Exception as e:
+        # Sin el almacén compartido se deja pasar: un fallo de Redis no debe tumbar la API
+        rate_limit_stats["backend_errors"] += 1
+        logger.warning("Error en el limitador de peticiones: %s", e)
+        return Decision(True, limit, limit.per_minute, 0)
+    decision = Decision(True, limit, int(tokens), reset, quota_used=used)
+    if used is not None and used > limit.daily_quota:
+        rate_limit_stats["quota_exceeded"] += 1
+        decision.allowed = False
+        decision.retry_after = seconds_to_midnight()
+        return decision
+    rate_limit_stats["allowed"] += 1
+    return decision
+
+
+def key_limit(row):
+    return Limit(row.get("rate_limit_per_minute") or RATE_LIMIT_KEY_PER_MINUTE, row.get("daily_quota"))
+
+
+async def check_key(row):
+    return await check(f"key:{row['id']}", key_limit(row))
+
+
+async def identify(headers, client):
+    # API key válida, usuario del JWT o, si no hay ninguno, la IP. La clave sale de la caché de key_validation;
+    # el JWT solo se verifica (firma y caducidad), sin consultar la base de datos: la ruta hace el resto
+    api_key = headers.get(b"x-api-key")
+    if api_key:
+        try:
+            row = await lookup_key(api_key.decode("latin-1"))
+        except ASYNC_DB_ERRORS as e:
+            # Sin base de datos no se sabe de quién es la clave: se sigue con el JWT o la IP y la ruta responderá el error
+            logger.warning("No se pudo consultar la API key para el límite de peticiones: %s", e)
+            row = None
+        if row:
+            record_usage(row)
+            return f"key:{row['id']}", key_limit(row)
+    authorization = headers.get(b"authorization", b"").decode("latin-1")
+    if authorization[:7].lower() == "bearer ":
+        try:
+            payload = jwt.decode(authorization[7:], SECRET_KEY, algorithms=[ALGORITHM])
+        except JWTError:
+            payload = None
+        user = payload and (payload.get("uid") or payload.get("sub"))
+        if user:
+            return f"user:{user}", Limit(RATE_LIMIT_USER_PER_MINUTE)
+    return f"ip:{client[0] if client else 'unknown'}", Limit(RATE_LIMIT_ANON_PER_MINUTE)
+
+
+def _too_many(decision):
+    if decision.quota_used is not None and decision.quota_used > decision.limit.daily_quota:
+        detail = "Cuota diaria de peticiones agotada"
+    else:
+        detail = "Demasiadas peticiones"
+    body = ('{"detail":"%s"}' % detail).encode()
+    headers = [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()),
+               *decision.headers()]
+    return headers, body
+
+
+class RateLimitMiddleware:
+    # Middleware ASGI puro: cubo de fichas por API key, por usuario del JWT o por IP, con cabeceras X-RateLimit-*
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not RATE_LIMIT_ENABLED or scope["path"].startswith(EXEMPT_PATHS):
+            await self.app(scope, receive, send)
+            return
+        identity, limit = await identify(dict(scope.get("headers", ())), scope.get("client"))
+        decision = await check(identity, limit)
+        if not decision.allowed:
+            headers, body = _too_many(decision)
+            await send({"type": "http.response.start", "status": 429, "headers": headers})
+            await send({"type": "http.response.body", "body": body})
+            return
+        extra = decision.headers()
+
+        async def send_with_headers(message):
+            if message["type"] == "http.response.start":
+                message = {**message, "headers": [*message.get("headers", ()), *extra]}
+            await send(message)
+
+        await self.app(scope, receive, send_with_headers)
@@ -0,0 +1,111 @@
+import hashlib
+import json
+import os
+
+from fastapi import Request, Response
+
+from cache import TTLCache
+from serialization import dumps
+
+# Con RESPONSE_CACHE_URL=redis://... todos los workers comparten respuestas y versiones;
+# sin ella cada proceso usa su propia caché en memoria
+RESPONSE_CACHE_URL = os.getenv("RESPONSE_CACHE_URL")
+RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", "300"))
+# En memoria, una escritura solo incrementa las versiones de su proceso: con varios workers los demás sirven la
+# copia anterior hasta que caduca, así que sin Redis las respuestas se guardan poco tiempo
+RESPONSE_CACHE_LOCAL_TTL = int(os.getenv("RESPONSE_CACHE_LOCAL_TTL", "5"))
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "2048"))
+KEY_PREFIX = "taskmanager:"
+
+response_cache_stats = {"hits": 0, "misses": 0, "not_modified": 0, "bumps": 0}
+
+
+class MemoryBackend:
+    def __init__(self, maxsize=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_LOCAL_TTL):
+        self.payloads = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.versions = {}
+
+    async def versions_of(self, names):
+        return [self.versions.get(name, 0) for name in names]
+
+    async def bump(self, names):
+        for name in names:
+            self.versions[name] = self.versions.get(name, 0) + 1
+
+    async def get(self, key):
+        return self.payloads.get(key)
+
+    async def set(self, key, value):
+        self.payloads.set(key, value)
+
+    async def clear(self):
+        self.payloads.clear()
+        self.versions.clear()
+
+
+class RedisBackend:
+    # Cualquier servidor compatible con el protocolo de Redis (Redis, Valkey, KeyDB...)
+    def __init__(self, url):
+        import redis.asyncio
+        self.client = redis.asyncio.from_url(url)
+
+    async def versions_of(self, names):
+        values = await self.client.mget([f"{KEY_PREFIX}ver:{name}" for name in names])
+        return [int(value) if value is not None else 0 for value in values]
+
+    async def bump(self, names):
+        async with self.client.pipeline(transaction=False) as pipe:
+            for name in names:
+                pipe.incr(f"{KEY_PREFIX}ver:{name}")
+            await pipe.execute()
+
+    async def get(self, key):
+        value = await self.client.get(f"{KEY_PREFIX}resp:{key}")
+        return tuple(json.loads(value)) if value is not None else None
+
+    async def set(self, key, value):
+        await self.client.set(f"{KEY_PREFIX}resp:{key}", json.dumps(value), ex=RESPONSE_CACHE_TTL)
+
+    async def clear(self):
+        async for key in self.client.scan_iter(f"{KEY_PREFIX}*"):
+            await self.client.delete(key)
+
+
+backend = RedisBackend(RESPONSE_CACHE_URL) if RESPONSE_CACHE_URL else MemoryBackend()
+
+
+async def bump(*names):
+    # Se llama tras confirmar una escritura: las respuestas que dependen de estos recursos dejan de servirse
+    response_cache_stats["bumps"] += 1
+    await backend.bump(names)
+
+
+def _not_modified(request: Request, etag):
+    if_none_match = request.headers.get("if-none-match", "")
+    return etag in (tag.strip() for tag in if_none_match.split(",")) or if_none_match.strip() == "*"
+
+
+def _response(request: Request, body, etag):
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if _not_modified(request, etag):
+        response_cache_stats["not_modified"] += 1
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+async def cached_response(request: Request, resources, build):
+    # resources: nombres cuyas versiones forman parte de la clave (p. ej. "projects", "project:3");
+    # build: corrutina que genera el contenido si no está en caché
+    versions = await backend.versions_of(resources)
+    stamp = ",".join(f"{name}={version}" for name, version in zip(resources, versions))
+    key = f"{request.url.path}?{'&'.join(sorted(str(request.query_params).split('&')))}|{stamp}"
+    cached = await backend.get(key)
+    if cached is not None:
+        response_cache_stats["hits"] += 1
+        body, etag = cached
+        return _response(request, body.encode(), etag)
+    response_cache_stats["misses"] += 1
+    body = dumps(await build())
+    etag = f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+    await backend.set(key, (body.decode(), etag))
+    return _response(request, body, etag)
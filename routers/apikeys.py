@@ -1,48 +1,66 @@
 from fastapi import APIRouter, HTTPException, Request, Depends
 from fastapi.responses import HTMLResponse
-from models.apikey import APIKey, create_apikeys_table
-from db import get_db
+from models.apikey import APIKey, APIKeyLimits
+from db_async import get_adb
+from pagination import Page, PageParams, Filters, fetch_page
+from serialization import FastJSONResponse
+from typing import Optional
 from routers.auth import get_admin_user
+from key_validation import invalidate_key, require_api_key
 import secrets
 
 router = APIRouter(prefix="/apikeys", tags=["apikeys"])
 
-@router.on_event("startup")
-def startup():
-    db = get_db()
-    if db:
-        create_apikeys_table(db)
-        db.close()
-
 @router.post("/", response_model=APIKey)
-def create_apikey(apikey: APIKey):
-    db = get_db()
-    cursor = db.cursor()
-    cursor.execute("INSERT INTO api_keys (user_id, name, api_key) VALUES (%s, %s, %s)", (apikey.user_id, apikey.name, apikey.api_key))
-    db.commit()
-    apikey.id = cursor.lastrowid
-    cursor.close()
-    db.close()
+async def create_apikey(apikey: APIKey, db=Depends(get_adb)):
+    result = await db.execute("INSERT INTO api_keys (user_id, name, api_key) VALUES (%s, %s, %s)", (apikey.user_id, apikey.name, apikey.api_key))
+    await db.commit()
+    await invalidate_key(apikey.api_key)
+    apikey.id = result.lastrowid
     return apikey
 
-@router.get("/", response_model=list[APIKey])
-def list_apikeys():
-    db = get_db()
-    cursor = db.cursor(dictionary=True)
-    cursor.execute("SELECT * FROM api_keys")
-    apikeys = [APIKey(**row) for row in cursor.fetchall()]
-    cursor.close()
-    db.close()
-    return apikeys
+@router.get("/me")
+async def current_apikey(key: dict = Depends(require_api_key)):
+    # La clave de la cabecera X-API-Key, validada en este proceso (caché de key_validation)
+    return key
+
+APIKEY_SORTS = ("id", "created_at")
+
+def apikey_filters(user_id: Optional[int] = None):
+    filters = Filters()
+    filters.eq("user_id", user_id)
+    return filters
+
+@router.get("/", response_model=Page)
+async def list_apikeys(page: PageParams = Depends(), filters: Filters = Depends(apikey_filters), db=Depends(get_adb)):
+    return FastJSONResponse(await fetch_page(db, "api_keys", APIKey, filters, page, APIKEY_SORTS))
+
+@router.delete("/{apikey_id}")
+async def revoke_apikey(apikey_id: int, current_user: dict = Depends(get_admin_user), db=Depends(get_adb)):
+    row = await db.fetch_one("SELECT api_key FROM api_keys WHERE id = %s", (apikey_id,))
+    if not row:
+        raise HTTPException(status_code=404, detail="API Key no encontrada")
+    await db.execute("DELETE FROM api_keys WHERE id = %s", (apikey_id,))
+    await db.commit()
+    await invalidate_key(row["api_key"])
+    return {"ok": True}
+
+@router.patch("/{apikey_id}/limits", response_model=APIKey)
+async def update_apikey_limits(apikey_id: int, limits: APIKeyLimits, current_user: dict = Depends(get_admin_user), db=Depends(get_adb)):
+    # Un valor null vuelve al límite por defecto (o quita la cuota); el cambio se aplica al caducar la caché de claves
+    # en los demás procesos, en este de inmediato
+    await db.execute("UPDATE api_keys SET rate_limit_per_minute = %s, daily_quota = %s WHERE id = %s",
+                     (limits.rate_limit_per_minute, limits.daily_quota, apikey_id))
+    row = await db.fetch_one("SELECT * FROM api_keys WHERE id = %s", (apikey_id,))
+    await db.commit()
+    if not row:
+        raise HTTPException(status_code=404, detail="API Key no encontrada")
+    await invalidate_key(row["api_key"])
+    return APIKey(**row)
 
 @router.get("/panel", response_class=HTMLResponse)
-def apikey_panel(request: Request, current_user: dict = Depends(get_admin_user)):
-    db = get_db()
-    cursor = db.cursor(dictionary=True)
-    cursor.execute("SELECT * FROM api_keys")
-    apikeys = cursor.fetchall()
-    cursor.close()
-    db.close()
+async def apikey_panel(request: Request, current_user: dict = Depends(get_admin_user), db=Depends(get_adb)):
+    apikeys = await db.fetch_all("SELECT * FROM api_keys")
     html = """
     <html><head><title>Panel API Keys</title></head><body>
     <h1>Panel de API Keys</h1>
@@ -61,18 +79,15 @@ def apikey_panel(request: Request, current_user: dict = Depends(get_admin_user))
     return html
 
 @router.post("/panel/create", response_class=HTMLResponse)
-async def apikey_panel_create(request: Request, current_user: dict = Depends(get_admin_user)):
+async def apikey_panel_create(request: Request, current_user: dict = Depends(get_admin_user), db=Depends(get_adb)):
     form = await request.form()
     name = form.get("name")
     if not name:
         return "<p>Nombre requerido</p><a href='/apikeys/panel'>Volver</a>"
     new_key = secrets.token_urlsafe(24)
-    db = get_db()
-    cursor = db.cursor()
-    cursor.execute("INSERT INTO api_keys (name, api_key) VALUES (%s, %s)", (name, new_key))
-    db.commit()
-    cursor.close()
-    db.close()
+    await db.execute("INSERT INTO api_keys (name, api_key) VALUES (%s, %s)", (name, new_key))
+    await db.commit()
+    await invalidate_key(new_key)
     html = f"""
     <html><head><title>API Key creada</title></head><body>
     <h1>API Key creada</h1>
@@ -1,20 +1,28 @@
 from fastapi import APIRouter, HTTPException, Depends, status
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from pydantic import BaseModel
-from models.user import User, create_users_table
-from db import get_db
+from models.user import User
+from db_async import apool, get_adb
+from cache import TTLCache
 from jose import jwt, JWTError
-from passlib.context import CryptContext
+from hashing import hash_password, verify_and_update
 from typing import Optional
 from datetime import datetime, timedelta
+import os
 
 SECRET_KEY = "supersecretkey"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60
 
+# Por defecto se carga el usuario (con caché) en cada petición, así un cambio de rol se aplica en cuanto
+# caduca la caché. Con AUTH_TRUST_CLAIMS=1 se confía en uid/role firmados en el token y solo se comprueba
+# (con caché) que token_version no haya cambiado: el rol del token vale hasta que caduca o se revoca.
+AUTH_TRUST_CLAIMS = os.getenv("AUTH_TRUST_CLAIMS", "0") == "1"
+user_cache = TTLCache(maxsize=4096, ttl=float(os.getenv("AUTH_USER_CACHE_TTL", "30")))
+token_version_cache = TTLCache(maxsize=4096, ttl=float(os.getenv("AUTH_REVOCATION_CACHE_TTL", "30")))
+
 router = APIRouter(prefix="/auth", tags=["auth"])
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/token")
 
 class UserCreate(BaseModel):
@@ -31,33 +39,52 @@ class TokenData(BaseModel):
     username: Optional[str] = None
     role: Optional[str] = None
 
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
-
-def get_password_hash(password):
-    return pwd_context.hash(password)
-
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     expire = datetime.utcnow() + (expires_delta or timedelta(minutes=15))
     to_encode.update({"exp": expire})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
-def get_user_by_username(username: str):
-    db = get_db()
-    cursor = db.cursor(dictionary=True)
-    cursor.execute("SELECT * FROM users WHERE username = %s", (username,))
-    row = cursor.fetchone()
-    cursor.close()
-    db.close()
-    return row
-
-def authenticate_user(username: str, password: str):
-    user = get_user_by_username(username)
+async def get_user_by_username(db, username: str):
+    return await db.fetch_one("SELECT * FROM users WHERE username = %s", (username,))
+
+async def get_cached_user(username: str):
+    user = user_cache.get(username)
+    if user is None:
+        async with apool.connection() as db:
+            user = await get_user_by_username(db, username)
+        if user is not None:
+            user_cache.set(username, user)
+            token_version_cache.set(user["id"], user["token_version"])
+    return user
+
+async def get_token_version(user_id: int):
+    version = token_version_cache.get(user_id)
+    if version is None:
+        async with apool.connection() as db:
+            row = await db.fetch_one("SELECT token_version FROM users WHERE id = %s", (user_id,))
+        if row is None:
+            return None
+        version = row["token_version"]
+        token_version_cache.set(user_id, version)
+    return version
+
+def invalidate_user(username: str, user_id: int):
+    user_cache.pop(username)
+    token_version_cache.pop(user_id)
+
+async def authenticate_user(db, username: str, password: str):
+    user = await get_user_by_username(db, username)
     if not user:
         return False
-    if not verify_password(password, user["password_hash"]):
+    valid, new_hash = await verify_and_update(password, user["password_hash"])
+    if not valid:
         return False
+    if new_hash:
+        # El hash usaba un coste o esquema obsoleto: se reemplaza aprovechando la contraseña en claro
+        await db.execute("UPDATE users SET password_hash = %s WHERE id = %s", (new_hash, user["id"]))
+        await db.commit()
+        user_cache.pop(username)
     return user
 
 async def get_current_user(token: str = Depends(oauth2_scheme)):
@@ -75,8 +102,13 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
         token_data = TokenData(username=username, role=role)
     except JWTError:
         raise credentials_exception
-    user = get_user_by_username(token_data.username)
-    if user is None:
+    user_id = payload.get("uid")
+    if AUTH_TRUST_CLAIMS and user_id is not None and "ver" in payload:
+        if await get_token_version(user_id) != payload["ver"]:
+            raise credentials_exception
+        return {"id": user_id, "username": token_data.username, "role": token_data.role}
+    user = await get_cached_user(token_data.username)
+    if user is None or user["token_version"] != payload.get("ver", user["token_version"]):
         raise credentials_exception
     return user
 
@@ -90,38 +122,50 @@ async def get_admin_user(current_user: dict = Depends(get_current_user)):
     return current_user
 
 @router.post("/register", response_model=User)
-def register(user: UserCreate):
-    db = get_db()
-    create_users_table(db)
-    cursor = db.cursor()
-    cursor.execute("SELECT id FROM users WHERE username = %s OR email = %s", (user.username, user.email))
-    if cursor.fetchone():
-        cursor.close()
-        db.close()
+async def register(user: UserCreate, db=Depends(get_adb)):
+    if await db.fetch_one("SELECT id FROM users WHERE username = %s OR email = %s", (user.username, user.email)):
         raise HTTPException(status_code=400, detail="Usuario o email ya existe")
-    hashed_password = get_password_hash(user.password)
-    cursor.execute("INSERT INTO users (username, password_hash, email, role) VALUES (%s, %s, %s, %s)", (user.username, hashed_password, user.email, user.role))
-    db.commit()
-    user_id = cursor.lastrowid
-    cursor.close()
-    db.close()
+    hashed_password = await hash_password(user.password)
+    result = await db.execute("INSERT INTO users (username, password_hash, email, role) VALUES (%s, %s, %s, %s)", (user.username, hashed_password, user.email, user.role))
+    await db.commit()
+    user_id = result.lastrowid
     return User(id=user_id, username=user.username, password_hash=hashed_password, email=user.email, created_at=None)
 
 @router.post("/token", response_model=Token)
-def login(form_data: OAuth2PasswordRequestForm = Depends()):
-    user = authenticate_user(form_data.username, form_data.password)
+async def login(form_data: OAuth2PasswordRequestForm = Depends(), db=Depends(get_adb)):
+    user = await authenticate_user(db, form_data.username, form_data.password)
     if not user:
         raise HTTPException(status_code=400, detail="Usuario o contraseña incorrectos")
     access_token = create_access_token(
-        data={"sub": user["username"], "role": user["role"]},
+        data={"sub": user["username"], "role": user["role"], "uid": user["id"], "ver": user["token_version"]},
         expires_delta=timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     )
     return {"access_token": access_token, "token_type": "bearer"}
 
+@router.post("/revoke")
+async def revoke_tokens(user_id: Optional[int] = None, current_user: dict = Depends(get_current_user), db=Depends(get_adb)):
+    # Invalida todos los tokens emitidos al usuario (por defecto, el propio)
+    target = current_user["id"] if user_id is None else user_id
+    if target != current_user["id"] and current_user.get("role") != "admin":
+        raise HTTPException(status_code=403, detail="No tienes permisos de administrador")
+    row = await db.fetch_one("SELECT username FROM users WHERE id = %s", (target,))
+    if not row:
+        raise HTTPException(status_code=404, detail="Usuario no encontrado")
+    await db.execute("UPDATE users SET token_version = token_version + 1 WHERE id = %s", (target,))
+    await db.commit()
+    invalidate_user(row["username"], target)
+    return {"ok": True}
+
 @router.get("/me", response_model=User)
 async def read_users_me(current_user: dict = Depends(get_current_active_user)):
-    return User(**current_user)
+    user = await get_cached_user(current_user["username"])
+    if user is None:
+        raise HTTPException(status_code=404, detail="Usuario no encontrado")
+    return User(**user)
 
 @router.get("/admin", response_model=User)
 async def read_admin(current_user: dict = Depends(get_admin_user)):
-    return User(**current_user) 
\ No newline at end of file
+    user = await get_cached_user(current_user["username"])
+    if user is None:
+        raise HTTPException(status_code=404, detail="Usuario no encontrado")
+    return User(**user) 
\ No newline at end of file
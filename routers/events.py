@@ -0,0 +1,92 @@
+import asyncio
+import os
+from contextlib import aclosing
+from typing import Optional
+
+from fastapi import APIRouter, Header, Query, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
+
+from events import ALL, project_channel, replay_and_subscribe
+from serialization import dumps
+
+router = APIRouter(prefix="/api/events", tags=["events"])
+
+# Cada cuánto se manda un latido si no hay eventos, para que los proxies no cierren la conexión
+KEEPALIVE_SECONDS = float(os.getenv("EVENTS_KEEPALIVE_SECONDS", "15"))
+
+
+async def follow(channel, after):
+    # Histórico pendiente y después eventos en vivo, sin repetidos; None es un latido
+    subscription, backlog = await replay_and_subscribe(channel, after)
+    last = after or 0
+    try:
+        for event in backlog:
+            last = event.get("seq", last)
+            yield event
+        while True:
+            try:
+                event = await subscription.get(KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                yield None
+                continue
+            if "seq" in event:
+                if event["seq"] <= last:
+                    continue
+                last = event["seq"]
+            yield event
+    finally:
+        subscription.close()
+
+
+def sse_response(channel, after, last_event_id):
+    # EventSource reenvía Last-Event-ID al reconectar; ?after= sirve para la primera conexión
+    if after is None and last_event_id and last_event_id.isdigit():
+        after = int(last_event_id)
+
+    async def stream():
+        yield b"retry: 3000\n\n"
+        # aclosing: al cortarse la conexión la suscripción se cierra en el momento, no cuando pase el GC
+        async with aclosing(follow(channel, after)) as events:
+            async for event in events:
+                if event is None:
+                    yield b": keepalive\n\n"
+                    continue
+                head = f"id: {event['seq']}\n" if "seq" in event else ""
+                yield f"{head}event: {event['type']}\ndata: ".encode() + dumps(event) + b"\n\n"
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+async def websocket_feed(websocket: WebSocket, channel, after):
+    await websocket.accept()
+    try:
+        async with aclosing(follow(channel, after)) as events:
+            async for event in events:
+                if event is None:
+                    await websocket.send_json({"type": "keepalive"})
+                else:
+                    await websocket.send_text(dumps(event).decode())
+    except WebSocketDisconnect:
+        pass
+
+
+@router.get("/")
+async def all_events(after: Optional[int] = Query(None, ge=0), last_event_id: Optional[str] = Header(None)):
+    return sse_response(ALL, after, last_event_id)
+
+
+@router.get("/projects/{project_id}")
+async def project_events(project_id: int, after: Optional[int] = Query(None, ge=0),
+                         last_event_id: Optional[str] = Header(None)):
+    return sse_response(project_channel(project_id), after, last_event_id)
+
+
+@router.websocket("/ws")
+async def all_events_ws(websocket: WebSocket, after: Optional[int] = Query(None, ge=0)):
+    await websocket_feed(websocket, ALL, after)
+
+
+@router.websocket("/projects/{project_id}/ws")
+async def project_events_ws(websocket: WebSocket, project_id: int, after: Optional[int] = Query(None, ge=0)):
+    await websocket_feed(websocket, project_channel(project_id), after)
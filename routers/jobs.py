@@ -0,0 +1,63 @@
+import json
+import os
+from fastapi import APIRouter, HTTPException, Depends
+from fastapi.responses import FileResponse
+from models.job import Job, JOB_STATUSES
+from db_async import get_adb
+from pagination import Page, PageParams, Filters, fetch_page
+from serialization import FastJSONResponse
+from export import EXPORT_FORMATS, export_path
+from jobs import timestamp, worker
+from typing import Optional
+
+router = APIRouter(prefix="/api/jobs", tags=["jobs"])
+
+JOB_SORTS = ("id", "run_at")
+
+def job_filters(status: Optional[str] = None, kind: Optional[str] = None):
+    if status is not None and status not in JOB_STATUSES:
+        raise HTTPException(status_code=400, detail=f"Estado no válido; use uno de: {', '.join(JOB_STATUSES)}")
+    filters = Filters()
+    filters.eq("status", status)
+    filters.eq("kind", kind)
+    return filters
+
+async def get_job_row(db, job_id):
+    row = await db.fetch_one("SELECT * FROM jobs WHERE id = %s", (job_id,))
+    if not row:
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado")
+    return row
+
+@router.get("/", response_model=Page)
+async def list_jobs(page: PageParams = Depends(), filters: Filters = Depends(job_filters), db=Depends(get_adb)):
+    return FastJSONResponse(await fetch_page(db, "jobs", Job, filters, page, JOB_SORTS))
+
+@router.get("/{job_id}", response_model=Job)
+async def get_job(job_id: int, db=Depends(get_adb)):
+    return Job(**await get_job_row(db, job_id))
+
+@router.post("/{job_id}/retry", response_model=Job)
+async def retry_job(job_id: int, db=Depends(get_adb)):
+    # Solo los fallidos: vuelven a la cola con los intentos a cero
+    result = await db.execute("UPDATE jobs SET status = 'queued', attempts = 0, run_at = %s WHERE id = %s AND status = 'failed'",
+                              (timestamp(), job_id))
+    row = await get_job_row(db, job_id)
+    await db.commit()
+    if not result.rowcount:
+        raise HTTPException(status_code=409, detail="Solo se pueden reintentar trabajos fallidos")
+    worker.wake()
+    return Job(**row)
+
+@router.get("/{job_id}/download")
+async def download_export(job_id: int, db=Depends(get_adb)):
+    row = await get_job_row(db, job_id)
+    if row["kind"] != "export.generate":
+        raise HTTPException(status_code=404, detail="El trabajo no es una exportación")
+    if row["status"] != "done":
+        raise HTTPException(status_code=409, detail=f"La exportación no está lista (estado: {row['status']})")
+    name = json.loads(row["result"])["file"]
+    path = export_path(name)
+    if not os.path.exists(path):
+        raise HTTPException(status_code=410, detail="El fichero de la exportación ya no está disponible")
+    fmt = name.rsplit(".", 1)[-1]
+    return FileResponse(path, media_type=EXPORT_FORMATS[fmt], filename=name)
@@ -0,0 +1,152 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from db import pool
+from db_async import apool, replica_stats, replicas
+from key_validation import key_cache, key_cache_stats, negative_cache
+from hashing import HASH_WORKERS, HASH_QUEUE_LIMIT, hash_stats
+from response_cache import response_cache_stats
+from instrumentation import LATENCY_BUCKETS, query_stats, route_stats
+from events import event_stats
+from jobs import job_stats, queue_depth
+from idempotency import idempotency_stats
+from ratelimit import rate_limit_stats
+
+router = APIRouter(tags=["metrics"])
+
+POOL_GAUGES = [
+    ("db_pool_size", "gauge", "size"),
+    ("db_pool_connections_open", "gauge", "open"),
+    ("db_pool_connections_in_use", "gauge", "in_use"),
+    ("db_pool_connections_idle", "gauge", "idle"),
+    ("db_pool_waiting", "gauge", "waiting"),
+    ("db_pool_checkout_timeouts_total", "counter", "timeouts"),
+    ("db_pool_recycled_total", "counter", "recycled"),
+    ("db_pool_failed_health_checks_total", "counter", "failed_health_checks"),
+]
+
+def render_pool_metrics(pools: dict) -> str:
+    # pools: {"nombre del pool": snapshot de PoolStats}
+    lines = []
+    for metric, kind, key in POOL_GAUGES:
+        lines.append(f"# TYPE {metric} {kind}")
+        for name, stats in pools.items():
+            lines.append(f'{metric}{{pool="{name}"}} {stats[key]}')
+    lines.append("# TYPE db_pool_checkout_seconds histogram")
+    for name, stats in pools.items():
+        for bound, count in stats["checkout_buckets"]:
+            lines.append(f'db_pool_checkout_seconds_bucket{{pool="{name}",le="{bound}"}} {count}')
+        lines.append(f'db_pool_checkout_seconds_bucket{{pool="{name}",le="+Inf"}} {stats["checkouts"]}')
+        lines.append(f'db_pool_checkout_seconds_sum{{pool="{name}"}} {stats["checkout_seconds_sum"]}')
+        lines.append(f'db_pool_checkout_seconds_count{{pool="{name}"}} {stats["checkouts"]}')
+    return "\n".join(lines) + "\n"
+
+def render_replica_metrics() -> str:
+    lines = []
+    for name, value in replica_stats.items():
+        lines.append(f"# TYPE db_replica_{name}_total counter")
+        lines.append(f"db_replica_{name}_total {value}")
+    lines.append("# TYPE db_replica_healthy gauge")
+    lines.append("# TYPE db_replica_lag_seconds gauge")
+    for replica in replicas.replicas:
+        lines.append(f'db_replica_healthy{{replica="{replica.name}"}} {int(replica.healthy)}')
+        if replica.lag is not None:
+            lines.append(f'db_replica_lag_seconds{{replica="{replica.name}"}} {replica.lag}')
+    return "\n".join(lines) + "\n"
+
+def render_key_cache_metrics() -> str:
+    lines = [
+        "# TYPE apikey_cache_entries gauge",
+        f"apikey_cache_entries {len(key_cache)}",
+        "# TYPE apikey_negative_cache_entries gauge",
+        f"apikey_negative_cache_entries {len(negative_cache)}",
+    ]
+    for name, value in key_cache_stats.items():
+        lines.append(f"# TYPE apikey_cache_{name}_total counter")
+        lines.append(f"apikey_cache_{name}_total {value}")
+    return "\n".join(lines) + "\n"
+
+def render_hash_metrics() -> str:
+    lines = [
+        "# TYPE password_hash_capacity gauge",
+        f"password_hash_capacity {HASH_WORKERS + HASH_QUEUE_LIMIT}",
+        "# TYPE password_hash_in_flight gauge",
+        f"password_hash_in_flight {hash_stats['in_flight']}",
+    ]
+    for name in ("completed", "rejected", "rehashed"):
+        lines.append(f"# TYPE password_hash_{name}_total counter")
+        lines.append(f"password_hash_{name}_total {hash_stats[name]}")
+    return "\n".join(lines) + "\n"
+
+def render_response_cache_metrics() -> str:
+    lines = []
+    for name, value in response_cache_stats.items():
+        lines.append(f"# TYPE response_cache_{name}_total counter")
+        lines.append(f"response_cache_{name}_total {value}")
+    return "\n".join(lines) + "\n"
+
+def render_event_metrics() -> str:
+    lines = []
+    for name, value in event_stats.items():
+        if name == "subscribers":
+            lines.append("# TYPE events_subscribers gauge")
+            lines.append(f"events_subscribers {value}")
+        else:
+            lines.append(f"# TYPE events_{name}_total counter")
+            lines.append(f"events_{name}_total {value}")
+    return "\n".join(lines) + "\n"
+
+def render_job_metrics() -> str:
+    lines = []
+    for name, value in job_stats.items():
+        lines.append(f"# TYPE jobs_{name}_total counter")
+        lines.append(f"jobs_{name}_total {value}")
+    lines.append("# TYPE jobs_queue_depth gauge")
+    for (kind, status), count in sorted(queue_depth.items()):
+        lines.append(f'jobs_queue_depth{{kind="{kind}",status="{status}"}} {count}')
+    return "\n".join(lines) + "\n"
+
+def render_idempotency_metrics() -> str:
+    lines = []
+    for name, value in idempotency_stats.items():
+        lines.append(f"# TYPE idempotency_{name}_total counter")
+        lines.append(f"idempotency_{name}_total {value}")
+    return "\n".join(lines) + "\n"
+
+def render_rate_limit_metrics() -> str:
+    lines = []
+    for name, value in rate_limit_stats.items():
+        lines.append(f"# TYPE rate_limit_{name}_total counter")
+        lines.append(f"rate_limit_{name}_total {value}")
+    return "\n".join(lines) + "\n"
+
+def render_request_metrics() -> str:
+    lines = ["# TYPE http_request_duration_seconds histogram"]
+    series = sorted(route_stats.items(), key=lambda item: (item[0][1], item[0][0], item[0][2]))
+    for (method, route, status), stats in series:
+        labels = f'method="{method}",route="{route}",status="{status}"'
+        for bound, count in zip(LATENCY_BUCKETS, stats.buckets):
+            lines.append(f'http_request_duration_seconds_bucket{{{labels},le="{bound}"}} {count}')
+        lines.append(f'http_request_duration_seconds_bucket{{{labels},le="+Inf"}} {stats.count}')
+        lines.append(f"http_request_duration_seconds_sum{{{labels}}} {stats.seconds_sum}")
+        lines.append(f"http_request_duration_seconds_count{{{labels}}} {stats.count}")
+    # Totales por ruta: divididos entre _count dan consultas y tiempo de base de datos por petición
+    for metric, attr in (("http_request_db_queries_total", "queries"), ("http_request_db_seconds_total", "db_seconds"),
+                         ("http_request_db_checkout_seconds_total", "checkout_seconds")):
+        lines.append(f"# TYPE {metric} counter")
+        for (method, route, status), stats in series:
+            lines.append(f'{metric}{{method="{method}",route="{route}",status="{status}"}} {getattr(stats, attr)}')
+    lines += [
+        "# TYPE db_queries_total counter", f"db_queries_total {query_stats['queries']}",
+        "# TYPE db_query_seconds_total counter", f"db_query_seconds_total {query_stats['seconds']}",
+        "# TYPE db_slow_queries_total counter", f"db_slow_queries_total {query_stats['slow']}",
+    ]
+    return "\n".join(lines) + "\n"
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    # En el bucle de eventos, no en el threadpool: route_stats y queue_depth se modifican desde el bucle y
+    # recorrerlos desde otro hilo puede fallar con "dictionary changed size during iteration"
+    return (render_pool_metrics({"sync": pool.metrics(), "async": apool.metrics(), **replicas.metrics()})
+            + render_replica_metrics() + render_key_cache_metrics() + render_hash_metrics() + render_response_cache_metrics()
+            + render_event_metrics() + render_job_metrics()
+            + render_idempotency_metrics() + render_rate_limit_metrics() + render_request_metrics())
@@ -1,48 +1,60 @@
-from fastapi import APIRouter, HTTPException, Query
-from models.milestone import Milestone, create_milestones_table
-from db import get_db
-from typing import List, Optional
+from fastapi import APIRouter, HTTPException, Query, Depends
+from models.milestone import Milestone
+from db_async import get_adb
+from pagination import Page, PageParams, Filters, fetch_page
+from serialization import FastJSONResponse
+from events import publish
+from bulk import BulkItemResult, BulkResponse, build_response, existing_ids, insert_rows, reject_if_atomic, run_in_transaction, validate_items
+from datetime import date
+from typing import Any, Dict, List, Optional
 
 router = APIRouter(prefix="/api/milestones", tags=["milestones"])
 
-@router.on_event("startup")
-def startup():
-    db = get_db()
-    if db:
-        create_milestones_table(db)
-        db.close()
+MILESTONE_SORTS = ("id", "date")
 
-@router.get("/", response_model=List[Milestone])
-def list_milestones(projectId: Optional[int] = Query(None)):
-    db = get_db()
-    cursor = db.cursor(dictionary=True)
-    if projectId:
-        cursor.execute("SELECT * FROM milestones WHERE projectId=%s", (projectId,))
-    else:
-        cursor.execute("SELECT * FROM milestones")
-    milestones = [Milestone(**row) for row in cursor.fetchall()]
-    cursor.close()
-    db.close()
-    return milestones
+def milestone_filters(projectId: Optional[int] = Query(None), date_from: Optional[date] = None, date_to: Optional[date] = None):
+    filters = Filters()
+    filters.eq("projectId", projectId)
+    filters.range("date", date_from, date_to)
+    return filters
+
+@router.get("/", response_model=Page)
+async def list_milestones(page: PageParams = Depends(), filters: Filters = Depends(milestone_filters), db=Depends(get_adb)):
+    return FastJSONResponse(await fetch_page(db, "milestones", Milestone, filters, page, MILESTONE_SORTS))
 
 @router.post("/", response_model=Milestone)
-def create_milestone(milestone: Milestone):
-    db = get_db()
-    cursor = db.cursor()
-    cursor.execute("INSERT INTO milestones (projectId, title, date) VALUES (%s, %s, %s)", (milestone.projectId, milestone.title, milestone.date))
-    db.commit()
-    milestone.id = cursor.lastrowid
-    cursor.close()
-    db.close()
+async def create_milestone(milestone: Milestone, db=Depends(get_adb)):
+    result = await db.execute("INSERT INTO milestones (projectId, title, date) VALUES (%s, %s, %s)", (milestone.projectId, milestone.title, milestone.date))
+    await db.commit()
+    milestone.id = result.lastrowid
+    await publish("milestone.created", milestone.projectId, milestones=[milestone])
     return milestone
 
+@router.post("/bulk", response_model=BulkResponse)
+async def create_milestones_bulk(items: List[Dict[str, Any]], atomic: bool = False, db=Depends(get_adb)):
+    valid, results = validate_items(items, Milestone)
+    projects = await existing_ids(db, "projects", [m.projectId for _, m in valid])
+    rows = []
+    for index, milestone in valid:
+        if milestone.projectId not in projects:
+            results[index] = BulkItemResult(index=index, ok=False, error="projectId: el proyecto no existe")
+        else:
+            rows.append((index, (milestone.projectId, milestone.title, milestone.date)))
+    reject_if_atomic(atomic, results)
+    if rows:
+        ids = await run_in_transaction(db, lambda: insert_rows(db, "milestones", ("projectId", "title", "date"), [r for _, r in rows]))
+        by_project = {}
+        for (index, (project_id, title, milestone_date)), milestone_id in zip(rows, ids):
+            results[index] = BulkItemResult(index=index, ok=True, id=milestone_id)
+            by_project.setdefault(project_id, []).append({"id": milestone_id, "projectId": project_id, "title": title, "date": milestone_date})
+        for project_id, milestones in by_project.items():
+            await publish("milestone.created", project_id, milestones=milestones)
+    return build_response(results, len(items))
+
 @router.patch("/{milestone_id}", response_model=Milestone)
-def update_milestone(milestone_id: int, milestone: Milestone):
-    db = get_db()
-    cursor = db.cursor()
-    cursor.execute("UPDATE milestones SET projectId=%s, title=%s, date=%s WHERE id=%s", (milestone.projectId, milestone.title, milestone.date, milestone_id))
-    db.commit()
-    cursor.close()
-    db.close()
+async def update_milestone(milestone_id: int, milestone: Milestone, db=Depends(get_adb)):
+    await db.execute("UPDATE milestones SET projectId=%s, title=%s, date=%s WHERE id=%s", (milestone.projectId, milestone.title, milestone.date, milestone_id))
+    await db.commit()
     milestone.id = milestone_id
-    return milestone 
\ No newline at end of file
+    await publish("milestone.updated", milestone.projectId, milestones=[milestone])
+    return milestone
\ No newline at end of file
@@ -1,105 +1,225 @@
-from fastapi import APIRouter, HTTPException, Depends
-from models.project import Project, create_projects_table
-from models.teammember import TeamMember, create_team_members_table
-from models.project_team import create_project_team_table
-from db import get_db
-from typing import List
+from fastapi import APIRouter, HTTPException, Depends, Query, Request
+from models.project import Project
+from models.teammember import TeamMember
+from models.milestone import Milestone
+from pydantic import BaseModel
+from db_async import apool, get_adb
+from response_cache import bump, cached_response
+from events import publish
+from pagination import Page, PageParams, Filters, fetch_page
+from export import enqueue_export, export_response
+from routers.stats import invalidate_stats, productivity
+from serialization import FastJSONResponse
+from search import SearchPage, SearchParams, search
+from typing import Dict, List, Optional
 
 router = APIRouter(prefix="/api/projects", tags=["projects"])
 
-@router.on_event("startup")
-def startup():
-    db = get_db()
-    if db:
-        create_projects_table(db)
-        create_team_members_table(db)
-        create_project_team_table(db)
-        db.close()
-
-@router.get("/", response_model=List[Project])
-def list_projects():
-    db = get_db()
-    cursor = db.cursor(dictionary=True)
-    cursor.execute("SELECT * FROM projects")
-    projects = [Project(**row) for row in cursor.fetchall()]
-    cursor.close()
-    db.close()
-    return projects
+PROJECT_SORTS = ("id", "startDate", "endDate")
+OVERVIEW_INCLUDES = ("team", "milestones", "tasks")
+OVERVIEW_MAX_IDS = 100
 
-@router.get("/{project_id}", response_model=Project)
-def get_project(project_id: int):
-    db = get_db()
-    cursor = db.cursor(dictionary=True)
-    cursor.execute("SELECT * FROM projects WHERE id = %s", (project_id,))
-    row = cursor.fetchone()
-    cursor.close()
-    db.close()
-    if not row:
+class TaskSummary(BaseModel):
+    byStatus: Dict[str, int]
+    totalTasks: int
+    completedTasks: int
+    timeSpent: int
+    productivity: int
+
+class ProjectOverview(BaseModel):
+    project: Project
+    team: Optional[List[TeamMember]] = None
+    milestones: Optional[List[Milestone]] = None
+    tasks: Optional[TaskSummary] = None
+
+def project_filters(status: Optional[str] = None, clientName: Optional[str] = None):
+    filters = Filters()
+    filters.eq("status", status)
+    filters.eq("clientName", clientName)
+    return filters
+
+def project_search_filters(status: Optional[str] = None, clientName: Optional[str] = None):
+    filters = Filters()
+    filters.eq("projects.status", status)
+    filters.eq("projects.clientName", clientName)
+    return filters
+
+# Las lecturas se sirven desde response_cache con ETag; la conexión solo se pide si no hay copia válida.
+# Se usa el primario a propósito: la copia se genera justo después de una escritura, cuando una réplica
+# aún puede no tenerla, y quedaría guardada con la versión nueva
+
+@router.get("/", response_model=Page)
+async def list_projects(request: Request, page: PageParams = Depends(), filters: Filters = Depends(project_filters)):
+    async def build():
+        async with apool.connection() as db:
+            return await fetch_page(db, "projects", Project, filters, page, PROJECT_SORTS)
+    return await cached_response(request, ["projects"], build)
+
+@router.get("/export")
+async def export_projects(format: str = Query("ndjson", description="ndjson o csv"), fields: Optional[str] = None,
+                          filters: Filters = Depends(project_filters)):
+    return export_response("projects", Project, filters, format, fields)
+
+@router.post("/export/jobs", status_code=202)
+async def export_projects_job(format: str = Query("ndjson", description="ndjson o csv"), fields: Optional[str] = None,
+                              filters: Filters = Depends(project_filters)):
+    # Para exportaciones grandes: el fichero se genera en segundo plano y se descarga desde /api/jobs/{id}/download
+    return await enqueue_export("projects", Project, filters, format, fields)
+
+@router.get("/search", response_model=SearchPage)
+async def search_projects(params: SearchParams = Depends(), filters: Filters = Depends(project_search_filters), db=Depends(get_adb)):
+    return FastJSONResponse(await search(db, "projects", Project, filters, params))
+
+def parse_includes(include):
+    if include is None:
+        return OVERVIEW_INCLUDES
+    includes = tuple(i.strip() for i in include.split(",") if i.strip())
+    unknown = [i for i in includes if i not in OVERVIEW_INCLUDES]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"include no válido; use: {', '.join(OVERVIEW_INCLUDES)}")
+    return includes
+
+def summarize_tasks(counts):
+    # counts: {estado: (tareas, minutos)}; la productividad no cuenta las archivadas, como en /api/stats
+    by_status = {status: count for status, (count, _) in counts.items()}
+    completed = by_status.get("completed", 0)
+    active = sum(count for status, count in by_status.items() if status != "archived")
+    return {
+        "byStatus": by_status,
+        "totalTasks": sum(by_status.values()),
+        "completedTasks": completed,
+        "timeSpent": sum(minutes for _, minutes in counts.values()),
+        "productivity": productivity(completed, active),
+    }
+
+async def load_overviews(db, ids, includes):
+    # Una consulta por sección para todos los proyectos a la vez, sea cual sea el número de id
+    placeholders = ", ".join(["%s"] * len(ids))
+    params = tuple(ids)
+    projects = await db.fetch_all(f"SELECT * FROM projects WHERE id IN ({placeholders}) ORDER BY id", params)
+    overviews = {row["id"]: {"project": row} for row in projects}
+    if not overviews:
+        return []
+    if "team" in includes:
+        for overview in overviews.values():
+            overview["team"] = []
+        rows = await db.fetch_all(f"""
+            SELECT pt.project_id, tm.id, tm.name, tm.avatarUrl FROM project_team pt
+            JOIN team_members tm ON tm.id = pt.team_member_id
+            WHERE pt.project_id IN ({placeholders}) ORDER BY tm.id
+        """, params)
+        for row in rows:
+            overviews[row.pop("project_id")]["team"].append(row)
+    if "milestones" in includes:
+        for overview in overviews.values():
+            overview["milestones"] = []
+        rows = await db.fetch_all(f"SELECT id, projectId, title, date FROM milestones WHERE projectId IN ({placeholders}) ORDER BY date, id", params)
+        for row in rows:
+            overviews[row["projectId"]]["milestones"].append(row)
+    if "tasks" in includes:
+        counts = {project_id: {} for project_id in overviews}
+        rows = await db.fetch_all(f"""
+            SELECT project_id, status, COUNT(*) AS count, COALESCE(SUM(time_spent), 0) AS time_spent
+            FROM tasks WHERE project_id IN ({placeholders}) GROUP BY project_id, status
+        """, params)
+        for row in rows:
+            counts[row["project_id"]][row["status"]] = (int(row["count"]), int(row["time_spent"]))
+        for project_id, overview in overviews.items():
+            overview["tasks"] = summarize_tasks(counts[project_id])
+    return list(overviews.values())
+
+@router.get("/overview", response_model=List[ProjectOverview])
+async def get_projects_overview(ids: str = Query(..., description="id de proyecto separados por comas"),
+                                include: Optional[str] = Query(None, description="secciones: team,milestones,tasks"),
+                                db=Depends(get_adb)):
+    try:
+        project_ids = list(dict.fromkeys(int(i) for i in ids.split(",") if i.strip()))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="ids debe ser una lista de números separados por comas")
+    if not project_ids or len(project_ids) > OVERVIEW_MAX_IDS:
+        raise HTTPException(status_code=400, detail=f"Indica entre 1 y {OVERVIEW_MAX_IDS} proyectos")
+    return FastJSONResponse(await load_overviews(db, project_ids, parse_includes(include)))
+
+@router.get("/{project_id}/overview", response_model=ProjectOverview)
+async def get_project_overview(project_id: int, include: Optional[str] = Query(None, description="secciones: team,milestones,tasks"),
+                               db=Depends(get_adb)):
+    overviews = await load_overviews(db, [project_id], parse_includes(include))
+    if not overviews:
         raise HTTPException(status_code=404, detail="Proyecto no encontrado")
-    return Project(**row)
+    return FastJSONResponse(overviews[0])
+
+@router.get("/{project_id}", response_model=Project)
+async def get_project(project_id: int, request: Request):
+    async def build():
+        async with apool.connection() as db:
+            row = await db.fetch_one("SELECT * FROM projects WHERE id = %s", (project_id,))
+        if not row:
+            raise HTTPException(status_code=404, detail="Proyecto no encontrado")
+        return Project(**row)
+    return await cached_response(request, [f"project:{project_id}"], build)
 
 @router.post("/", response_model=Project)
-def create_project(project: Project):
-    db = get_db()
-    cursor = db.cursor()
-    cursor.execute("INSERT INTO projects (name, description, clientName, startDate, endDate, status, progress) VALUES (%s, %s, %s, %s, %s, %s, %s)", (project.name, project.description, project.clientName, project.startDate, project.endDate, project.status, project.progress))
-    db.commit()
-    project.id = cursor.lastrowid
-    cursor.close()
-    db.close()
+async def create_project(project: Project, db=Depends(get_adb)):
+    # progress y los contadores de tareas los mantiene el servidor (project_progress.py)
+    result = await db.execute("INSERT INTO projects (name, description, clientName, startDate, endDate, status) VALUES (%s, %s, %s, %s, %s, %s)", (project.name, project.description, project.clientName, project.startDate, project.endDate, project.status))
+    await db.commit()
+    invalidate_stats()
+    await bump("projects")
+    project.id = result.lastrowid
+    project.progress = project.tasks_total = project.tasks_completed = 0
+    await publish("project.created", project.id, project=project)
     return project
 
 @router.put("/{project_id}", response_model=Project)
-def update_project(project_id: int, project: Project):
-    db = get_db()
-    cursor = db.cursor()
-    cursor.execute("UPDATE projects SET name=%s, description=%s, clientName=%s, startDate=%s, endDate=%s, status=%s, progress=%s WHERE id=%s", (project.name, project.description, project.clientName, project.startDate, project.endDate, project.status, project.progress, project_id))
-    db.commit()
-    cursor.close()
-    db.close()
-    return project
+async def update_project(project_id: int, project: Project, db=Depends(get_adb)):
+    await db.execute("UPDATE projects SET name=%s, description=%s, clientName=%s, startDate=%s, endDate=%s, status=%s WHERE id=%s", (project.name, project.description, project.clientName, project.startDate, project.endDate, project.status, project_id))
+    row = await db.fetch_one("SELECT * FROM projects WHERE id = %s", (project_id,))
+    await db.commit()
+    if not row:
+        raise HTTPException(status_code=404, detail="Proyecto no encontrado")
+    invalidate_stats()
+    await bump("projects", f"project:{project_id}")
+    await publish("project.updated", project_id, project=row)
+    return Project(**row)
 
 @router.delete("/{project_id}")
-def delete_project(project_id: int):
-    db = get_db()
-    cursor = db.cursor()
-    cursor.execute("DELETE FROM projects WHERE id=%s", (project_id,))
-    db.commit()
-    cursor.close()
-    db.close()
+async def delete_project(project_id: int, db=Depends(get_adb)):
+    await db.execute("DELETE FROM projects WHERE id=%s", (project_id,))
+    await db.commit()
+    invalidate_stats()
+    await bump("projects", f"project:{project_id}", f"project:{project_id}:team")
+    await publish("project.deleted", project_id)
     return {"ok": True}
 
 @router.get("/{project_id}/team", response_model=List[TeamMember])
-def get_project_team(project_id: int):
-    db = get_db()
-    cursor = db.cursor(dictionary=True)
-    cursor.execute("""
-        SELECT tm.* FROM team_members tm
-        JOIN project_team pt ON tm.id = pt.team_member_id
-        WHERE pt.project_id = %s
-    """, (project_id,))
-    members = [TeamMember(**row) for row in cursor.fetchall()]
-    cursor.close()
-    db.close()
-    return members
+async def get_project_team(project_id: int, request: Request):
+    async def build():
+        async with apool.connection() as db:
+            rows = await db.fetch_all("""
+                SELECT tm.* FROM team_members tm
+                JOIN project_team pt ON tm.id = pt.team_member_id
+                WHERE pt.project_id = %s
+            """, (project_id,))
+        return rows
+    # team_members cambia al editar o borrar un miembro desde /api/team
+    return await cached_response(request, [f"project:{project_id}:team", "team_members"], build)
 
 @router.post("/{project_id}/team")
-def assign_team_members(project_id: int, member_ids: List[int]):
-    db = get_db()
-    cursor = db.cursor()
-    for member_id in member_ids:
-        cursor.execute("INSERT IGNORE INTO project_team (project_id, team_member_id) VALUES (%s, %s)", (project_id, member_id))
-    db.commit()
-    cursor.close()
-    db.close()
+async def assign_team_members(project_id: int, member_ids: List[int], db=Depends(get_adb)):
+    # Un solo INSERT multi-fila en lugar de una sentencia por miembro
+    member_ids = list(dict.fromkeys(member_ids))
+    if member_ids:
+        await db.executemany("INSERT IGNORE INTO project_team (project_id, team_member_id) VALUES (%s, %s)",
+                             [(project_id, member_id) for member_id in member_ids])
+        await db.commit()
+        await bump(f"project:{project_id}:team")
+        await publish("project.team_added", project_id, member_ids=member_ids)
     return {"ok": True}
 
 @router.delete("/{project_id}/team/{member_id}")
-def remove_team_member(project_id: int, member_id: int):
-    db = get_db()
-    cursor = db.cursor()
-    cursor.execute("DELETE FROM project_team WHERE project_id=%s AND team_member_id=%s", (project_id, member_id))
-    db.commit()
-    cursor.close()
-    db.close()
-    return {"ok": True} 
\ No newline at end of file
+async def remove_team_member(project_id: int, member_id: int, db=Depends(get_adb)):
+    await db.execute("DELETE FROM project_team WHERE project_id=%s AND team_member_id=%s", (project_id, member_id))
+    await db.commit()
+    await bump(f"project:{project_id}:team")
+    await publish("project.team_removed", project_id, member_ids=[member_id])
+    return {"ok": True}
\ No newline at end of file
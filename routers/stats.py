@@ -1,37 +1,87 @@
-from fastapi import APIRouter
-from db import get_db
+import os
+from fastapi import APIRouter, Depends
+from db_async import get_adb
+from cache import TTLCache
+from typing import Optional
 
 router = APIRouter(prefix="/api/stats", tags=["stats"])
 
+# Las estadísticas se recalculan como mucho cada STATS_CACHE_TTL segundos o tras una escritura
+stats_cache = TTLCache(maxsize=256, ttl=float(os.getenv("STATS_CACHE_TTL", "10")))
+
+def invalidate_stats():
+    stats_cache.clear()
+
+def productivity(completed, total):
+    return round(100 * completed / total) if total else 0
+
+# Totales por estado de proyectos y tareas en una sola consulta agrupada
+DASHBOARD_SQL = """
+    SELECT 'projects' AS kind, status, COUNT(*) AS count, 0 AS time_spent FROM projects GROUP BY status
+    UNION ALL
+    SELECT 'tasks' AS kind, status, COUNT(*) AS count, COALESCE(SUM(time_spent), 0) AS time_spent FROM tasks GROUP BY status
+"""
+
+GROUPED_SQL = """
+    SELECT {column} AS id, COUNT(*) AS total,
+           SUM(CASE WHEN status = 'completed' THEN 1 ELSE 0 END) AS completed,
+           COALESCE(SUM(time_spent), 0) AS timeSpent
+    FROM tasks
+    WHERE {column} IS NOT NULL AND status <> 'archived'{extra}
+    GROUP BY {column}
+"""
+
+async def grouped_stats(db, column, id_filter=None):
+    key = (column, id_filter)
+    cached = stats_cache.get(key)
+    if cached is not None:
+        return cached
+    extra, params = "", ()
+    if id_filter is not None:
+        extra, params = f" AND {column} = %s", (id_filter,)
+    rows = await db.fetch_all(GROUPED_SQL.format(column=column, extra=extra), params)
+    result = [
+        {
+            "id": row["id"],
+            "totalTasks": int(row["total"]),
+            "completedTasks": int(row["completed"]),
+            "timeSpent": int(row["timeSpent"]),
+            "productivity": productivity(int(row["completed"]), int(row["total"])),
+        }
+        for row in rows
+    ]
+    stats_cache.set(key, result)
+    return result
+
 @router.get("/")
-def get_stats():
-    db = get_db()
-    cursor = db.cursor(dictionary=True)
-    # Proyectos activos
-    cursor.execute("SELECT COUNT(*) as count FROM projects WHERE status='active'")
-    activeProjects = cursor.fetchone()["count"]
-    # Proyectos completados
-    cursor.execute("SELECT COUNT(*) as count FROM projects WHERE status='completed'")
-    completedProjects = cursor.fetchone()["count"]
-    # Tareas pendientes y completadas (si hay tabla de tareas)
-    try:
-        cursor.execute("SELECT COUNT(*) as count FROM tasks WHERE status='pending'")
-        pendingTasks = cursor.fetchone()["count"]
-        cursor.execute("SELECT COUNT(*) as count FROM tasks WHERE status='completed'")
-        completedTasks = cursor.fetchone()["count"]
-    except Exception:
-        pendingTasks = 0
-        completedTasks = 0
-    # Tiempo y productividad (mock)
+async def get_stats(db=Depends(get_adb)):
+    cached = stats_cache.get("dashboard")
+    if cached is not None:
+        return cached
+    counts = {"projects": {}, "tasks": {}}
     timeSpent = 0
-    productivity = 0
-    cursor.close()
-    db.close()
-    return {
-        "activeProjects": activeProjects,
-        "completedProjects": completedProjects,
-        "pendingTasks": pendingTasks,
+    for row in await db.fetch_all(DASHBOARD_SQL):
+        counts[row["kind"]][row["status"]] = int(row["count"])
+        timeSpent += int(row["time_spent"])
+    tasks = counts["tasks"]
+    completedTasks = tasks.get("completed", 0)
+    # La productividad es el porcentaje de tareas completadas (sin contar las archivadas)
+    activeTotal = sum(count for status, count in tasks.items() if status != "archived")
+    stats = {
+        "activeProjects": counts["projects"].get("active", 0),
+        "completedProjects": counts["projects"].get("completed", 0),
+        "pendingTasks": tasks.get("pending", 0),
         "completedTasks": completedTasks,
         "timeSpent": timeSpent,
-        "productivity": productivity
-    } 
\ No newline at end of file
+        "productivity": productivity(completedTasks, activeTotal)
+    }
+    stats_cache.set("dashboard", stats)
+    return stats
+
+@router.get("/projects")
+async def get_project_stats(projectId: Optional[int] = None, db=Depends(get_adb)):
+    return await grouped_stats(db, "project_id", projectId)
+
+@router.get("/users")
+async def get_user_stats(user_id: Optional[int] = None, db=Depends(get_adb)):
+    return await grouped_stats(db, "user_id", user_id)
\ No newline at end of file
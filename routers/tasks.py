@@ -1,33 +1,303 @@
-from fastapi import APIRouter, HTTPException
-from models.task import Task, create_tasks_table
-from db import get_db
+from fastapi import APIRouter, HTTPException, Depends, Query
+from pydantic import BaseModel, Field
+from models.task import Task, TASK_STATUSES
+from db_async import get_adb
+from pagination import Page, PageParams, Filters, fetch_page
+from serialization import FastJSONResponse
+from search import SearchPage, SearchParams, search
+from export import enqueue_export, export_response
+from routers.stats import invalidate_stats
+from project_progress import ProgressDeltas, apply_deltas, for_update, invalidate_projects
+from events import publish
+from kanban import KANBAN_COLUMNS, RANK_REBALANCE_LENGTH, check_appended, check_column, last_rank, rank_after, rank_for_move, request_rebalance
+from bulk import (BulkIds, BulkItemResult, BulkResponse, build_response, check_size, existing_ids, insert_rows,
+                  placeholders, reject_if_atomic, run_in_transaction, validate_items)
+from collections import defaultdict
+from datetime import date
+from typing import Any, Dict, List, Optional
 
 router = APIRouter(prefix="/tasks", tags=["tasks"])
 
-@router.on_event("startup")
-def startup():
-    db = get_db()
-    if db:
-        create_tasks_table(db)
-        db.close()
+TASK_SORTS = ("id", "due_date", "created_at", "rank_key")
+
+# Campos que viajan en los eventos de tareas creadas; el resto se pide a la API si hace falta
+TASK_EVENT_FIELDS = ("id", "user_id", "project_id", "title", "status", "due_date", "kanban_column", "rank_key")
+
+TASK_INSERT_COLUMNS = ("user_id", "project_id", "title", "description", "status", "due_date", "time_spent", "time_estimate",
+                       "kanban_column", "rank_key")
+
+class BulkStatusUpdate(BaseModel):
+    ids: List[int]
+    status: str
+
+class TaskUpdate(BaseModel):
+    # Solo se modifican los campos presentes en el cuerpo
+    user_id: Optional[int] = None
+    project_id: Optional[int] = None
+    title: Optional[str] = None
+    description: Optional[str] = None
+    status: Optional[str] = None
+    due_date: Optional[date] = None
+    time_spent: Optional[int] = None
+    time_estimate: Optional[int] = None
+
+class TaskMove(BaseModel):
+    column: str
+    # Vecinas en la columna de destino: la tarea queda justo después de after_id y/o justo antes de before_id
+    after_id: Optional[int] = None
+    before_id: Optional[int] = None
+    # Sin vecinas, posición (desde 0) en la columna, como la envía el frontend Pro; sin nada, al final
+    order: Optional[int] = Field(None, ge=0)
+
+# Columnas NOT NULL (y status, del que dependen los contadores de progreso): un null explícito no se escribe
+TASK_REQUIRED_FIELDS = ("user_id", "title", "status", "time_spent")
+
+def check_required(changes):
+    nulls = [field for field in TASK_REQUIRED_FIELDS if field in changes and changes[field] is None]
+    if nulls:
+        raise HTTPException(status_code=400, detail=f"Estos campos no admiten null: {', '.join(nulls)}")
+
+def check_status(status):
+    if status is not None and status not in TASK_STATUSES:
+        raise HTTPException(status_code=400, detail=f"Estado no válido; use uno de: {', '.join(TASK_STATUSES)}")
+
+async def after_task_write(deltas):
+    # Tras el commit: cachés y un evento con la variación de contadores de cada proyecto afectado
+    invalidate_stats()
+    changed = deltas.changed()
+    await invalidate_projects(sorted(changed))
+    for project_id, (total, completed) in sorted(changed.items()):
+        await publish("project.counters", project_id, tasks_total=total, tasks_completed=completed)
+
+async def publish_tasks(event_type, rows, **data):
+    # Un evento por proyecto con las tareas afectadas; sin proyecto solo llega al canal global
+    by_project = defaultdict(list)
+    for row in rows:
+        by_project[row["project_id"]].append(row)
+    for project_id, group in by_project.items():
+        if event_type == "task.created":
+            await publish(event_type, project_id, tasks=[{f: row[f] for f in TASK_EVENT_FIELDS} for row in group], **data)
+        else:
+            await publish(event_type, project_id, ids=[row["id"] for row in group], **data)
+
+def task_filters(status: Optional[str] = None, user_id: Optional[int] = None, projectId: Optional[int] = None,
+                 due_from: Optional[date] = None, due_to: Optional[date] = None, column: Optional[str] = None):
+    # Una columna del tablero en orden: ?projectId=&column=&sort=rank_key (índice idx_tasks_kanban)
+    filters = Filters()
+    filters.eq("status", status)
+    filters.eq("kanban_column", column)
+    filters.eq("user_id", user_id)
+    filters.eq("project_id", projectId)
+    filters.range("due_date", due_from, due_to)
+    return filters
+
+def task_search_filters(status: Optional[str] = None, user_id: Optional[int] = None, projectId: Optional[int] = None):
+    filters = Filters()
+    filters.eq("tasks.status", status)
+    filters.eq("tasks.user_id", user_id)
+    filters.eq("tasks.project_id", projectId)
+    return filters
+
+# Toda escritura de tareas actualiza en la misma transacción los contadores y el progreso del proyecto
 
 @router.post("/", response_model=Task)
-def create_task(task: Task):
-    db = get_db()
-    cursor = db.cursor()
-    cursor.execute("INSERT INTO tasks (user_id, title, description, status, due_date) VALUES (%s, %s, %s, %s, %s)", (task.user_id, task.title, task.description, task.status, task.due_date))
-    db.commit()
-    task.id = cursor.lastrowid
-    cursor.close()
-    db.close()
+async def create_task(task: Task, db=Depends(get_adb)):
+    check_status(task.status)
+    task.kanban_column = task.kanban_column or "todo"
+    check_column(task.kanban_column)
+    # Las tareas nuevas van al final de su columna (last_rank bloquea el final hasta el commit)
+    task.rank_key = rank_after(await last_rank(db, task.project_id, task.kanban_column))
+    result = await db.execute("INSERT INTO tasks (user_id, project_id, title, description, status, due_date, time_spent, time_estimate, kanban_column, rank_key) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)", (task.user_id, task.project_id, task.title, task.description, task.status, task.due_date, task.time_spent or 0, task.time_estimate, task.kanban_column, task.rank_key))
+    deltas = ProgressDeltas()
+    deltas.add(task.project_id, task.status)
+    await apply_deltas(db, deltas)
+    await db.commit()
+    task.id = result.lastrowid
+    await check_appended(db, task.project_id, task.kanban_column, [task.rank_key])
+    await after_task_write(deltas)
+    await publish_tasks("task.created", [task.model_dump()])
     return task
 
-@router.get("/", response_model=list[Task])
-def list_tasks():
-    db = get_db()
-    cursor = db.cursor(dictionary=True)
-    cursor.execute("SELECT * FROM tasks")
-    tasks = [Task(**row) for row in cursor.fetchall()]
-    cursor.close()
-    db.close()
-    return tasks 
\ No newline at end of file
+@router.post("/bulk", response_model=BulkResponse)
+async def create_tasks_bulk(items: List[Dict[str, Any]], atomic: bool = False, db=Depends(get_adb)):
+    valid, results = validate_items(items, Task)
+    users = await existing_ids(db, "users", [t.user_id for _, t in valid])
+    projects = await existing_ids(db, "projects", [t.project_id for _, t in valid])
+    rows = []
+    deltas = ProgressDeltas()
+    for index, task in valid:
+        if task.user_id not in users:
+            results[index] = BulkItemResult(index=index, ok=False, error="user_id: el usuario no existe")
+        elif task.project_id is not None and task.project_id not in projects:
+            results[index] = BulkItemResult(index=index, ok=False, error="project_id: el proyecto no existe")
+        elif task.status is not None and task.status not in TASK_STATUSES:
+            results[index] = BulkItemResult(index=index, ok=False, error="status: estado no válido")
+        elif task.kanban_column is not None and task.kanban_column not in KANBAN_COLUMNS:
+            results[index] = BulkItemResult(index=index, ok=False, error="kanban_column: columna no válida")
+        else:
+            rows.append((index, [task.user_id, task.project_id, task.title, task.description, task.status,
+                                 task.due_date, task.time_spent or 0, task.time_estimate, task.kanban_column or "todo", None]))
+            deltas.add(task.project_id, task.status)
+    reject_if_atomic(atomic, results)
+    appended = defaultdict(list)
+    if rows:
+        async def insert():
+            # Al final de cada columna, en el orden del lote: una consulta por columna, no por tarea. Las columnas
+            # se bloquean siempre en el mismo orden para que dos lotes no se esperen mutuamente
+            last = {}
+            for column in sorted({(row[1], row[8]) for _, row in rows}, key=lambda c: (c[0] is None, c[0] or 0, c[1])):
+                last[column] = await last_rank(db, *column)
+            appended.clear()
+            for _, row in rows:
+                column = (row[1], row[8])
+                row[9] = last[column] = rank_after(last[column])
+                appended[column].append(row[9])
+            ids = await insert_rows(db, "tasks", TASK_INSERT_COLUMNS, [tuple(r) for _, r in rows])
+            await apply_deltas(db, deltas)
+            return ids
+        ids = await run_in_transaction(db, insert)
+        for (index, _), task_id in zip(rows, ids):
+            results[index] = BulkItemResult(index=index, ok=True, id=task_id)
+        for (project_id, column), ranks in appended.items():
+            await check_appended(db, project_id, column, ranks)
+        await after_task_write(deltas)
+        await publish_tasks("task.created", [{"id": task_id, **dict(zip(TASK_INSERT_COLUMNS, row))}
+                                             for (_, row), task_id in zip(rows, ids)])
+    return build_response(results, len(items))
+
+async def lock_tasks(db, ids):
+    # Estado y proyecto actuales, bloqueados hasta el commit para calcular bien los contadores
+    return await db.fetch_all(f"SELECT id, project_id, status FROM tasks WHERE id IN ({placeholders(ids)}){for_update(db)}", tuple(ids))
+
+def id_results(ids, found):
+    return {i: BulkItemResult(index=i, ok=task_id in found, id=task_id,
+                              error=None if task_id in found else "Tarea no encontrada")
+            for i, task_id in enumerate(ids)}
+
+@router.patch("/bulk", response_model=BulkResponse)
+async def update_tasks_status_bulk(update: BulkStatusUpdate, db=Depends(get_adb)):
+    check_status(update.status)
+    check_size(update.ids)
+    deltas = ProgressDeltas()
+    async def apply():
+        rows = await lock_tasks(db, update.ids)
+        if not rows:
+            return rows
+        for row in rows:
+            deltas.remove(row["project_id"], row["status"])
+            deltas.add(row["project_id"], update.status)
+        ids = tuple(row["id"] for row in rows)
+        await db.execute(f"UPDATE tasks SET status = %s WHERE id IN ({placeholders(ids)})", (update.status,) + ids)
+        await apply_deltas(db, deltas)
+        return rows
+    rows = await run_in_transaction(db, apply)
+    if rows:
+        await after_task_write(deltas)
+        await publish_tasks("task.updated", rows, changes={"status": update.status})
+    return build_response(id_results(update.ids, {row["id"] for row in rows}), len(update.ids))
+
+@router.post("/bulk/delete", response_model=BulkResponse)
+async def delete_tasks_bulk(body: BulkIds, db=Depends(get_adb)):
+    check_size(body.ids)
+    deltas = ProgressDeltas()
+    async def apply():
+        rows = await lock_tasks(db, body.ids)
+        if not rows:
+            return rows
+        for row in rows:
+            deltas.remove(row["project_id"], row["status"])
+        ids = tuple(row["id"] for row in rows)
+        await db.execute(f"DELETE FROM tasks WHERE id IN ({placeholders(ids)})", ids)
+        await apply_deltas(db, deltas)
+        return rows
+    rows = await run_in_transaction(db, apply)
+    if rows:
+        await after_task_write(deltas)
+        await publish_tasks("task.deleted", rows)
+    return build_response(id_results(body.ids, {row["id"] for row in rows}), len(body.ids))
+
+@router.get("/", response_model=Page)
+async def list_tasks(page: PageParams = Depends(), filters: Filters = Depends(task_filters), db=Depends(get_adb)):
+    return FastJSONResponse(await fetch_page(db, "tasks", Task, filters, page, TASK_SORTS))
+
+@router.get("/export")
+async def export_tasks(format: str = Query("ndjson", description="ndjson o csv"), fields: Optional[str] = None,
+                       filters: Filters = Depends(task_filters)):
+    return export_response("tasks", Task, filters, format, fields)
+
+@router.post("/export/jobs", status_code=202)
+async def export_tasks_job(format: str = Query("ndjson", description="ndjson o csv"), fields: Optional[str] = None,
+                           filters: Filters = Depends(task_filters)):
+    # Para exportaciones grandes: el fichero se genera en segundo plano y se descarga desde /api/jobs/{id}/download
+    return await enqueue_export("tasks", Task, filters, format, fields)
+
+@router.get("/search", response_model=SearchPage)
+async def search_tasks(params: SearchParams = Depends(), filters: Filters = Depends(task_search_filters), db=Depends(get_adb)):
+    return FastJSONResponse(await search(db, "tasks", Task, filters, params))
+
+@router.get("/{task_id}", response_model=Task)
+async def get_task(task_id: int, db=Depends(get_adb)):
+    row = await db.fetch_one("SELECT * FROM tasks WHERE id = %s", (task_id,))
+    if not row:
+        raise HTTPException(status_code=404, detail="Tarea no encontrada")
+    return Task(**row)
+
+@router.patch("/{task_id}", response_model=Task)
+async def update_task(task_id: int, update: TaskUpdate, db=Depends(get_adb)):
+    changes = update.model_dump(exclude_unset=True)
+    check_required(changes)
+    check_status(changes.get("status"))
+    row = await db.fetch_one(f"SELECT * FROM tasks WHERE id = %s{for_update(db)}", (task_id,))
+    if not row:
+        raise HTTPException(status_code=404, detail="Tarea no encontrada")
+    moved = "project_id" in changes and changes["project_id"] != row["project_id"]
+    if moved:
+        # La clave solo ordena dentro de su proyecto: en el nuevo la tarea va al final de la misma columna
+        changes["rank_key"] = rank_after(await last_rank(db, changes["project_id"], row["kanban_column"]))
+    if changes:
+        assignments = ", ".join(f"{column} = %s" for column in changes)
+        await db.execute(f"UPDATE tasks SET {assignments} WHERE id = %s", tuple(changes.values()) + (task_id,))
+        # Cambiar de estado o de proyecto mueve la tarea entre contadores
+        deltas = ProgressDeltas()
+        deltas.remove(row["project_id"], row["status"])
+        deltas.add(changes.get("project_id", row["project_id"]), changes.get("status", row["status"]))
+        await apply_deltas(db, deltas)
+        await db.commit()
+        if moved:
+            await check_appended(db, changes["project_id"], row["kanban_column"], [changes["rank_key"]])
+        await after_task_write(deltas)
+        # Si la tarea cambia de proyecto el evento llega a los dos: el anterior ve el nuevo project_id
+        await publish_tasks("task.updated", [row], changes=changes)
+        if changes.get("project_id", row["project_id"]) != row["project_id"]:
+            await publish_tasks("task.updated", [{**row, **changes}], changes=changes)
+    return Task(**{**row, **changes})
+
+@router.post("/{task_id}/move", response_model=Task)
+async def move_task(task_id: int, move: TaskMove, db=Depends(get_adb)):
+    # Cambia de columna o de posición escribiendo solo esta fila: la nueva clave cae entre las de sus vecinas
+    check_column(move.column)
+    row = await db.fetch_one(f"SELECT * FROM tasks WHERE id = %s{for_update(db)}", (task_id,))
+    if not row:
+        raise HTTPException(status_code=404, detail="Tarea no encontrada")
+    rank_key = await rank_for_move(db, row, move.column, move.after_id, move.before_id, move.order)
+    await db.execute("UPDATE tasks SET kanban_column = %s, rank_key = %s WHERE id = %s", (move.column, rank_key, task_id))
+    await db.commit()
+    changes = {"kanban_column": move.column, "rank_key": rank_key}
+    if len(rank_key) > RANK_REBALANCE_LENGTH:
+        await request_rebalance(row["project_id"], move.column)
+    await publish_tasks("task.updated", [row], changes=changes)
+    return Task(**{**row, **changes})
+
+@router.delete("/{task_id}")
+async def delete_task(task_id: int, db=Depends(get_adb)):
+    row = await db.fetch_one(f"SELECT project_id, status FROM tasks WHERE id = %s{for_update(db)}", (task_id,))
+    if not row:
+        raise HTTPException(status_code=404, detail="Tarea no encontrada")
+    await db.execute("DELETE FROM tasks WHERE id = %s", (task_id,))
+    deltas = ProgressDeltas()
+    deltas.remove(row["project_id"], row["status"])
+    await apply_deltas(db, deltas)
+    await db.commit()
+    await after_task_write(deltas)
+    await publish_tasks("task.deleted", [{"id": task_id, "project_id": row["project_id"]}])
+    return {"ok": True}
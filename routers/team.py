@@ -1 +1,37 @@
- 
\ No newline at end of file
+from fastapi import APIRouter, HTTPException, Depends
+from models.teammember import TeamMember
+from db_async import get_adb
+from response_cache import bump
+from pagination import Page, PageParams, Filters, fetch_page
+from serialization import FastJSONResponse
+
+router = APIRouter(prefix="/api/team", tags=["team"])
+
+@router.get("/", response_model=Page)
+async def list_team_members(page: PageParams = Depends(), db=Depends(get_adb)):
+    return FastJSONResponse(await fetch_page(db, "team_members", TeamMember, Filters(), page, ("id",)))
+
+@router.post("/", response_model=TeamMember)
+async def create_team_member(member: TeamMember, db=Depends(get_adb)):
+    result = await db.execute("INSERT INTO team_members (name, avatarUrl) VALUES (%s, %s)", (member.name, member.avatarUrl))
+    await db.commit()
+    member.id = result.lastrowid
+    return member
+
+@router.patch("/{member_id}", response_model=TeamMember)
+async def update_team_member(member_id: int, member: TeamMember, db=Depends(get_adb)):
+    # No se mira rowcount: en MySQL es 0 si los valores no cambian y daría un 404 falso
+    if await db.fetch_one("SELECT id FROM team_members WHERE id=%s", (member_id,)) is None:
+        raise HTTPException(status_code=404, detail="Miembro no encontrado")
+    await db.execute("UPDATE team_members SET name=%s, avatarUrl=%s WHERE id=%s", (member.name, member.avatarUrl, member_id))
+    await db.commit()
+    await bump("team_members")
+    member.id = member_id
+    return member
+
+@router.delete("/{member_id}")
+async def delete_team_member(member_id: int, db=Depends(get_adb)):
+    await db.execute("DELETE FROM team_members WHERE id=%s", (member_id,))
+    await db.commit()
+    await bump("team_members")
+    return {"ok": True}
\ No newline at end of file
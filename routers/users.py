@@ -1,33 +1,26 @@
-from fastapi import APIRouter, HTTPException
-from models.user import User, create_users_table
-from db import get_db
+from fastapi import APIRouter, HTTPException, Depends
+from models.user import User
+from db_async import get_adb
+from pagination import Page, PageParams, Filters, fetch_page
+from serialization import FastJSONResponse
+from typing import Optional
 
 router = APIRouter(prefix="/users", tags=["users"])
 
-@router.on_event("startup")
-def startup():
-    db = get_db()
-    if db:
-        create_users_table(db)
-        db.close()
-
 @router.post("/", response_model=User)
-def create_user(user: User):
-    db = get_db()
-    cursor = db.cursor()
-    cursor.execute("INSERT INTO users (username, password_hash, email) VALUES (%s, %s, %s)", (user.username, user.password_hash, user.email))
-    db.commit()
-    user.id = cursor.lastrowid
-    cursor.close()
-    db.close()
+async def create_user(user: User, db=Depends(get_adb)):
+    result = await db.execute("INSERT INTO users (username, password_hash, email) VALUES (%s, %s, %s)", (user.username, user.password_hash, user.email))
+    await db.commit()
+    user.id = result.lastrowid
     return user
 
-@router.get("/", response_model=list[User])
-def list_users():
-    db = get_db()
-    cursor = db.cursor(dictionary=True)
-    cursor.execute("SELECT * FROM users")
-    users = [User(**row) for row in cursor.fetchall()]
-    cursor.close()
-    db.close()
-    return users 
\ No newline at end of file
+USER_SORTS = ("id", "created_at")
+
+def user_filters(role: Optional[str] = None):
+    filters = Filters()
+    filters.eq("role", role)
+    return filters
+
+@router.get("/", response_model=Page)
+async def list_users(page: PageParams = Depends(), filters: Filters = Depends(user_filters), db=Depends(get_adb)):
+    return FastJSONResponse(await fetch_page(db, "users", User, filters, page, USER_SORTS))
\ No newline at end of file
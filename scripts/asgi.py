@@ -0,0 +1,47 @@
+import asyncio
+import json
+from urllib.parse import urlencode, urlsplit
+
+
+async def request(app, method, url, body=None, headers=None, form=None):
+    # Llama a la aplicación ASGI en el mismo proceso, sin servidor ni cliente HTTP
+    parts = urlsplit(url)
+    if form is not None:
+        payload = urlencode(form).encode()
+        raw_headers = [(b"content-type", b"application/x-www-form-urlencoded")]
+    elif body is not None:
+        payload = json.dumps(body).encode()
+        raw_headers = [(b"content-type", b"application/json")]
+    else:
+        payload, raw_headers = b"", []
+    raw_headers += [(k.lower().encode(), v.encode()) for k, v in (headers or {}).items()]
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": method,
+        "scheme": "http", "path": parts.path, "raw_path": parts.path.encode(),
+        "query_string": parts.query.encode(), "headers": raw_headers,
+        "client": ("127.0.0.1", 0), "server": ("testserver", 80), "root_path": "",
+    }
+    sent = False
+    finished = asyncio.Event()
+    response = {"status": None, "headers": {}, "body": b""}
+
+    async def receive():
+        nonlocal sent
+        if sent:
+            # El cliente no se desconecta hasta recibir la respuesta completa (p. ej. en streaming)
+            await finished.wait()
+            return {"type": "http.disconnect"}
+        sent = True
+        return {"type": "http.request", "body": payload, "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            response["status"] = message["status"]
+            response["headers"] = {k.decode(): v.decode() for k, v in message.get("headers", [])}
+        elif message["type"] == "http.response.body":
+            response["body"] += message.get("body", b"")
+            if not message.get("more_body", False):
+                finished.set()
+
+    await app(scope, receive, send)
+    return response
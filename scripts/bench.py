@@ -0,0 +1,241 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime
+from urllib.parse import quote
+
+# El limitador de peticiones (ratelimit.py) convertiría casi todo en 429; para medir contra servidores
+# arrancados aparte hay que arrancarlos también con RATE_LIMIT_ENABLED=0
+os.environ.setdefault("RATE_LIMIT_ENABLED", "0")
+
+from db import DB_BACKEND
+from db_async import apool, query_listeners
+from scripts.asgi import request
+from scripts.seed import BENCH_PASSWORD, TITLE_WORDS
+
+# Los escenarios suponen una base de datos generada con scripts/seed.py: existen user0..user9,
+# las claves bench-key-0..9 y los id 1..10 de usuarios y proyectos
+SEED_USERS = 10
+
+
+class InProcessClient:
+    # Llama a main:app y db_service:app en este proceso; permite contar las consultas por petición
+    mode = "inprocess"
+
+    def __init__(self):
+        from main import app
+        from db_service import app as keys_app
+        self.apps = {"main": app, "keys": keys_app}
+        self.queries = 0
+        query_listeners.append(self._count)
+
+    def _count(self, sql, params, seconds):
+        self.queries += 1
+
+    async def request(self, target, method, url, body=None, form=None):
+        response = await request(self.apps[target], method, url, body=body, form=form)
+        return response["status"], response["body"]
+
+    async def close(self):
+        query_listeners.remove(self._count)
+        await apool.close_all()
+
+
+class HttpClient:
+    # Contra servidores ya arrancados (uvicorn main:app / uvicorn db_service:app)
+    mode = "http"
+    queries = None
+
+    def __init__(self, url, keys_url, concurrency):
+        import requests
+        self.urls = {"main": url.rstrip("/"), "keys": (keys_url or "").rstrip("/")}
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=2, pool_maxsize=concurrency)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def _send(self, target, method, url, body, form):
+        response = self.session.request(method, self.urls[target] + url, json=body, data=form)
+        return response.status_code, response.content
+
+    async def request(self, target, method, url, body=None, form=None):
+        return await asyncio.to_thread(self._send, target, method, url, body, form)
+
+    async def close(self):
+        self.session.close()
+
+
+async def login(client, i, state):
+    return await client.request("main", "POST", "/auth/token",
+                                form={"username": f"user{i % SEED_USERS}", "password": BENCH_PASSWORD})
+
+
+async def list_paginate(client, i, state):
+    # Cada trabajador recorre hasta 10 páginas siguiendo next_after y vuelve a empezar
+    after = state.get("after")
+    url = "/tasks/?limit=50" + (f"&after={after}" if after else "")
+    status, body = await client.request("main", "GET", url)
+    if status == 200:
+        next_after = json.loads(body)["next_after"]
+        state["pages"] = state.get("pages", 0) + 1
+        state["after"] = next_after if next_after and state["pages"] % 10 else None
+    return status, body
+
+
+async def create_task_burst(client, i, state):
+    task = {"user_id": 1 + i % SEED_USERS, "project_id": 1 + i % SEED_USERS, "title": f"bench {i}", "time_estimate": 60}
+    return await client.request("main", "POST", "/tasks/", body=task)
+
+
+async def stats_dashboard(client, i, state):
+    return await client.request("main", "GET", "/api/stats/")
+
+
+async def search_tasks(client, i, state):
+    # Búsqueda por prefijo de una palabra del vocabulario de scripts/seed.py
+    word = TITLE_WORDS[i % len(TITLE_WORDS)]
+    return await client.request("main", "GET", f"/tasks/search?q={quote(word[:4])}&limit=20")
+
+
+async def validate_key(client, i, state):
+    # Uno de cada diez intentos usa una clave inexistente (caché negativa)
+    key = f"bench-key-{i % SEED_USERS}" if i % 10 else f"invalid-{i}"
+    return await client.request("keys", "GET", f"/validate-key?key={key}")
+
+
+async def validate_keys_batch(client, i, state):
+    # Lo mismo en lotes de 50 claves con POST /validate-keys; la latencia es por lote
+    keys = [f"bench-key-{j % SEED_USERS}" if j % 10 else f"invalid-{j}" for j in range(i * 50, i * 50 + 50)]
+    return await client.request("keys", "POST", "/validate-keys", body={"keys": keys})
+
+
+SCENARIOS = {
+    "login": login,
+    "list_paginate": list_paginate,
+    "stats_dashboard": stats_dashboard,
+    "search_tasks": search_tasks,
+    "validate_key": validate_key,
+    "validate_keys_batch": validate_keys_batch,
+    # Al final porque añade filas a tasks
+    "create_task_burst": create_task_burst,
+}
+
+
+def percentile(values, q):
+    # Método del rango más cercano sobre una lista ordenada
+    if not values:
+        return None
+    index = max(0, min(len(values) - 1, round(q / 100 * len(values) + 0.5) - 1))
+    return values[index]
+
+
+async def run_scenario(client, operation, requests, concurrency, warmup):
+    for i in range(warmup):
+        await operation(client, i, {})
+    latencies, errors = [], 0
+    counter = iter(range(requests))
+    queries_before = client.queries
+
+    async def worker():
+        nonlocal errors
+        state = {}
+        for i in counter:
+            start = time.perf_counter()
+            status, _ = await operation(client, i, state)
+            latencies.append(time.perf_counter() - start)
+            if status >= 400:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    ms = [value * 1000 for value in latencies]
+    return {
+        "requests": requests,
+        "errors": errors,
+        "seconds": round(elapsed, 3),
+        "throughput_rps": round(requests / elapsed, 1),
+        "latency_ms": {
+            "p50": round(percentile(ms, 50), 2), "p95": round(percentile(ms, 95), 2),
+            "p99": round(percentile(ms, 99), 2), "max": round(ms[-1], 2), "mean": round(sum(ms) / len(ms), 2),
+        },
+        "queries_per_request": None if client.queries is None else round((client.queries - queries_before) / requests, 2),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(previous, current):
+    # Cambio relativo de p95 y throughput frente a una ejecución anterior
+    print(f"{'escenario':<20} {'p95 ms':>18} {'req/s':>18}")
+    for name, result in current["scenarios"].items():
+        old = previous.get("scenarios", {}).get(name)
+        if not old:
+            continue
+        p95, old_p95 = result["latency_ms"]["p95"], old["latency_ms"]["p95"]
+        rps, old_rps = result["throughput_rps"], old["throughput_rps"]
+        print(f"{name:<20} {old_p95:>7} → {p95:<7} ({(p95 - old_p95) / old_p95:+.0%})"
+              f" {old_rps:>7} → {rps:<7} ({(rps - old_rps) / old_rps:+.0%})")
+
+
+async def run(args):
+    if args.url:
+        client = HttpClient(args.url, args.keys_url, args.concurrency)
+    else:
+        client = InProcessClient()
+    names = args.scenario or [name for name in SCENARIOS if not name.startswith("validate_key") or client.mode == "inprocess" or args.keys_url]
+    results = {}
+    try:
+        for name in names:
+            results[name] = await run_scenario(client, SCENARIOS[name], args.requests, args.concurrency, args.warmup)
+            print(f"{name:<20} p50={results[name]['latency_ms']['p50']} ms p95={results[name]['latency_ms']['p95']} ms "
+                  f"p99={results[name]['latency_ms']['p99']} ms {results[name]['throughput_rps']} req/s "
+                  f"consultas/petición={results[name]['queries_per_request']} errores={results[name]['errors']}")
+    finally:
+        await client.close()
+    return {
+        "meta": {
+            "label": args.label, "commit": git_commit(), "started_at": datetime.now().isoformat(timespec="seconds"),
+            "mode": client.mode, "backend": DB_BACKEND, "requests": args.requests, "concurrency": args.concurrency,
+            "python": platform.python_version(),
+        },
+        "scenarios": results,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Mide latencia y throughput de la API sobre datos de scripts/seed.py")
+    parser.add_argument("--scenario", action="append", choices=SCENARIOS, help="escenario a ejecutar (repetible; por defecto todos)")
+    parser.add_argument("--requests", type=int, default=500, help="peticiones medidas por escenario")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--warmup", type=int, default=20, help="peticiones previas sin medir")
+    parser.add_argument("--url", help="URL de main:app; sin ella se llama a la aplicación en el mismo proceso")
+    parser.add_argument("--keys-url", help="URL de db_service:app para el escenario validate_key")
+    parser.add_argument("--label", help="nombre del conjunto de datos o del cambio medido")
+    parser.add_argument("--output", help="fichero JSON donde guardar los resultados")
+    parser.add_argument("--compare", help="fichero JSON de una ejecución anterior")
+    args = parser.parse_args(argv)
+
+    result = asyncio.run(run(args))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), result)
+    return 1 if any(r["errors"] for r in result["scenarios"].values()) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,78 @@
+import argparse
+import json
+import sys
+import time
+from datetime import date, datetime, timedelta
+from typing import List
+
+from pydantic import TypeAdapter
+
+from models.task import Task
+from pagination import Page
+from serialization import dumps, orjson
+
+# Coste de serialización por fila de un listado de tareas, sin base de datos ni red.
+# Con response_model FastAPI vuelca a dict lo que devuelve la ruta, lo valida y lo serializa;
+# aquí se reproducen esos pasos con TypeAdapter para comparar los tres caminos.
+
+
+def make_rows(n):
+    # Filas tal como las devuelve el driver de MySQL: fechas como date/datetime
+    base = datetime(2024, 1, 1, 9, 30)
+    return [{
+        "id": i, "user_id": 1 + i % 50, "project_id": 1 + i % 100, "title": f"Tarea {i}",
+        "description": "Descripción de la tarea" if i % 3 else None, "status": "pending",
+        "due_date": date(2024, 1, 1) + timedelta(days=i % 365), "time_spent": i % 600, "time_estimate": 120,
+        "created_at": base + timedelta(minutes=i), "updated_at": base + timedelta(minutes=i),
+    } for i in range(n)]
+
+
+def models_path(rows):
+    # Antes de la paginación: [Task(**row)] con response_model=List[Task]
+    adapter = TypeAdapter(List[Task])
+    content = [Task(**row).model_dump() for row in rows]
+    return json.dumps(adapter.dump_python(adapter.validate_python(content), mode="json")).encode()
+
+
+def validated_page_path(rows):
+    # Page(items=filas) validada en fetch_page y de nuevo por response_model=Page
+    adapter = TypeAdapter(Page)
+    content = Page(items=rows, next_after=None, limit=len(rows)).model_dump()
+    return json.dumps(adapter.dump_python(adapter.validate_python(content), mode="json")).encode()
+
+
+def fast_path(rows):
+    # Página construida sin validar y serializada con FastJSONResponse
+    return dumps(Page.model_construct(items=rows, next_after=None, limit=len(rows)))
+
+
+PATHS = {"modelos": models_path, "pagina_validada": validated_page_path, "rapido": fast_path}
+
+
+def measure(fn, rows, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(rows)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compara el coste por fila de serializar listados")
+    parser.add_argument("--rows", type=int, action="append", help="filas por respuesta (repetible)")
+    parser.add_argument("--repeat", type=int, default=5, help="repeticiones; se toma la más rápida")
+    args = parser.parse_args(argv)
+
+    results = {"orjson": orjson is not None, "rows": {}}
+    for n in args.rows or [50, 500, 5000]:
+        rows = make_rows(n)
+        per_row = {name: measure(fn, rows, args.repeat) / n * 1e6 for name, fn in PATHS.items()}
+        results["rows"][n] = {f"{name}_us_por_fila": round(value, 2) for name, value in per_row.items()}
+        results["rows"][n]["mejora"] = round(per_row["pagina_validada"] / per_row["rapido"], 1)
+    print(json.dumps(results, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,132 @@
+import argparse
+import asyncio
+import re
+import sys
+
+from db import DB_BACKEND, pool, to_sqlite
+from db_async import apool, query_listeners
+from main import app
+from migrations import upgrade
+from scripts.asgi import request
+from scripts.seed import is_empty, seed
+
+# Peticiones que cubren los filtros y órdenes de los routers; {project}, {user}, {task}... se sustituyen
+# por id existentes en los datos generados
+ROUTES = [
+    "/tasks/", "/tasks/?status=pending", "/tasks/?user_id={user}", "/tasks/?projectId={project}",
+    "/tasks/?projectId={project}&status=completed", "/tasks/?user_id={user}&status=in_progress",
+    "/tasks/?sort=due_date", "/tasks/?sort=due_date&after={task}", "/tasks/?sort=-due_date&after={task}",
+    "/tasks/?sort=-created_at&after={task}", "/tasks/?due_from=2020-01-01&due_to=2020-01-31",
+    "/tasks/export?status=pending",
+    "/tasks/?projectId={project}&column=todo&sort=rank_key", "/tasks/?projectId={project}&column=todo&sort=rank_key&after={task}",
+    "/tasks/search?q=informe", "/tasks/search?q=inf&projectId={project}&status=pending", "/api/projects/search?q=cliente",
+    "/api/milestones/?projectId={project}", "/api/milestones/?projectId={project}&sort=date",
+    "/api/projects/?status=active", "/api/projects/?status=active&after={project}", "/api/projects/{project}",
+    "/api/projects/{project}/team", "/api/team/",
+    "/api/projects/{project}/overview", "/api/projects/overview?ids={project},{project2}",
+    "/api/stats/", "/api/stats/projects", "/api/stats/projects?projectId={project}",
+    "/api/stats/users", "/api/stats/users?user_id={user}",
+    "/apikeys/?user_id={user}",
+]
+
+# Recorridos completos aceptados a propósito: (tabla, motivo)
+ALLOWED_SCANS = {
+    ("users", "la tabla de usuarios es pequeña y solo la lista un administrador"),
+    ("team_members", "el listado de miembros no tiene filtros"),
+    ("api_keys", "la tabla de claves es pequeña; la validación usa la clave UNIQUE"),
+}
+
+
+def capture_queries(seed_ids):
+    # Ejecuta las rutas en el mismo proceso y devuelve las consultas distintas que han emitido
+    captured = {}
+
+    def listener(sql, params, seconds):
+        key = " ".join(sql.split())
+        if key.split(" ", 1)[0].upper() in ("SELECT", "UPDATE", "DELETE") and key not in captured:
+            captured[key] = tuple(params)
+
+    async def run():
+        query_listeners.append(listener)
+        try:
+            for route in ROUTES:
+                response = await request(app, "GET", route.format(**seed_ids))
+                if response["status"] != 200:
+                    raise RuntimeError(f"{route} respondió {response['status']}: {response['body'][:200]!r}")
+        finally:
+            query_listeners.remove(listener)
+            await apool.close_all()
+
+    asyncio.run(run())
+    return captured
+
+
+def unfiltered(sql):
+    # Un listado sin WHERE ni GROUP BY recorre la tabla por diseño (paginado por id o exportación)
+    return not re.search(r"\b(WHERE|GROUP BY)\b", sql, re.IGNORECASE)
+
+
+def full_scans(db, sql, params):
+    cursor = db.cursor(dictionary=True)
+    if DB_BACKEND == "sqlite":
+        cursor.execute("EXPLAIN QUERY PLAN " + sql, params)
+        # "SCAN tasks" es un recorrido de tabla; "SCAN tasks USING [COVERING] INDEX ..." recorre un índice
+        scans = [m.group(1) for row in cursor.fetchall()
+                 for m in [re.match(r"SCAN (\w+)$", row["detail"])] if m]
+    else:
+        cursor.execute("EXPLAIN " + sql, params)
+        scans = [row["table"] for row in cursor.fetchall() if row["type"] == "ALL"]
+    cursor.close()
+    return scans
+
+
+def check(db, queries):
+    allowed = {table for table, _ in ALLOWED_SCANS}
+    failures = []
+    for sql, params in queries.items():
+        if unfiltered(sql):
+            continue
+        for table in full_scans(db, sql, params):
+            if table not in allowed:
+                failures.append((table, sql))
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Comprueba con EXPLAIN que las consultas de los routers usan índices")
+    parser.add_argument("--tasks", type=int, default=20000, help="tareas a generar si la base de datos está vacía")
+    parser.add_argument("--verbose", action="store_true", help="muestra todas las consultas y su plan")
+    args = parser.parse_args(argv)
+
+    db = pool.acquire()
+    try:
+        upgrade(db)
+        if is_empty(db):
+            seed(db, tasks=args.tasks)
+        cursor = db.cursor()
+        # Estadísticas actualizadas para que el optimizador elija el plan que tendría en producción
+        if DB_BACKEND == "sqlite":
+            cursor.execute("ANALYZE")
+        else:
+            cursor.execute("ANALYZE TABLE users, projects, tasks, milestones, project_team")
+            cursor.fetchall()
+        cursor.execute("SELECT MIN(id), MIN(user_id), MIN(project_id), MAX(project_id) FROM tasks")
+        task, user, project, project2 = cursor.fetchone()
+        cursor.close()
+
+        queries = capture_queries({"task": task, "user": user, "project": project, "project2": project2})
+        if args.verbose:
+            for sql, params in queries.items():
+                print(sql if DB_BACKEND != "sqlite" else to_sqlite(sql), params, full_scans(db, sql, params))
+        failures = check(db, queries)
+    finally:
+        db.close()
+
+    print(f"{len(queries)} consultas comprobadas")
+    for table, sql in failures:
+        print(f"RECORRIDO COMPLETO de {table}: {sql}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,113 @@
+import argparse
+import random
+import sys
+import time
+from datetime import date, timedelta
+from itertools import islice
+
+from db import pool
+from hashing import pwd_context
+from models.task import TASK_STATUSES
+from project_progress import reconcile
+from kanban import STATUS_COLUMNS, spaced_rank
+
+PROJECT_STATUSES = ("active", "completed", "on_hold")
+BATCH_SIZE = 1000
+# Vocabulario de los títulos para que las búsquedas de texto tengan resultados de tamaño realista
+TITLE_WORDS = ("informe", "revisión", "factura", "diseño", "despliegue", "migración", "pruebas", "reunión",
+               "presupuesto", "contrato", "soporte", "incidencia", "documentación", "cliente", "entrega")
+# Tamaños de referencia para que los resultados de distintas ejecuciones sean comparables
+SCALES = {"10k": 10_000, "1m": 1_000_000, "10m": 10_000_000}
+# Todos los usuarios generados (user0, user1, ...) comparten esta contraseña; sus API Keys son bench-key-<n>
+BENCH_PASSWORD = "bench"
+
+
+def _insert(db, sql, rows):
+    # rows puede ser un generador: se inserta por lotes sin materializar millones de filas
+    cursor = db.cursor()
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, BATCH_SIZE))
+        if not batch:
+            break
+        cursor.executemany(sql, batch)
+        db.commit()
+    cursor.close()
+
+
+def _ids(db, table):
+    cursor = db.cursor()
+    cursor.execute(f"SELECT id FROM {table} ORDER BY id")
+    ids = [row[0] for row in cursor.fetchall()]
+    cursor.close()
+    return ids
+
+
+def is_empty(db):
+    cursor = db.cursor()
+    cursor.execute("SELECT COUNT(*) FROM tasks")
+    count = cursor.fetchone()[0]
+    cursor.close()
+    return count == 0
+
+
+def seed(db, tasks=10000, projects=None, users=None, rng_seed=42):
+    # Datos deterministas: con la misma semilla se generan las mismas filas en cada ejecución
+    rng = random.Random(rng_seed)
+    projects = projects or max(10, tasks // 100)
+    users = users or max(10, tasks // 200)
+    # Fecha fija para que la distribución de fechas no dependa del día en que se genera
+    today = date(2024, 1, 1)
+    password_hash = pwd_context.hash(BENCH_PASSWORD)
+
+    _insert(db, "INSERT INTO users (username, password_hash, email, role) VALUES (%s, %s, %s, %s)",
+            [(f"user{i}", password_hash, f"user{i}@example.com", "admin" if i == 0 else "user") for i in range(users)])
+    _insert(db, "INSERT INTO projects (name, clientName, startDate, endDate, status) VALUES (%s, %s, %s, %s, %s)",
+            [(f"Proyecto {i}", f"Cliente {i % 50}", today - timedelta(days=rng.randint(0, 365)),
+              today + timedelta(days=rng.randint(0, 365)), rng.choice(PROJECT_STATUSES))
+             for i in range(projects)])
+    _insert(db, "INSERT INTO team_members (name) VALUES (%s)", [(f"Miembro {i}",) for i in range(users)])
+
+    user_ids = _ids(db, "users")
+    _insert(db, "INSERT INTO api_keys (user_id, name, api_key) VALUES (%s, %s, %s)",
+            [(user_id, f"bench {i}", f"bench-key-{i}") for i, user_id in enumerate(user_ids)])
+    project_ids = _ids(db, "projects")
+    member_ids = _ids(db, "team_members")
+    _insert(db, "INSERT INTO project_team (project_id, team_member_id) VALUES (%s, %s)",
+            [(p, m) for p in project_ids for m in rng.sample(member_ids, min(3, len(member_ids)))])
+    _insert(db, "INSERT INTO milestones (projectId, title, date) VALUES (%s, %s, %s)",
+            [(p, f"Hito {i}", today + timedelta(days=rng.randint(-90, 180))) for p in project_ids for i in range(3)])
+    # Claves de orden crecientes con i: dentro de cada columna del tablero quedan en orden de creación
+    _insert(db, "INSERT INTO tasks (user_id, project_id, title, status, due_date, time_spent, time_estimate, kanban_column, rank_key) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)",
+            ((rng.choice(user_ids), rng.choice(project_ids), f"Tarea {i} {rng.choice(TITLE_WORDS)} {rng.choice(TITLE_WORDS)}", status,
+              today + timedelta(days=rng.randint(-180, 180)) if rng.random() < 0.9 else None,
+              rng.randint(0, 600), rng.choice((None, 60, 120, 480)), STATUS_COLUMNS.get(status, "todo"), spaced_rank(i, tasks))
+             for i, status in ((i, rng.choice(TASK_STATUSES)) for i in range(tasks))))
+    # Las tareas se insertan directamente, sin pasar por la API: los contadores se calculan al final
+    reconcile(db)
+    return {"users": len(user_ids), "projects": len(project_ids), "tasks": tasks}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Genera datos de prueba en una base de datos local vacía")
+    size = parser.add_mutually_exclusive_group()
+    size.add_argument("--scale", choices=SCALES, default="10k", help="tamaño de referencia")
+    size.add_argument("--tasks", type=int, help="número de tareas exacto")
+    parser.add_argument("--seed", type=int, default=42, help="semilla del generador aleatorio")
+    args = parser.parse_args(argv)
+
+    db = pool.acquire()
+    try:
+        if not is_empty(db):
+            print("La tabla tasks ya tiene datos; usa una base de datos vacía")
+            return 1
+        start = time.perf_counter()
+        counts = seed(db, tasks=args.tasks or SCALES[args.scale], rng_seed=args.seed)
+        print(f"{counts} en {time.perf_counter() - start:.1f} s")
+    finally:
+        db.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,74 @@
+import re
+from typing import Any, Dict, List, Optional
+
+from fastapi import HTTPException, Query
+from pydantic import BaseModel
+
+from pagination import DEFAULT_LIMIT, MAX_LIMIT, Filters, parse_fields
+
+# Columnas indexadas por tabla: FULLTEXT en MySQL y tabla FTS5 <tabla>_fts en SQLite (migraciones 16 y 17)
+SEARCH_COLUMNS = {
+    "tasks": ("title", "description"),
+    "projects": ("name", "description", "clientName"),
+}
+# La relevancia no permite paginar por id: se pagina con offset hasta este límite
+SEARCH_MAX_OFFSET = 1000
+SEARCH_MAX_TERMS = 10
+TERM_RE = re.compile(r"\w+")
+
+
+class SearchPage(BaseModel):
+    items: List[Dict[str, Any]]
+    # offset de la página siguiente; None si no hay más resultados
+    next_offset: Optional[int] = None
+    limit: int
+
+
+class SearchParams:
+    def __init__(
+        self,
+        q: str = Query(..., min_length=1, description="palabras a buscar; cada una se busca también como prefijo"),
+        limit: int = Query(DEFAULT_LIMIT, ge=1, le=MAX_LIMIT),
+        offset: int = Query(0, ge=0, le=SEARCH_MAX_OFFSET),
+        fields: Optional[str] = Query(None, description="columnas a devolver separadas por comas"),
+    ):
+        self.q = q
+        self.limit = limit
+        self.offset = offset
+        self.fields = fields
+
+
+def parse_terms(q):
+    # Solo letras y dígitos: los operadores de cada motor (+ - * " ...) nunca llegan desde el cliente
+    terms = list(dict.fromkeys(TERM_RE.findall(q.lower())))[:SEARCH_MAX_TERMS]
+    if not terms:
+        raise HTTPException(status_code=400, detail="La búsqueda debe contener al menos una palabra")
+    return terms
+
+
+def match_clause(db, table, terms):
+    # (origen, expresión de relevancia, condición, parámetros de la expresión, parámetros de la condición)
+    if db.backend == "sqlite":
+        fts = f"{table}_fts"
+        query = " AND ".join(f'"{term}"*' for term in terms)
+        return f"{fts} JOIN {table} ON {table}.id = {fts}.rowid", f"-bm25({fts})", f"{fts} MATCH %s", [], [query]
+    # Modo booleano: todas las palabras obligatorias y como prefijo; MySQL calcula MATCH una sola vez
+    query = " ".join(f"+{term}*" for term in terms)
+    match = f"MATCH({', '.join(SEARCH_COLUMNS[table])}) AGAINST (%s IN BOOLEAN MODE)"
+    return table, match, match, [query], [query]
+
+
+async def search(db, table, model, filters: Filters, params: SearchParams):
+    # Los filtros deben usar columnas con el nombre de la tabla delante (en SQLite se une con <tabla>_fts)
+    columns = [f"{table}.{column}" for column in parse_fields(params.fields, model)]
+    source, score, condition, score_params, condition_params = match_clause(db, table, parse_terms(params.q))
+    where = " AND ".join([condition] + filters.clauses)
+    rows = await db.fetch_all(
+        f"SELECT {', '.join(columns)}, {score} AS score FROM {source} WHERE {where} "
+        f"ORDER BY score DESC, {table}.id DESC LIMIT %s OFFSET %s",
+        tuple(score_params + condition_params + filters.params) + (params.limit + 1, params.offset),
+    )
+    next_offset = params.offset + params.limit if len(rows) > params.limit else None
+    if next_offset is not None and next_offset > SEARCH_MAX_OFFSET:
+        next_offset = None
+    return SearchPage.model_construct(items=rows[:params.limit], next_offset=next_offset, limit=params.limit)
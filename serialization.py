@@ -0,0 +1,38 @@
+import json
+from datetime import date, datetime
+from decimal import Decimal
+
+from fastapi.responses import Response
+from pydantic import BaseModel
+
+try:
+    import orjson
+except ImportError:
+    # orjson es opcional: sin él se usa el módulo json con el mismo formato de salida
+    orjson = None
+
+
+def json_default(value):
+    if isinstance(value, BaseModel):
+        # Volcado superficial: los modelos anidados vuelven a pasar por aquí (los modelos no usan alias)
+        return dict(value)
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"Tipo no serializable: {type(value).__name__}")
+
+
+def dumps(value) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(value, default=json_default)
+    return json.dumps(value, default=json_default, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+class FastJSONResponse(Response):
+    # Serializa directamente las filas de la base de datos, sin volver a validarlas contra response_model.
+    # Solo para datos de confianza leídos de la base de datos, nunca para contenido enviado por el cliente.
+    media_type = "application/json"
+
+    def render(self, content) -> bytes:
+        return dumps(content)